@@ -0,0 +1,151 @@
+from fastapi import HTTPException
+from .domain import Trader
+
+# Locks of the account service, a trader's balances are guarded by the one at their position modulo it
+LOCK_STRIPES = 64
+
+
+class Accounts:
+    """Moves traders' cash for the matching engine.
+
+    By default balances live on the `Trader` objects. In sharded mode (see `backend/sharding.py`)
+    they live in the account service instead: reservations are checked there right away, and
+    the other changes are queued and sent to it in one call per command by `commit`.
+    """
+
+    def __init__(self):
+        self.service = None
+        self._pending = []  # (trader_id, money change, reserved funds change)
+
+    def reserve(self, trader: Trader, cost: float):
+        """Reserves funds for a buy order, if the trader's available money (excluding reserved funds) covers them."""
+        if self.service is not None:
+            reserved = self.service.reserve(trader.id, cost)
+        else:
+            reserved = trader.money - trader.reserved_funds >= cost
+            if reserved:
+                trader.reserved_funds += cost
+
+        if not reserved:
+            raise HTTPException(status_code=400, detail="Not enough money to place the buy order.")
+
+    def release(self, trader: Trader, cost: float):
+        """Releases funds reserved for a buy order that was cancelled or replaced."""
+        if self.service is not None:
+            self._pending.append((trader.id, 0.0, -cost))
+        else:
+            trader.reserved_funds -= cost
+
+    def settle(self, buyer: Trader, seller: Trader, trade_cost: float, reserved_cost: float):
+        """Pays the seller for a trade, releasing the buyer's funds reserved for it at the buy order's price."""
+        if self.service is not None:
+            self._pending.append((buyer.id, -trade_cost, -reserved_cost))
+            self._pending.append((seller.id, trade_cost, 0.0))
+        else:
+            buyer.reserved_funds -= reserved_cost
+            buyer.money -= trade_cost
+            seller.money += trade_cost
+
+    def commit(self):
+        """Sends the queued changes to the account service."""
+        if self._pending:
+            changes, self._pending = self._pending, []
+            self.service.apply(changes)
+
+
+class AccountService:
+    """Cash balances shared by all engine processes in sharded mode.
+
+    The balances live in a shared-memory region as a pair of floats per trader, their money
+    and reserved funds, at the trader's position in `trader_order`. Every process adds traders
+    to it in the same order. Each process reads and changes the balances in place, holding one
+    of LOCK_STRIPES locks picked by the trader's position, so a reservation takes microseconds
+    and engine processes only wait for each other on the same stripe.
+    """
+
+    def __init__(self, region, locks: list, trader_order: list):
+        self.region = region
+        self.capacity = region.size // 16
+        self._values = region.buf.cast("d")  # money and reserved funds of each position in turn
+        self._locks = locks
+        self._trader_order = trader_order
+        self._slots = {}  # trader_id -> position
+        self._opened = 0  # Positions whose balances were written by `add`
+        self._sync()
+
+    def _sync(self):
+        # Traders added to `trader_order` since the last lookup
+        slots = self._slots
+        for position in range(len(slots), len(self._trader_order)):
+            slots[self._trader_order[position]] = position
+
+    def _slot(self, trader_id: str):
+        slot = self._slots.get(trader_id)
+        if slot is None:
+            self._sync()
+            slot = self._slots.get(trader_id)
+        return slot
+
+    def reserve(self, trader_id: str, cost: float):
+        """Reserves funds if the trader's available money covers them. Returns whether it did."""
+        slot = self._slot(trader_id)
+        values = self._values
+        with self._locks[slot % LOCK_STRIPES]:
+            if values[2 * slot] - values[2 * slot + 1] < cost:
+                return False
+            values[2 * slot + 1] += cost
+            return True
+
+    def apply(self, changes: list):
+        """Applies (trader_id, money change, reserved funds change) triples."""
+        values = self._values
+        for trader_id, money, reserved_funds in changes:
+            slot = self._slot(trader_id)
+            with self._locks[slot % LOCK_STRIPES]:
+                values[2 * slot] += money
+                values[2 * slot + 1] += reserved_funds
+
+    def add(self, balances: dict):
+        """Writes the {trader_id: (money, reserved_funds)} balances of the traders added to `trader_order` since the last call.
+
+        Only the process that created the region calls it, before the engine processes learn of the traders.
+        """
+        self._sync()
+        self.check_capacity(0)
+        values = self._values
+        for position in range(self._opened, len(self._trader_order)):
+            values[2 * position], values[2 * position + 1] = balances.get(self._trader_order[position], (0.0, 0.0))
+        self._opened = len(self._trader_order)
+
+    def check_capacity(self, count: int):
+        """Raises a 507 if `count` more accounts wouldn't fit."""
+        if len(self._trader_order) + count > self.capacity:
+            raise HTTPException(status_code=507, detail="The account service is full, restart with a larger ACCOUNT_CAPACITY.")
+
+    def balance(self, trader_id: str):
+        """Returns the trader's (money, reserved_funds), or None for an unknown trader."""
+        slot = self._slot(trader_id)
+        if slot is None:
+            return None
+        with self._locks[slot % LOCK_STRIPES]:
+            return self._values[2 * slot], self._values[2 * slot + 1]
+
+    def balances(self, trader_ids=None):
+        """Returns every trader's (money, reserved_funds), or only those of the given traders."""
+        if trader_ids is not None:
+            return {trader_id: self.balance(trader_id) for trader_id in trader_ids}
+        self._sync()
+        count = len(self._trader_order)
+        # Holding every stripe, so no trader's balance is read halfway through a change
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            values = self._values[:2 * count].tolist()
+        finally:
+            for lock in self._locks:
+                lock.release()
+        return {trader_id: (values[2 * position], values[2 * position + 1]) for position, trader_id in enumerate(self._trader_order[:count])}
+
+    def close(self):
+        self._values.release()
+        self.region.close()
@@ -0,0 +1,138 @@
+from fastapi import HTTPException
+from .config import METRICS_ENABLED
+from . import metrics
+import math
+import time
+
+
+class TokenBucket:
+    """Allows `rate` events per second on average, and bursts of up to `burst` events."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, count: int):
+        """Returns the seconds until `count` tokens are available, 0 if they are now. `count` can't exceed the burst."""
+        return max(0.0, (count - self.tokens) / self.rate)
+
+
+class AdmissionControl:
+    """Rejects orders up front when the engine is saturated, instead of queueing them.
+
+    An order is admitted while fewer than `max_in_flight` orders, and fewer than
+    `max_in_flight_per_stock` orders for its stock, are queued or running, and while its
+    trader's token bucket has a token left. Rejections raise a 429 with a Retry-After, so
+    clients back off and the event loop stays free to serve reads. A batch larger than a
+    limit could never be admitted, so it's refused with a 413 and no Retry-After instead.
+    A limit of 0 disables it.
+    """
+
+    def __init__(self, max_in_flight: int, max_in_flight_per_stock: int, trader_rate: float, trader_burst: float):
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_stock = max_in_flight_per_stock
+        self.trader_rate = trader_rate
+        self.trader_burst = trader_burst
+        self.in_flight = 0
+        self.stock_in_flight = {}  # stock_id -> orders queued or running
+        self.rejections = {"in_flight": 0, "stock_in_flight": 0, "rate_limit": 0, "too_large": 0}
+        self._buckets = {}  # trader_id -> TokenBucket
+        self._bucket_limit = 1024  # Number of buckets kept before dropping the full ones
+
+    def _drop_full_buckets(self, now: float):
+        # A full bucket is the same as a new one, so only traders still limited need theirs
+        for trader_id, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self._buckets[trader_id]
+        self._bucket_limit = max(1024, 2 * len(self._buckets))
+
+    def _reject(self, reason: str, detail: str, retry_after: float = None):
+        """Raises a 429 telling the client when to retry, or a 413 without `retry_after` for orders that can never be admitted."""
+        self.rejections[reason] += 1
+        if METRICS_ENABLED:
+            metrics.orders_rejected.inc((reason,))
+        if retry_after is None:
+            raise HTTPException(status_code=413, detail=detail)
+        raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+    def admit(self, orders: list):
+        """Admits (trader_id, stock_id) orders submitted together, all or none of them.
+
+        Raises a 429 if any limit would be exceeded, or a 413 if the orders exceed a limit
+        on their own. Admitted orders count as in flight until they are `release`d.
+        """
+        stock_counts = {}
+        trader_counts = {}
+        for trader_id, stock_id in orders:
+            stock_counts[stock_id] = stock_counts.get(stock_id, 0) + 1
+            trader_counts[trader_id] = trader_counts.get(trader_id, 0) + 1
+
+        # Orders no amount of waiting would make room for, the client has to split them
+        if self.max_in_flight and len(orders) > self.max_in_flight:
+            self._reject("too_large", f"At most {self.max_in_flight} orders can be in flight at once, split the batch.")
+        if self.max_in_flight_per_stock and max(stock_counts.values(), default=0) > self.max_in_flight_per_stock:
+            self._reject("too_large", f"At most {self.max_in_flight_per_stock} orders for a stock can be in flight at once, split the batch.")
+        if self.trader_rate and max(trader_counts.values(), default=0) > self.trader_burst:
+            self._reject("too_large", f"At most {self.trader_burst:g} orders of a trader are admitted at once, split the batch.")
+
+        if self.max_in_flight and self.in_flight + len(orders) > self.max_in_flight:
+            self._reject("in_flight", "Too many orders in flight, retry later.", 1)
+        if self.max_in_flight_per_stock:
+            for stock_id, count in stock_counts.items():
+                if self.stock_in_flight.get(stock_id, 0) + count > self.max_in_flight_per_stock:
+                    self._reject("stock_in_flight", f"Too many orders in flight for stock {stock_id}, retry later.", 1)
+
+        if self.trader_rate:
+            now = time.monotonic()
+            buckets = []
+            for trader_id, count in trader_counts.items():
+                bucket = self._buckets.get(trader_id)
+                if bucket is None:
+                    if len(self._buckets) >= self._bucket_limit:
+                        self._drop_full_buckets(now)
+                    bucket = self._buckets[trader_id] = TokenBucket(self.trader_rate, self.trader_burst, now)
+                bucket.refill(now)
+                wait_time = bucket.wait_time(count)
+                if wait_time:
+                    self._reject("rate_limit", f"Order rate limit exceeded for trader {trader_id}.", wait_time)
+                buckets.append((bucket, count))
+            # Tokens are only taken once every trader has enough
+            for bucket, count in buckets:
+                bucket.tokens -= count
+
+        self.in_flight += len(orders)
+        for stock_id, count in stock_counts.items():
+            self.stock_in_flight[stock_id] = self.stock_in_flight.get(stock_id, 0) + count
+
+    def release(self, orders: list):
+        """Marks admitted (trader_id, stock_id) orders as done."""
+        self.in_flight -= len(orders)
+        for _, stock_id in orders:
+            remaining = self.stock_in_flight[stock_id] - 1
+            if remaining:
+                self.stock_in_flight[stock_id] = remaining
+            else:
+                del self.stock_in_flight[stock_id]
+
+    def status(self):
+        """Returns the limits, the orders in flight and the rejection counts."""
+        return {
+            "limits": {
+                "max_in_flight": self.max_in_flight,
+                "max_in_flight_per_stock": self.max_in_flight_per_stock,
+                "trader_rate": self.trader_rate,
+                "trader_burst": self.trader_burst,
+            },
+            "in_flight": self.in_flight,
+            "stock_in_flight": dict(self.stock_in_flight),
+            "rejections": dict(self.rejections),
+        }
@@ -0,0 +1,150 @@
+from array import array
+import datetime
+
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def to_microseconds(timestamp: datetime.datetime):
+    """Returns a timestamp as microseconds since the epoch, the unit the trade log stores."""
+    return (timestamp - EPOCH) // MICROSECOND
+
+
+# Bar intervals in microseconds
+CANDLE_INTERVALS = {"1s": 1_000_000, "1m": 60_000_000, "5m": 300_000_000, "1h": 3_600_000_000}
+
+
+class CandleSeries:
+    """OHLCV bars of one stock at one interval, kept in arrays used as a ring buffer of up to `capacity` bars.
+
+    Bars are addressed by an ever increasing index, and only intervals with at least one
+    tick get a bar. The arrays grow as bars are started until they hold `capacity` bars, so
+    coarse intervals only take the memory of the bars they have.
+    """
+
+    def __init__(self, interval: int, capacity: int, size: int = 0):
+        self.interval = interval
+        self.capacity = capacity
+        self.count = 0  # Total number of bars started, the index of the next bar
+        self.starts = array("q", [0]) * size  # Microseconds since the epoch
+        self.opens = array("d", [0.0]) * size
+        self.highs = array("d", [0.0]) * size
+        self.lows = array("d", [0.0]) * size
+        self.closes = array("d", [0.0]) * size
+        self.volumes = array("q", [0]) * size
+
+    def add(self, timestamp: int, price: float, volume: int):
+        """Adds a tick at `timestamp` (microseconds since the epoch) to its bar."""
+        start = timestamp - timestamp % self.interval
+        if self.count:
+            slot = (self.count - 1) % self.capacity
+            # Ticks are added in time order, a late one is counted in the latest bar
+            if start <= self.starts[slot]:
+                if price > self.highs[slot]:
+                    self.highs[slot] = price
+                if price < self.lows[slot]:
+                    self.lows[slot] = price
+                self.closes[slot] = price
+                self.volumes[slot] += volume
+                return
+
+        slot = self.count % self.capacity
+        if slot == len(self.starts):
+            # Not full yet
+            for column in self._columns():
+                column.append(0)
+        self.starts[slot] = start
+        self.opens[slot] = self.highs[slot] = self.lows[slot] = self.closes[slot] = price
+        self.volumes[slot] = volume
+        self.count += 1
+
+    def _first_index(self, start: int):
+        # Binary search for the first kept bar starting at or after `start`, bar starts are ascending
+        low, high = max(0, self.count - self.capacity), self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.starts[middle % self.capacity] < start:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def bars(self, start: int, end: int):
+        """Returns the kept bars starting in [start, end), oldest first."""
+        bars = []
+        for index in range(self._first_index(start), self.count):
+            slot = index % self.capacity
+            if self.starts[slot] >= end:
+                break
+            bars.append({
+                "start": EPOCH + self.starts[slot] * MICROSECOND,
+                "open": self.opens[slot],
+                "high": self.highs[slot],
+                "low": self.lows[slot],
+                "close": self.closes[slot],
+                "volume": self.volumes[slot],
+            })
+        return bars
+
+    def _columns(self):
+        return self.starts, self.opens, self.highs, self.lows, self.closes, self.volumes
+
+
+class Candles:
+    """OHLCV bars per stock at every interval in `CANDLE_INTERVALS`, updated in O(1) per tick."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        self._series = {}  # stock_id -> {interval name: CandleSeries}
+
+    def add(self, stock_id: str, timestamp: int, price: float, volume: int):
+        """Adds a trade, or a price change with no volume, at `timestamp` (microseconds since the epoch) to the stock's bars."""
+        series = self._series.get(stock_id)
+        if series is None:
+            series = self._series[stock_id] = {
+                name: CandleSeries(interval, self.capacity) for name, interval in CANDLE_INTERVALS.items()
+            }
+        for candle_series in series.values():
+            candle_series.add(timestamp, price, volume)
+
+    def bars(self, stock_id: str, interval: str, start: datetime.datetime = None, end: datetime.datetime = None):
+        """Returns the stock's kept bars at the interval starting between `start` (inclusive) and `end` (exclusive)."""
+        series = self._series.get(stock_id)
+        if series is None:
+            return []
+        start = 0 if start is None else to_microseconds(start)
+        end = 2 ** 63 - 1 if end is None else to_microseconds(end)
+        return series[interval].bars(start, end)
+
+    def snapshot(self):
+        """Returns the kept bars as plain data for a snapshot."""
+        return {
+            "capacity": self.capacity,
+            "series": {
+                stock_id: {
+                    name: (candle_series.count, [column.tobytes() for column in candle_series._columns()])
+                    for name, candle_series in series.items()
+                }
+                for stock_id, series in self._series.items()
+            },
+        }
+
+    def restore(self, state: dict):
+        """Replaces the bars with a snapshot taken by `snapshot`, the capacity may have changed."""
+        self.clear()
+        capacity = state["capacity"]
+        for stock_id, saved_series in state["series"].items():
+            series = self._series[stock_id] = {}
+            for name, (count, saved_columns) in saved_series.items():
+                # The bars still held are renumbered from 0, so a larger capacity has no empty slots before them
+                first = max(0, count - capacity, count - self.capacity)
+                candle_series = series[name] = CandleSeries(CANDLE_INTERVALS[name], self.capacity, count - first)
+                candle_series.count = count - first
+                for column, data in zip(candle_series._columns(), saved_columns):
+                    saved = array(column.typecode)
+                    saved.frombytes(data)
+                    for index in range(first, count):
+                        column[index - first] = saved[index % capacity]
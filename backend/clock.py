@@ -0,0 +1,49 @@
+from collections import deque
+import datetime
+
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+class Clock:
+    """Source of the timestamps the matching engine gives transactions.
+
+    It reads the system time by default, never going back if the system time is set back,
+    so transactions' timestamps follow their order. Replays switch it to a simulated time
+    that only moves when they advance it, and every reading moves it forward by a
+    microsecond, so transactions still get distinct and reproducible timestamps. Journal
+    recovery schedules the timestamps the replayed fills were journaled with, which are
+    returned first.
+    """
+
+    def __init__(self):
+        self.simulated_time = None
+        self._scheduled = deque()
+        self._last = datetime.datetime.min  # Latest system or scheduled time returned
+
+    def now(self):
+        if self._scheduled:
+            time = self._scheduled.popleft()
+            self._last = max(self._last, time)
+            return time
+        if self.simulated_time is None:
+            self._last = max(self._last, datetime.datetime.now())
+            return self._last
+        time = self.simulated_time
+        self.simulated_time += MICROSECOND
+        return time
+
+    def simulate(self, start: datetime.datetime):
+        """Switches to a simulated time starting at `start`."""
+        self.simulated_time = start
+
+    def advance_to(self, time: datetime.datetime):
+        """Moves the simulated time forward to `time`, it never moves back."""
+        if time > self.simulated_time:
+            self.simulated_time = time
+
+    def use_system_time(self):
+        self.simulated_time = None
+
+    def schedule(self, timestamps):
+        """Replaces the timestamps to return before reading the time again."""
+        self._scheduled = deque(timestamps)
@@ -0,0 +1,76 @@
+import os
+
+# Settings can be overridden through environment variables of the same name
+
+# Stocks and traders loaded on startup, a JSON file or a binary seed compiled by `python -m backend.seed`
+SEED_FILE = os.environ.get("SEED_FILE", "BurseJson.json")
+
+# Number of fills kept in the central trade log before the oldest ones are overwritten
+TRADE_LOG_CAPACITY = int(os.environ.get("TRADE_LOG_CAPACITY", 100_000))
+
+# Number of recent transactions kept per trader and per stock
+TRADER_HISTORY_SIZE = int(os.environ.get("TRADER_HISTORY_SIZE", 8))
+STOCK_HISTORY_SIZE = int(os.environ.get("STOCK_HISTORY_SIZE", 10))
+
+# Directory for the write-ahead journal and snapshots, journaling is disabled when empty
+JOURNAL_DIR = os.environ.get("JOURNAL_DIR", "")
+
+# Seconds the journal waits to collect records into one write and fsync (group commit)
+JOURNAL_FLUSH_INTERVAL = float(os.environ.get("JOURNAL_FLUSH_INTERVAL", 0.005))
+
+# Seconds between snapshots, recovery only replays the journal written since the last one
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", 300))
+
+# Number of sequencer shards stocks are spread over, and the number of commands each shard can queue
+SEQUENCER_SHARDS = int(os.environ.get("SEQUENCER_SHARDS", 8))
+SEQUENCER_QUEUE_SIZE = int(os.environ.get("SEQUENCER_QUEUE_SIZE", 1000))
+
+# Number of engine processes the stocks are partitioned over (sharded mode), 0 runs the engine in the web server process
+ENGINE_PROCESSES = int(os.environ.get("ENGINE_PROCESSES", 0))
+
+# Traders the account service has room for in sharded mode, at least twice the seeded traders (16 bytes each, only touched pages use memory)
+ACCOUNT_CAPACITY = int(os.environ.get("ACCOUNT_CAPACITY", 4_000_000))
+
+# Number of trade prints buffered per market-data subscriber before the oldest are dropped
+FEED_TRADE_BUFFER_SIZE = int(os.environ.get("FEED_TRADE_BUFFER_SIZE", 100))
+
+# Seconds between market events, the market model moving prices ("random_walk" or "sector_factor"),
+# the number of sectors of the "sector_factor" model and the seed of its random numbers (random when empty)
+MARKET_EVENT_INTERVAL = float(os.environ.get("MARKET_EVENT_INTERVAL", 60))
+MARKET_MODEL = os.environ.get("MARKET_MODEL", "random_walk")
+MARKET_SECTORS = int(os.environ.get("MARKET_SECTORS", 10))
+MARKET_SEED = int(os.environ["MARKET_SEED"]) if os.environ.get("MARKET_SEED") else None
+
+# Whether to record metrics for /metrics, instrumentation costs nothing when disabled
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "0") not in ("", "0")
+
+# Whether the order paths time their stages (see `backend/profiling.py`), and the seconds past which an
+# order is kept in the slow-order log, which holds the last SLOW_ORDER_LOG_SIZE of them
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") not in ("", "0")
+SLOW_ORDER_THRESHOLD = float(os.environ.get("SLOW_ORDER_THRESHOLD", 0.005))
+SLOW_ORDER_LOG_SIZE = int(os.environ.get("SLOW_ORDER_LOG_SIZE", 100))
+
+# Number of OHLCV bars kept per stock at each interval (1s, 1m, 5m and 1h)
+CANDLE_HISTORY_SIZE = int(os.environ.get("CANDLE_HISTORY_SIZE", 240))
+
+# Admission control for order entry, 0 disables a limit: orders queued or running at once, overall and per
+# stock, and each trader's sustained orders per second and burst. Orders over a limit get a 429 right away
+ORDER_IN_FLIGHT_LIMIT = int(os.environ.get("ORDER_IN_FLIGHT_LIMIT", 2000))
+STOCK_IN_FLIGHT_LIMIT = int(os.environ.get("STOCK_IN_FLIGHT_LIMIT", 200))
+TRADER_ORDER_RATE = float(os.environ.get("TRADER_ORDER_RATE", 1000))
+TRADER_ORDER_BURST = float(os.environ.get("TRADER_ORDER_BURST", 1000))
+
+# Directory of the trade-history archive every fill is appended to, the archive is disabled when empty,
+# and the number of fills per segment file. Without a journal, each start begins a new history
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "")
+ARCHIVE_SEGMENT_SIZE = int(os.environ.get("ARCHIVE_SEGMENT_SIZE", 1_000_000))
+
+# Read replicas: the name of the shared-memory region the primary publishes GET responses to (disabled when
+# empty), its size in bytes and the seconds between publishes. READ_REPLICA=1 runs read-only workers serving from it
+SHARED_STATE_NAME = os.environ.get("SHARED_STATE_NAME", "")
+SHARED_STATE_SIZE = int(os.environ.get("SHARED_STATE_SIZE", 256 * 1024 * 1024))
+SHARED_STATE_PUBLISH_INTERVAL = float(os.environ.get("SHARED_STATE_PUBLISH_INTERVAL", 0.05))
+READ_REPLICA = os.environ.get("READ_REPLICA", "0") not in ("", "0")
+
+# Number of records the bulk provisioning endpoints add at a time, trading continues between chunks
+PROVISIONING_CHUNK_SIZE = int(os.environ.get("PROVISIONING_CHUNK_SIZE", 10_000))
@@ -1,86 +1,305 @@
-import json
-from .models import Trader, Stock, Order
-import random
+from .domain import Trader, Stock, Order
+from .order_book import OrderBook
+from .trade_log import TradeLog
+from .journal import Journal
+from .accounts import Accounts
+from .market_data import MarketDataFeed
+from .response_cache import ResponseCache
+from .clock import Clock
+from .candles import Candles, to_microseconds
+from .market_simulator import MarketSimulator, create_market_model
+from .portfolio import Portfolios, STOCK_MARKET_ID
+from .trade_archive import TradeArchive
+from .profiling import SlowOrderLog
+from .seed import read_seed
+from .config import SEED_FILE, TRADE_LOG_CAPACITY, TRADER_HISTORY_SIZE, STOCK_HISTORY_SIZE, FEED_TRADE_BUFFER_SIZE, CANDLE_HISTORY_SIZE, MARKET_EVENT_INTERVAL, MARKET_MODEL, MARKET_SECTORS, MARKET_SEED, METRICS_ENABLED, ARCHIVE_SEGMENT_SIZE, SLOW_ORDER_THRESHOLD, SLOW_ORDER_LOG_SIZE
+from . import metrics
 import asyncio
+import gc
+import time
 
 # In-memory database
 stocks_db = {}
 traders_db = {}
+# Trader IDs in the order they were added, the stable order `/traders` is paged in. Traders are never removed
+trader_order = []
+order_books = {}  # Mapping stock_id to the stock's order book
+trade_log = TradeLog(TRADE_LOG_CAPACITY, TRADER_HISTORY_SIZE, STOCK_HISTORY_SIZE)
+journal = Journal()
+accounts = Accounts()
+feed = MarketDataFeed(FEED_TRADE_BUFFER_SIZE)
+response_cache = ResponseCache()
+clock = Clock()
+candles = Candles(CANDLE_HISTORY_SIZE)
+market_simulator = MarketSimulator(create_market_model(MARKET_MODEL, MARKET_SECTORS), MARKET_SEED)
+portfolios = Portfolios()
+trade_archive = TradeArchive(ARCHIVE_SEGMENT_SIZE)  # Opened on startup when ARCHIVE_DIR is set
+slow_orders = SlowOrderLog(SLOW_ORDER_THRESHOLD, SLOW_ORDER_LOG_SIZE)  # Written to with PROFILING_ENABLED
 
-# Load data from JSON file
-def load_data():
-    global stocks_db, traders_db
-    with open("BurseJson.json", "r") as file:
-        data = json.load(file)
-
-        # Clear existing data while maintaining reference
-        stocks_db.clear()
-        traders_db.clear()
-
-        stocks_db.update({
-            stock["id"]: Stock(
-                id=stock["id"], 
-                name=stock["name"], 
-                current_price=stock["currentPrice"], 
-                amount=stock["amount"]
-            ) for stock in data["shares"]
-        })
-
-        traders_db.update({
-            trader["id"]: Trader(
-                id=trader["id"], 
-                name=trader["name"], 
-                money=trader["money"]
-            ) 
-            for trader in data["traders"]
-        })
-        
-        # Create the "Stock Market" trader
-        stock_market = Trader(
-            id="0", 
-            name="Stock Market", 
-            money=0.0,  
-            holdings={stock_id: stock.amount for stock_id, stock in stocks_db.items()}, 
-            sell_orders={
-                stock_id: Order(
-                    id=f"order_{stock_id}",
-                    trader_id="0",
-                    stock_id=stock_id,
-                    order_type="SELL",
-                    price=stock.current_price,
-                    amount=stock.amount
-                )
-                for stock_id, stock in stocks_db.items()
-            }
-        )
-
-        # Add the stock market trader to traders_db
-        traders_db["0"] = stock_market
-
-# Initialize data at startup
-load_data()
+# Number of stocks repriced by a market event before other tasks get to run
+MARKET_EVENT_BATCH_SIZE = 1000
+
+# Whether the seed file has been loaded, the server loads it once on startup
+data_loaded = False
+
+# Load the stocks and traders from a seed file, JSON or binary (see `backend/seed.py`)
+def load_data(path: str = SEED_FILE):
+    global stocks_db, traders_db, order_books, data_loaded
+    stocks, (trader_ids, trader_names, trader_money) = read_seed(path)
+
+    # Clear existing data while maintaining reference
+    stocks_db.clear()
+    traders_db.clear()
+    order_books.clear()
+    trade_log.clear()
+    candles.clear()
+    response_cache.clear()
+
+    stocks_db.update({
+        stock_id: Stock(id=stock_id, name=name, current_price=current_price, amount=amount)
+        for stock_id, name, current_price, amount in stocks
+    })
+
+    # Built from the columns in one pass, the seed can hold millions of traders. Creating that many
+    # objects would trigger repeated full garbage collections, which find nothing to free here
+    gc.disable()
+    try:
+        traders_db.update(zip(trader_ids, map(Trader, trader_ids, trader_names, trader_money)))
+    finally:
+        gc.enable()
+
+    # Create the "Stock Market" trader
+    stock_market = Trader(
+        id="0", 
+        name="Stock Market", 
+        money=0.0,  
+        holdings={stock_id: stock.amount for stock_id, stock in stocks_db.items()}, 
+        sell_orders={
+            stock_id: Order(
+                id=f"order_{stock_id}",
+                trader_id="0",
+                stock_id=stock_id,
+                order_type="SELL",
+                price=stock.current_price,
+                amount=stock.amount
+            )
+            for stock_id, stock in stocks_db.items()
+        }
+    )
+
+    # Add the stock market trader to traders_db
+    traders_db["0"] = stock_market
+    trader_order[:] = traders_db
+
+    # Create an order book per stock, seeded with the stock market's sell order
+    order_books.update({stock_id: OrderBook(stock_id) for stock_id in stocks_db})
+    for stock_id, sell_order in stock_market.sell_orders.items():
+        order_books[stock_id].add(sell_order)
+
+    portfolios.rebuild(stocks_db, traders_db)
+    # The seeded objects live as long as the server, keep them out of later collections
+    gc.freeze()
+    data_loaded = True
+
+def load_data_once():
+    """Loads the seed file, unless it has been loaded already."""
+    if not data_loaded:
+        load_data()
+
+def add_stocks(stocks: list):
+    """Adds (id, name, price, amount) stocks to the live market, skipping IDs that already exist.
+
+    Like the seeded stocks, the stock market holds all of a new stock's shares and offers them
+    at its price. Returns the number of stocks added.
+    """
+    stock_market = traders_db[STOCK_MARKET_ID]
+    added = []
+    for stock_id, name, current_price, amount in stocks:
+        if stock_id in stocks_db:
+            continue
+        stocks_db[stock_id] = Stock(id=stock_id, name=name, current_price=current_price, amount=amount)
+        stock_market.holdings[stock_id] = amount
+        book = order_books[stock_id] = OrderBook(stock_id)
+        if amount > 0:
+            # Journals from before stocks without shares were refused may hold some, they get no sell order
+            sell_order = stock_market.sell_orders[stock_id] = Order(
+                id=f"order_{stock_id}", trader_id=STOCK_MARKET_ID, stock_id=stock_id, order_type="SELL",
+                price=current_price, amount=amount
+            )
+            book.add(sell_order)
+        portfolios.add_stock(stock_id, current_price, {STOCK_MARKET_ID: amount})
+        response_cache.bump("stock", stock_id)
+        added.append((stock_id, name, current_price, amount))
+
+    if added:
+        response_cache.bump("trader", STOCK_MARKET_ID)
+        journal.append("STOCKS", stocks=added)
+    return len(added)
+
+def add_traders(trader_ids: list, trader_names: list, trader_money: list):
+    """Adds traders from columns of their IDs, names and money to the live market, skipping IDs that already exist.
+
+    Returns the number of traders added.
+    """
+    if not traders_db.keys().isdisjoint(trader_ids) or len(set(trader_ids)) != len(trader_ids):
+        # Keep the first of each new ID
+        columns = {}
+        for trader_id, name, money in zip(trader_ids, trader_names, trader_money):
+            if trader_id not in traders_db and trader_id not in columns:
+                columns[trader_id] = (name, money)
+        trader_ids = list(columns)
+        trader_names = [name for name, _ in columns.values()]
+        trader_money = [money for _, money in columns.values()]
+    if not trader_ids:
+        return 0
+
+    # As when loading the seed, nothing collectable is created here
+    gc.disable()
+    try:
+        traders_db.update(zip(trader_ids, map(Trader, trader_ids, trader_names, trader_money)))
+    finally:
+        gc.enable()
+    trader_order.extend(trader_ids)
+    portfolios.add_traders(trader_ids)
+    for trader_id in trader_ids:
+        response_cache.bump("trader", trader_id)
+    response_cache.bump("trader-names")
+    journal.append("TRADERS", ids=trader_ids, names=trader_names, money=trader_money)
+    return len(trader_ids)
+
+def apply_market_prices(stock_ids: list, prices: list, timestamp: int = None):
+    """Sets stocks' prices after a market event and reprices the stock market's sell orders in the same pass.
+
+    The event happens now, or at `timestamp` (microseconds since the epoch) when it is replayed.
+    """
+    sell_orders = traders_db["0"].sell_orders
+    if timestamp is None:
+        timestamp = to_microseconds(clock.now())
+    for stock_id, new_price in zip(stock_ids, prices):
+        stock = stocks_db[stock_id]
+        stock.current_price = new_price
+
+        sell_order = sell_orders.get(stock_id)
+        if sell_order:
+            # Re-queue the order at its new price level in the stock's order book
+            book = order_books[stock_id]
+            book.remove(sell_order)
+            sell_order.price = new_price  # Update the price to the current stock price
+            book.add(sell_order)
+
+        # Price changes count as ticks with no volume
+        candles.add(stock_id, timestamp, new_price, 0)
+        response_cache.bump("stock", stock_id)
+        if feed.has_subscribers(stock_id):
+            feed.publish_quote(stock_id, new_price, order_books[stock_id])
+
+    # Revalue the positions in the repriced stocks, touching only their holders
+    portfolios.set_prices(stock_ids, prices)
+
+    journal.append("PRICES", stock_ids=stock_ids, prices=prices, timestamp=timestamp)
+    response_cache.bump("trader", "0")
+
+def run_market_event():
+    """Moves every stock's price by a market event drawn by the market simulator."""
+    tick_start = time.perf_counter()
+    stock_ids, prices = market_simulator.next_prices(stocks_db)
+    apply_market_prices(stock_ids, prices.tolist())
+    if METRICS_ENABLED:
+        metrics.market_event_duration.observe(time.perf_counter() - tick_start)
 
 async def update_stock_prices():
     while True:
-        
-        for stock in stocks_db.values():
-            old_price = stock.current_price
-            
-            # Introduce a dynamic market impact factor
-            market_trend = random.choice([-1, 1])  # Simulate good/bad news
-            impact_factor = random.uniform(0.01, 0.05)  # 1% to 5% change
-            
-            # Calculate new price with more market influence
-            price_change = market_trend * impact_factor * stock.current_price
-            stock.current_price = max(1, round(old_price + price_change, 2))  
-
-        # Update the stock market's sell orders to match the new stock prices
-        stock_market = traders_db["0"]
-
-        # Update each sell order to reflect the new price
-        for stock_id, sell_order in stock_market.sell_orders.items():
-            stock = stocks_db.get(stock_id)
-            if stock:
-                sell_order.price = stock.current_price  # Update the price to the current stock price
-                    
-        await asyncio.sleep(60)  
+        tick_start = time.perf_counter()
+        stock_ids, prices = market_simulator.next_prices(stocks_db)
+        prices = prices.tolist()
+        duration = 0.0
+
+        # Apply the new prices in batches, letting orders run in between, so a large market doesn't stall the event loop
+        for start in range(0, len(stock_ids), MARKET_EVENT_BATCH_SIZE):
+            end = start + MARKET_EVENT_BATCH_SIZE
+            apply_market_prices(stock_ids[start:end], prices[start:end])
+            duration += time.perf_counter() - tick_start
+            await asyncio.sleep(0)
+            tick_start = time.perf_counter()
+
+        if METRICS_ENABLED:
+            # Time spent on the event, without the time other tasks ran in between batches
+            metrics.market_event_duration.observe(duration)
+
+        await asyncio.sleep(MARKET_EVENT_INTERVAL)
+
+def keep_stocks(stock_ids: set):
+    """Drops every other stock from the in-memory database, used by engine processes that own a subset of the stocks."""
+    stock_market = traders_db["0"]
+    for stock_id in list(stocks_db):
+        if stock_id not in stock_ids:
+            del stocks_db[stock_id]
+            del order_books[stock_id]
+            stock_market.holdings.pop(stock_id, None)
+            stock_market.sell_orders.pop(stock_id, None)
+    portfolios.rebuild(stocks_db, traders_db)
+
+
+def order_to_tuple(order: Order):
+    return (order.id, order.trader_id, order.stock_id, order.order_type, order.price, order.amount)
+
+def order_from_tuple(values: tuple):
+    order_id, trader_id, stock_id, order_type, price, amount = values
+    return Order(id=order_id, trader_id=trader_id, stock_id=stock_id, order_type=order_type, price=price, amount=amount)
+
+def snapshot_state():
+    """Returns the whole in-memory database as plain data for a snapshot."""
+    return {
+        "stocks": [(stock.id, stock.name, stock.current_price, stock.amount) for stock in stocks_db.values()],
+        "traders": [
+            (
+                trader.id, trader.name, trader.money, trader.reserved_funds, dict(trader.holdings),
+                [order_to_tuple(order) for order in trader.buy_orders.values()],
+                [order_to_tuple(order) for order in trader.sell_orders.values()],
+            )
+            for trader in traders_db.values()
+        ],
+        # Resting order IDs per stock in priority order, so re-adding them keeps each level's FIFO order
+        "books": {stock_id: [order.id for order in book.orders()] for stock_id, book in order_books.items()},
+        "trade_log": trade_log.snapshot(),
+        "candles": candles.snapshot(),
+        "portfolios": portfolios.snapshot(),
+    }
+
+def restore_state(state: dict):
+    """Replaces the in-memory database with a snapshot taken by `snapshot_state`."""
+    stocks_db.clear()
+    traders_db.clear()
+    order_books.clear()
+
+    for stock_id, name, current_price, amount in state["stocks"]:
+        stocks_db[stock_id] = Stock(id=stock_id, name=name, current_price=current_price, amount=amount)
+        order_books[stock_id] = OrderBook(stock_id)
+
+    orders = {}
+    for trader_id, name, money, reserved_funds, holdings, buy_orders, sell_orders in state["traders"]:
+        trader = Trader(id=trader_id, name=name, money=money, reserved_funds=reserved_funds, holdings=holdings)
+        for side, saved_orders in ((trader.buy_orders, buy_orders), (trader.sell_orders, sell_orders)):
+            for values in saved_orders:
+                order = order_from_tuple(values)
+                side[order.stock_id] = order
+                orders[order.id] = order
+        traders_db[trader_id] = trader
+    trader_order[:] = traders_db
+
+    for stock_id, order_ids in state["books"].items():
+        for order_id in order_ids:
+            order_books[stock_id].add(orders[order_id])
+
+    trade_log.restore(state["trade_log"])
+    if "candles" in state:
+        candles.restore(state["candles"])
+    else:
+        # Snapshots from older versions have no bars
+        candles.clear()
+    if "portfolios" in state:
+        portfolios.restore(state["portfolios"])
+    else:
+        # Older snapshots have no cost basis, the current prices are taken as the cost
+        portfolios.rebuild(stocks_db, traders_db)
+    response_cache.clear()
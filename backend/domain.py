@@ -0,0 +1,59 @@
+from . import models
+
+# Internal representations of the in-memory database used by the matching engine. They are
+# plain classes with `__slots__`, so creating and updating them skips pydantic's validation
+# and per-instance dicts. The pydantic models in `backend/models.py` are the API's response
+# schemas and are only built from these when a response needs them (`to_model`).
+
+
+class Stock:
+    __slots__ = ("id", "name", "current_price", "amount")
+
+    def __init__(self, id: str, name: str, current_price: float, amount: int):
+        self.id = id
+        self.name = name
+        self.current_price = current_price
+        self.amount = amount
+
+    def to_model(self):
+        return models.Stock(id=self.id, name=self.name, current_price=self.current_price, amount=self.amount)
+
+
+class Order:
+    __slots__ = ("id", "trader_id", "stock_id", "order_type", "price", "amount")
+
+    def __init__(self, id: str, trader_id: str, stock_id: str, order_type: str, price: float, amount: int):
+        self.id = id
+        self.trader_id = trader_id
+        self.stock_id = stock_id
+        self.order_type = order_type  # "BUY" or "SELL"
+        self.price = price
+        self.amount = amount
+
+    def to_model(self):
+        return models.Order(
+            id=self.id, trader_id=self.trader_id, stock_id=self.stock_id,
+            order_type=self.order_type, price=self.price, amount=self.amount
+        )
+
+
+class Trader:
+    __slots__ = ("id", "name", "money", "reserved_funds", "holdings", "buy_orders", "sell_orders")
+
+    def __init__(self, id: str, name: str, money: float, reserved_funds: float = 0.0, holdings: dict = None,
+                 buy_orders: dict = None, sell_orders: dict = None):
+        self.id = id
+        self.name = name
+        self.money = money
+        self.reserved_funds = reserved_funds
+        self.holdings = {} if holdings is None else holdings  # Mapping stock_id to quantity of shares owned
+        self.buy_orders = {} if buy_orders is None else buy_orders  # Mapping stock_id to buy orders
+        self.sell_orders = {} if sell_orders is None else sell_orders  # Mapping stock_id to sell orders
+
+    def to_model(self):
+        return models.Trader(
+            id=self.id, name=self.name, money=self.money, reserved_funds=self.reserved_funds,
+            holdings=dict(self.holdings),
+            buy_orders={stock_id: order.to_model() for stock_id, order in self.buy_orders.items()},
+            sell_orders={stock_id: order.to_model() for stock_id, order in self.sell_orders.items()},
+        )
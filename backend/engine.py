@@ -0,0 +1,487 @@
+from fastapi import HTTPException
+from .database import stocks_db, traders_db, order_books, trade_log, journal, accounts, feed, response_cache, clock, candles, portfolios, trade_archive, slow_orders, apply_market_prices, add_stocks, add_traders, snapshot_state, restore_state
+from .journal import load_latest_snapshot, read_records
+from .config import JOURNAL_FLUSH_INTERVAL, METRICS_ENABLED, PROFILING_ENABLED
+from . import metrics
+from .models import BatchOrder
+from .profiling import OrderSpan
+from .helpers import reserve_funds, create_buy_order, find_matching_sell_orders, fetch_and_validate_buy_order, create_and_update_transaction_in_buy_order, update_buyer_holdings, fetch_and_validate_sell_order, create_sell_order, find_matching_buy_orders, create_and_update_transaction_in_sell_order, rest_order, remove_resting_order, release_replaced_buy_order
+import datetime
+import itertools
+
+# Matching engine. These functions change the in-memory database and must only be called
+# by the sequencer (or during recovery), which runs them one at a time.
+
+def execute_buy_order(trader_id: str, stock_id: str, price: float, amount: int):
+    """Places a buy order, matching it against the stock's sell orders."""
+    span = OrderSpan("BUY") if PROFILING_ENABLED else None
+    # Fetch trader and stock and validate constraints
+    trader, stock = fetch_and_validate_buy_order(trader_id, stock_id, price, amount, traders_db, stocks_db)
+
+    # Validate the trader has enough available money, reserve funds and create the buy order
+    reserve_funds(accounts, trader, price, amount)
+    buy_order = create_buy_order(trader_id, stock_id, price, amount)
+
+    # Journal the accepted order, the fills it produces are journaled after matching
+    journal.append("BUY", trader_id=trader_id, stock_id=stock_id, price=price, amount=amount)
+    fills_from = trade_log.count
+    if span is not None:
+        span.mark("validate")
+
+    # The new buy order replaces the trader's previous buy order for the stock, if any
+    book = order_books[stock_id]
+    replaced_order = remove_resting_order(book, trader.buy_orders, stock_id)
+    release_replaced_buy_order(accounts, trader, replaced_order)
+    if span is not None:
+        span.mark("replace")
+    
+    # Get matched sell orders from the stock's order book
+    matched_sell_orders = find_matching_sell_orders(book, price, amount, traders_db)
+    if span is not None:
+        span.mark("match")
+
+    if matched_sell_orders:
+        for sell_order, seller in matched_sell_orders:
+            if sell_order.amount < amount:
+                # Full match, buyer purchases all shares from this sell order (E.g., buyer wants 10, seller has 5)
+                amount -= sell_order.amount
+                trade_cost = sell_order.amount * sell_order.price
+                
+                # Pay the seller from the buyer's reserved funds, and update the buyer's holdings
+                accounts.settle(trader, seller, trade_cost, sell_order.amount * price)
+                update_buyer_holdings(trader, stock_id, sell_order.amount)
+
+                # Update the seller's holdings
+                seller.holdings[stock_id] = seller.holdings.get(stock_id, 0) - sell_order.amount
+
+                # Create transaction and update buyer, seller, and stock transaction histories
+                create_and_update_transaction_in_buy_order(trader, seller, stock_id, sell_order, trade_cost, sell_order.amount, trade_log, clock)
+
+                # Remove stock holdings for seller if they become zero
+                if seller.holdings[stock_id] == 0:
+                    del seller.holdings[stock_id]
+
+                # Remove the completed sell order from the stock's order book
+                book.remove(sell_order)
+
+                # Sell order is fully completed, remove the completed sell order from the seller's open orders
+                sell_order.amount = 0  
+                seller.sell_orders.pop(stock_id, None)
+
+                # Update the seller in database and update stock price to the transaction price
+                traders_db[seller.id] = seller
+                stocks_db[stock_id].current_price = sell_order.price
+            else:
+                # Partial match, buyer buys only what they need (E.g., buyer wants 10 or less, seller has 10)
+                trade_cost = amount * sell_order.price
+                
+                # Pay the seller from the buyer's reserved funds, and update the buyer's holdings
+                accounts.settle(trader, seller, trade_cost, amount * price)
+                update_buyer_holdings(trader, stock_id, amount)
+
+                if sell_order.amount - amount == 0:
+                    # Remove the sell order since it's fully executed
+                    seller.sell_orders.pop(stock_id, None)
+                    # Remove the sell order from the stock's order book
+                    book.remove(sell_order)
+                
+                # Update sell order amount, and the amount resting at its price level
+                book.fill(sell_order, amount)
+
+                # Update the seller's holdings
+                seller.holdings[stock_id] = seller.holdings.get(stock_id, 0) - amount 
+                 
+                # Remove stock holdings for seller if they become zero
+                if seller.holdings[stock_id] == 0:
+                    del seller.holdings[stock_id]              
+                
+                # Create transaction and update buyer, seller, and stock transaction histories
+                create_and_update_transaction_in_buy_order(trader, seller, stock_id, sell_order, trade_cost, amount, trade_log, clock)
+
+                # The buy order is fully fulfilled
+                amount = 0  # Order fully filled
+
+                # Update the seller in database and Update stock price to the transaction price
+                traders_db[seller.id] = seller
+                stocks_db[stock_id].current_price = sell_order.price
+                break
+        if span is not None:
+            span.mark("fill")
+        
+        # If there are still shares left in the buy order, place it as an active buy order
+        if amount > 0:
+            buy_order.amount = amount       
+            # Add the buy order to the trader's open orders and the stock's order book
+            rest_order(book, trader.buy_orders, buy_order)
+    else:
+        # No matching sell orders, place the buy order in the stock's order book for future matching
+        rest_order(book, trader.buy_orders, buy_order)
+
+    # Update the buyer in the database
+    traders_db[trader.id] = trader
+    if span is not None:
+        span.mark("rest")
+    update_candles(stock_id, fills_from)
+    update_portfolios(stock_id, fills_from)
+    if METRICS_ENABLED:
+        record_order_metrics(stock_id, "BUY", len(matched_sell_orders), fills_from, amount > 0)
+    if span is not None:
+        span.mark("record")
+    journal_fills(fills_from)
+    archive_fills(fills_from)
+    if span is not None:
+        span.mark("journal")
+    bump_versions(trader_id, stock_id, fills_from)
+    publish_market_data(stock_id, fills_from)
+    if span is not None:
+        span.mark("publish")
+        slow_orders.finish(span, trader_id, stock_id, matched_sell_orders, trade_log.count - fills_from)
+    return {"message": "Buy order processed successfully", "buy_order": buy_order.to_model()}
+
+
+def execute_cancel_buy_order(trader_id: str, stock_id: str):
+    """Cancels a trader's buy order and releases its reserved funds."""
+    span = OrderSpan("CANCEL_BUY") if PROFILING_ENABLED else None
+    trader = traders_db.get(trader_id)
+    
+    if not trader or stock_id not in trader.buy_orders:
+        raise HTTPException(status_code=404, detail="Buy order not found.")
+    
+    # Retrieve the buy order and release the reserved funds
+    order = trader.buy_orders.pop(stock_id)
+    total_cost = order.price * order.amount
+    accounts.release(trader, total_cost)
+
+    # Update the trader in the database
+    traders_db[trader.id] = trader
+    if span is not None:
+        span.mark("validate")
+
+    # Remove the buy order from the stock's order book
+    order_books[stock_id].remove(order)
+    if span is not None:
+        span.mark("remove")
+    journal.append("CANCEL_BUY", trader_id=trader_id, stock_id=stock_id)
+    if METRICS_ENABLED:
+        metrics.orders_cancelled.inc((stock_id, "BUY"))
+    if span is not None:
+        span.mark("journal")
+    bump_versions(trader_id, stock_id, trade_log.count)
+    publish_market_data(stock_id, trade_log.count)
+    if span is not None:
+        span.mark("publish")
+        slow_orders.finish(span, trader_id, stock_id)
+    
+    return {"message": "Buy order cancelled successfully", "order": order.to_model()}  
+
+
+def execute_sell_order(trader_id: str, stock_id: str, price: float, amount: int):
+    """Places a sell order, matching it against the stock's buy orders."""
+    span = OrderSpan("SELL") if PROFILING_ENABLED else None
+    # Fetch trader and stock and validate constraints
+    trader, stock = fetch_and_validate_sell_order(trader_id, stock_id, price, amount, traders_db, stocks_db)
+    
+    # Journal the accepted order, the fills it produces are journaled after matching
+    journal.append("SELL", trader_id=trader_id, stock_id=stock_id, price=price, amount=amount)
+    fills_from = trade_log.count
+    if span is not None:
+        span.mark("validate")
+
+    # Create the sell order
+    sell_order = create_sell_order(trader_id, stock_id, price, amount)
+
+    # The new sell order replaces the trader's previous sell order for the stock, if any
+    book = order_books[stock_id]
+    remove_resting_order(book, trader.sell_orders, stock_id)
+    if span is not None:
+        span.mark("replace")
+
+    # Find matching buy orders in the stock's order book
+    matched_buy_orders = find_matching_buy_orders(book, price, amount, traders_db)
+    if span is not None:
+        span.mark("match")
+    
+    if matched_buy_orders:
+        for buy_order, buyer in matched_buy_orders:
+
+            if buy_order.amount < amount:
+                # Seller sells part of what he has (e.g., buyer wants 10, seller has 15)
+                amount -= buy_order.amount
+                trade_cost = buy_order.amount * buy_order.price
+                
+                # Update the seller's and buyer's holdings
+                buyer.holdings[stock_id] = buyer.holdings.get(stock_id, 0) + buy_order.amount
+                trader.holdings[stock_id] -= buy_order.amount
+
+                # Pay the seller from the buyer's reserved funds
+                accounts.settle(buyer, trader, trade_cost, trade_cost)
+                
+                # create transaction and update the seller's, buyer's, and stock's history
+                create_and_update_transaction_in_sell_order(trader, buyer, stock_id, buy_order, buy_order.amount, trade_cost, trade_log, clock)
+
+                # Remove the open buy order (which is now closed) from the stock's order book
+                book.remove(buy_order)
+
+                # Remove completed buy order, and update buyer in the database
+                buy_order.amount = 0
+                buyer.buy_orders.pop(stock_id, None)
+                traders_db[buyer.id] = buyer
+
+                # Update stock price to the transaction price
+                stocks_db[stock_id].current_price = buy_order.price
+
+            else:
+                # Seller sells everything he has (e.g., buyer wants 10, seller has 10 or less)
+                trade_cost = amount * buy_order.price
+                
+                # Update holdings
+                buyer.holdings[stock_id] = buyer.holdings.get(stock_id, 0) + amount
+                trader.holdings[stock_id] -= amount
+                
+                # Pay the seller from the buyer's reserved funds
+                accounts.settle(buyer, trader, trade_cost, trade_cost)
+
+                # Remove stock entry if holdings become zero
+                if trader.holdings[stock_id] == 0:
+                    del trader.holdings[stock_id]
+
+                if buy_order.amount - amount == 0:
+                    # Remove the buy order since it's fully executed
+                    buyer.buy_orders.pop(stock_id, None)   
+                    # Remove the buy order from the stock's order book
+                    book.remove(buy_order)
+
+                # Update buy order amount, and the amount resting at its price level
+                book.fill(buy_order, amount)
+
+                # Create transaction and update the seller's, buyer's, and stock's history
+                create_and_update_transaction_in_sell_order(trader, buyer, stock_id, buy_order, amount, trade_cost, trade_log, clock)
+
+                # The sell order is fully executed
+                amount = 0  # Order fully filled
+
+                # Update buyer in database
+                traders_db[buyer.id] = buyer
+
+                # Update stock price to the transaction price
+                stocks_db[stock_id].current_price = buy_order.price
+                break
+        if span is not None:
+            span.mark("fill")
+
+        # If there's any stock left unsold, keep it as an active sell order
+        if amount > 0:
+            sell_order.amount = amount       
+
+            # Add the sell order to the trader's open orders and the stock's order book
+            rest_order(book, trader.sell_orders, sell_order)
+    else:
+        # No matching buy orders, place the sell order in the stock's order book for future matching
+        rest_order(book, trader.sell_orders, sell_order)
+    
+    # Update the seller in the database
+    traders_db[trader.id] = trader
+    if span is not None:
+        span.mark("rest")
+    update_candles(stock_id, fills_from)
+    update_portfolios(stock_id, fills_from)
+    if METRICS_ENABLED:
+        record_order_metrics(stock_id, "SELL", len(matched_buy_orders), fills_from, amount > 0)
+    if span is not None:
+        span.mark("record")
+    journal_fills(fills_from)
+    archive_fills(fills_from)
+    if span is not None:
+        span.mark("journal")
+    bump_versions(trader_id, stock_id, fills_from)
+    publish_market_data(stock_id, fills_from)
+    if span is not None:
+        span.mark("publish")
+        slow_orders.finish(span, trader_id, stock_id, matched_buy_orders, trade_log.count - fills_from)
+    return {"message": "Sell order processed successfully", "sell_order": sell_order.to_model()}
+
+
+def execute_cancel_sell_order(trader_id: str, stock_id: str):
+    """Cancels a trader's sell order."""
+    span = OrderSpan("CANCEL_SELL") if PROFILING_ENABLED else None
+    trader = traders_db.get(trader_id)
+
+    if not trader or stock_id not in trader.sell_orders:
+        raise HTTPException(status_code=404, detail="Sell order not found.")
+
+    # Remove the sell order
+    sell_order = trader.sell_orders.pop(stock_id)
+
+    # Update the seller in the database
+    traders_db[trader.id] = trader
+    if span is not None:
+        span.mark("validate")
+
+    # Remove the sell order from the stock's order book
+    order_books[stock_id].remove(sell_order)
+    if span is not None:
+        span.mark("remove")
+    journal.append("CANCEL_SELL", trader_id=trader_id, stock_id=stock_id)
+    if METRICS_ENABLED:
+        metrics.orders_cancelled.inc((stock_id, "SELL"))
+    if span is not None:
+        span.mark("journal")
+    bump_versions(trader_id, stock_id, trade_log.count)
+    publish_market_data(stock_id, trade_log.count)
+    if span is not None:
+        span.mark("publish")
+        slow_orders.finish(span, trader_id, stock_id)
+
+    return {"message": "Sell order cancelled successfully", "order": sell_order.to_model()}
+
+
+def execute_batch_order(order: BatchOrder):
+    """Executes a single batch instruction and returns its result."""
+    if order.action in ("BUY", "SELL") and (order.price is None or order.amount is None):
+        raise HTTPException(status_code=400, detail="Price and amount are required for buy and sell orders.")
+
+    if order.action == "BUY":
+        return execute_buy_order(order.trader_id, order.stock_id, order.price, order.amount)
+    if order.action == "SELL":
+        return execute_sell_order(order.trader_id, order.stock_id, order.price, order.amount)
+    if order.action == "CANCEL_BUY":
+        return execute_cancel_buy_order(order.trader_id, order.stock_id)
+    if order.action == "CANCEL_SELL":
+        return execute_cancel_sell_order(order.trader_id, order.stock_id)
+
+    raise HTTPException(status_code=400, detail="Action must be BUY, SELL, CANCEL_BUY or CANCEL_SELL.")
+
+
+def execute_stock_orders(stock_orders: list):
+    """Executes a stock's batch instructions in order, returning (index, result) pairs."""
+    results = []
+    for index, order in stock_orders:
+        try:
+            results.append((index, {"status_code": 200, **execute_batch_order(order)}))
+        except HTTPException as error:
+            # A rejected instruction doesn't stop the rest of the batch
+            results.append((index, {"status_code": error.status_code, "detail": error.detail}))
+    return results
+
+def journal_fills(fills_from: int):
+    """Journals the fills recorded in the trade log since offset `fills_from`."""
+    if journal.enabled:
+        for offset in range(fills_from, trade_log.count):
+            journal.append("FILL", **trade_log.fill(offset))
+
+def archive_fills(fills_from: int):
+    """Appends the fills recorded in the trade log since offset `fills_from` to the trade archive."""
+    if trade_archive.enabled:
+        trade_archive.append(trade_log, fills_from)
+
+def update_candles(stock_id: str, fills_from: int):
+    """Adds the fills recorded since offset `fills_from` to the stock's OHLCV bars."""
+    for offset in range(fills_from, trade_log.count):
+        candles.add(stock_id, *trade_log.tick(offset))
+
+def update_portfolios(stock_id: str, fills_from: int):
+    """Moves the shares of the fills recorded since offset `fills_from` between positions and revalues the stock's holders."""
+    for offset in range(fills_from, trade_log.count):
+        buyer_id, seller_id = trade_log.participants(offset)
+        _, price, amount = trade_log.tick(offset)
+        portfolios.record_fill(stock_id, buyer_id, seller_id, price, amount)
+    portfolios.set_prices([stock_id], [stocks_db[stock_id].current_price])
+
+def record_order_metrics(stock_id: str, side: str, iterations: int, fills_from: int, rested: bool):
+    """Counts an order placed and the fills it produced since offset `fills_from`."""
+    labels = (stock_id, side)
+    metrics.orders_placed.inc(labels)
+    metrics.match_loop_iterations.observe(iterations)
+    fill_count = trade_log.count - fills_from
+    if fill_count:
+        metrics.fills.inc((stock_id,), fill_count)
+        (metrics.orders_partially_filled if rested else metrics.orders_filled).inc(labels)
+
+def bump_versions(trader_id: str, stock_id: str, fills_from: int):
+    """Marks the trader, the stock and the counterparties of the fills since offset `fills_from` as changed."""
+    response_cache.bump("trader", trader_id)
+    response_cache.bump("stock", stock_id)
+    for offset in range(fills_from, trade_log.count):
+        for participant_id in trade_log.participants(offset):
+            if participant_id != trader_id:
+                response_cache.bump("trader", participant_id)
+
+def publish_market_data(stock_id: str, fills_from: int):
+    """Publishes the fills recorded since offset `fills_from` and the stock's new top of book to the market-data feed."""
+    if feed.has_subscribers(stock_id):
+        for offset in range(fills_from, trade_log.count):
+            feed.publish_trade(trade_log.fill(offset))
+        feed.publish_quote(stock_id, stocks_db[stock_id].current_price, order_books[stock_id])
+
+def replay_record(record: dict):
+    """Applies a journal record to the in-memory database."""
+    record_type = record["type"]
+    if record_type == "BUY":
+        execute_buy_order(record["trader_id"], record["stock_id"], record["price"], record["amount"])
+    elif record_type == "SELL":
+        execute_sell_order(record["trader_id"], record["stock_id"], record["price"], record["amount"])
+    elif record_type == "CANCEL_BUY":
+        execute_cancel_buy_order(record["trader_id"], record["stock_id"])
+    elif record_type == "CANCEL_SELL":
+        execute_cancel_sell_order(record["trader_id"], record["stock_id"])
+    elif record_type == "PRICES":
+        apply_market_prices(record["stock_ids"], record["prices"], record.get("timestamp"))
+    elif record_type == "STOCKS":
+        add_stocks(record["stocks"])
+    elif record_type == "TRADERS":
+        add_traders(record["ids"], record["names"], record["money"])
+    elif record_type == "PRICE":
+        # Market events journaled one stock at a time by older versions
+        apply_market_prices([record["stock_id"]], [record["price"]])
+    elif record_type == "FILLS_START":
+        trade_log.start_at(record["offset"])
+    # Fills are produced again by replaying the orders, their records are only kept for auditing
+
+def transaction_timestamp(transaction_id: str):
+    """Returns the timestamp in a transaction ID (f"{stock_id}_{timestamp}")."""
+    return datetime.datetime.fromisoformat(transaction_id.rsplit("_", 1)[1])
+
+def replay_records(records):
+    """Replays journal records, giving the fills they produce the timestamps they were journaled with.
+
+    Returns the sequence number of the last record.
+    """
+    seq = None
+    pending = None  # The last record, applied once the fill records following it are read
+    fill_timestamps = []
+    for record in itertools.chain(records, [None]):
+        if record is not None:
+            seq = record["seq"]
+            if record["type"] == "FILL":
+                fill_timestamps.append(transaction_timestamp(record["id"]))
+                continue
+        if pending is not None:
+            clock.schedule(fill_timestamps)
+            replay_record(pending)
+            clock.schedule([])
+        pending, fill_timestamps = record, []
+    return seq
+
+def recover_from_journal(directory: str):
+    """Loads the latest snapshot, replays the journal written after it and starts journaling."""
+    seq, state = load_latest_snapshot(directory)
+    if state is not None:
+        restore_state(state)
+    last_seq = replay_records(read_records(directory, seq))
+    journal.open(directory, seq if last_seq is None else last_seq, JOURNAL_FLUSH_INTERVAL)
+
+def open_trade_archive(directory: str):
+    """Opens the trade archive, journaling where the trade log's offsets start if they now continue the archive's."""
+    first = trade_log.first
+    trade_archive.open(directory, trade_log)
+    if trade_log.first != first:
+        journal.append("FILLS_START", offset=trade_log.first)
+
+def take_snapshot():
+    """Captures a snapshot of the in-memory database and starts a new journal segment.
+
+    Returns the sequence number and state to pass to `journal.write_snapshot`.
+    """
+    state = snapshot_state()
+    seq = journal.rotate()
+    return seq, state
@@ -0,0 +1,162 @@
+import json
+import os
+import pickle
+import threading
+import time
+
+SEGMENT_PREFIX = "journal-"
+SNAPSHOT_PREFIX = "snapshot-"
+
+
+def _sequence_of(file_name: str, prefix: str):
+    """Returns the sequence number in a journal segment or snapshot file name."""
+    return int(file_name[len(prefix):].split(".")[0])
+
+
+def _files(directory: str, prefix: str):
+    """Returns (sequence, path) pairs for the journal segments or snapshots in a directory, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        (_sequence_of(name, prefix), os.path.join(directory, name))
+        for name in os.listdir(directory)
+        if name.startswith(prefix) and not name.endswith(".tmp")
+    )
+
+
+class Journal:
+    """Append-only journal of accepted orders, cancels, fills and market events.
+
+    Records are buffered in memory and a background thread writes and fsyncs them in
+    batches (group commit), so appending never waits for the disk. The journal is split
+    into segments, a new one starting every time a snapshot is taken.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.seq = 0  # Sequence number of the last appended record
+        self._file = None
+        self._buffer = []
+        self._lock = threading.Lock()  # Guards the sequence number and the buffer
+        self._io_lock = threading.Lock()  # Guards writes to the current segment
+        self._has_records = threading.Condition(self._lock)
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self._file is not None
+
+    def open(self, directory: str, seq: int, flush_interval: float):
+        """Starts a new journal segment after the record with sequence number `seq`."""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.seq = seq
+        self.flush_interval = flush_interval
+        self._file = self._open_segment(seq + 1)
+
+        self._thread = threading.Thread(target=self._flush_loop, name="journal-flush", daemon=True)
+        self._thread.start()
+
+    def _open_segment(self, first_seq: int):
+        return open(os.path.join(self.directory, f"{SEGMENT_PREFIX}{first_seq:012d}.log"), "ab")
+
+    def append(self, record_type: str, **fields):
+        """Appends a record to the journal and returns its sequence number."""
+        with self._lock:
+            if self._file is None:
+                return None
+            self.seq += 1
+            record = {"seq": self.seq, "type": record_type, **fields}
+            self._buffer.append(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+            self._has_records.notify()
+            return self.seq
+
+    def _take_buffer(self):
+        batch, self._buffer = self._buffer, []
+        return batch
+
+    def _write(self, file, batch):
+        if batch:
+            file.write(b"".join(batch))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                while not self._buffer and self._file is not None:
+                    self._has_records.wait()
+                if self._file is None:
+                    return
+            # Let records accumulate so they share a single write and fsync
+            time.sleep(self.flush_interval)
+            with self._io_lock:
+                with self._lock:
+                    batch = self._take_buffer()
+                    file = self._file
+                if file is not None:
+                    self._write(file, batch)
+
+    def rotate(self):
+        """Flushes the current segment, starts a new one and returns the last sequence number before it."""
+        with self._io_lock:
+            with self._lock:
+                batch = self._take_buffer()
+                file = self._file
+                seq = self.seq
+                self._file = self._open_segment(seq + 1)
+            self._write(file, batch)
+            file.close()
+        return seq
+
+    def close(self):
+        """Flushes any buffered records and closes the journal."""
+        with self._io_lock:
+            with self._lock:
+                batch = self._take_buffer()
+                file, self._file = self._file, None
+                self._has_records.notify()
+            if file is not None:
+                self._write(file, batch)
+                file.close()
+
+    def write_snapshot(self, seq: int, state: dict):
+        """Writes a snapshot of the state up to record `seq`, then deletes the files it replaces."""
+        path = os.path.join(self.directory, f"{SNAPSHOT_PREFIX}{seq:012d}.bin")
+        with open(path + ".tmp", "wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+        # Older snapshots and the segments written before this snapshot are no longer needed
+        for snapshot_seq, snapshot_path in _files(self.directory, SNAPSHOT_PREFIX):
+            if snapshot_seq < seq:
+                os.remove(snapshot_path)
+        for first_seq, segment_path in _files(self.directory, SEGMENT_PREFIX):
+            if first_seq <= seq:
+                os.remove(segment_path)
+
+
+def load_latest_snapshot(directory: str):
+    """Returns the sequence number and state of the latest snapshot, or (0, None) if there is none."""
+    snapshots = _files(directory, SNAPSHOT_PREFIX)
+    if not snapshots:
+        return 0, None
+    seq, path = snapshots[-1]
+    with open(path, "rb") as file:
+        return seq, pickle.load(file)
+
+
+def read_records(directory: str, after_seq: int):
+    """Yields the journal records with a sequence number greater than `after_seq`, in order."""
+    for _, path in _files(directory, SEGMENT_PREFIX):
+        with open(path, "rb") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn write at the end of the journal, from a crash mid-flush
+                    break
+                if record["seq"] > after_seq:
+                    yield record
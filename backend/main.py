@@ -1,325 +1,447 @@
-from fastapi import FastAPI, HTTPException
-from .database import load_data, stocks_db, traders_db
-from .models import Order, Transaction
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse
+from .database import load_data_once, add_stocks, add_traders, stocks_db, order_books, journal, feed, response_cache, trade_archive
+from .config import JOURNAL_DIR, SNAPSHOT_INTERVAL, SEQUENCER_SHARDS, SEQUENCER_QUEUE_SIZE, ENGINE_PROCESSES, METRICS_ENABLED, ORDER_IN_FLIGHT_LIMIT, STOCK_IN_FLIGHT_LIMIT, TRADER_ORDER_RATE, TRADER_ORDER_BURST, ARCHIVE_DIR, SHARED_STATE_NAME, SHARED_STATE_SIZE, SHARED_STATE_PUBLISH_INTERVAL, READ_REPLICA, PROVISIONING_CHUNK_SIZE, PROFILING_ENABLED, SLOW_ORDER_THRESHOLD
+from .models import BatchOrder
+from .sequencer import Sequencer
+from .sharding import ShardRouter
+from .views import TRADER_FIELDS, stocks_view, stock_view, depth_view, candles_view, history_view, traders_view, traders_page_view, trader_view, trader_transactions_view, trader_names_view, last_transactions_view, portfolio_view, leaderboard_view, slow_orders_view, metrics_view
+from .metrics import RequestMetricsMiddleware, all_metrics, admission_gauges, collect, merge, render
+from .admission import AdmissionControl
+from .replica import ReplicaPublisher, ReplicaReader, ReplicaMiddleware
+from .provisioning import ndjson_chunks, trader_columns, stock_rows
+from .profiling import start_profile, stop_profile, collapsed
+from .market_data import Subscriber, quote_message
+from .serialization import MEDIA_TYPES, negotiate, encode
+from .response_cache import etag_matches
+from .engine import execute_buy_order, execute_sell_order, execute_cancel_buy_order, execute_cancel_sell_order, execute_stock_orders, recover_from_journal, open_trade_archive, take_snapshot
+from typing import List, Optional
+import datetime
 import asyncio
+import json
 from .database import update_stock_prices
-from .helpers import reserve_funds, create_buy_order, find_matching_sell_orders, fetch_and_validate_buy_order, create_and_update_transaction_in_buy_order, update_buyer_funds_and_holdings, fetch_and_validate_sell_order, create_sell_order, find_matching_buy_orders, create_and_update_transaction_in_sell_order, adjust_balances
 
 app = FastAPI()
+if METRICS_ENABLED:
+    app.add_middleware(RequestMetricsMiddleware)
 
-# Load data on startup
-load_data()
+# Every change to the order books goes through the sequencer, or in sharded mode through the
+# engine process that owns the stock
+sequencer = Sequencer(SEQUENCER_SHARDS, SEQUENCER_QUEUE_SIZE)
+router = ShardRouter(ENGINE_PROCESSES) if ENGINE_PROCESSES else None
+engine = router or sequencer
+
+# Orders over these limits are rejected before they reach the engine
+admission = AdmissionControl(ORDER_IN_FLIGHT_LIMIT, STOCK_IN_FLIGHT_LIMIT, TRADER_ORDER_RATE, TRADER_ORDER_BURST)
+
+# The primary publishes GET responses to shared memory, read replicas serve them from there
+replica_reader = ReplicaReader(SHARED_STATE_NAME) if READ_REPLICA else None
+replica_publisher = ReplicaPublisher(SHARED_STATE_NAME, SHARED_STATE_SIZE) if SHARED_STATE_NAME and not READ_REPLICA else None
+if replica_reader:
+    app.add_middleware(ReplicaMiddleware, reader=replica_reader)
 
 @app.on_event("startup")
 async def start_background_tasks():
+    if replica_reader:
+        # Read replicas hold no state of their own
+        return
+    # The seed is loaded here rather than on import, and only once
+    load_data_once()
+    if router:
+        if replica_publisher:
+            raise RuntimeError("Read replicas need the engine in the web server process, set ENGINE_PROCESSES=0")
+        if JOURNAL_DIR:
+            raise RuntimeError("Journaling needs the engine in the web server process, set ENGINE_PROCESSES=0")
+        # Engine processes run their own market events
+        router.start()
+        return
+
+    if JOURNAL_DIR:
+        # Recover the state from the latest snapshot and the journal written after it
+        recover_from_journal(JOURNAL_DIR)
+        asyncio.create_task(take_periodic_snapshots())
+    if ARCHIVE_DIR:
+        # Opened once the trade log is recovered, fills the archive missed are copied from it
+        open_trade_archive(ARCHIVE_DIR)
+    if replica_publisher:
+        replica_publisher.open()
+        asyncio.create_task(publish_to_replicas())
+    sequencer.start()
     asyncio.create_task(update_stock_prices())  
 
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await engine.stop()
+    journal.close()
+    trade_archive.close()
+    if replica_publisher:
+        replica_publisher.close()
+    if replica_reader:
+        replica_reader.close()
+
+async def take_periodic_snapshots():
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        # The state is captured on the event loop, between sequencer commands, and written off it
+        seq, state = take_snapshot()
+        await asyncio.get_running_loop().run_in_executor(None, journal.write_snapshot, seq, state)
+
+async def publish_to_replicas():
+    while True:
+        await asyncio.sleep(SHARED_STATE_PUBLISH_INTERVAL)
+        # Runs between sequencer commands, so every publish is a consistent state
+        replica_publisher.publish()
+
+def encoded_response(request: Request, content):
+    """Returns the content as JSON, or as MessagePack if the request's Accept header asks for it."""
+    format = negotiate(request.headers.get("accept"))
+    return Response(content=encode(content, format), media_type=MEDIA_TYPES[format], headers={"Vary": "Accept"})
+
+def cached_response(request: Request, key: tuple, version: int, render):
+    """Returns the cached body for the key at this version, or 304 if the client already has it."""
+    format = negotiate(request.headers.get("accept"))
+    etag, body = response_cache.get(key, version, render, format)
+    headers = {"ETag": etag, "Vary": "Accept"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=MEDIA_TYPES[format], headers=headers)
+
+
 @app.get("/stocks")
-def get_stocks():
-    return list(stocks_db.values())
+async def get_stocks(request: Request):
+    if router:
+        return encoded_response(request, await router.get_stocks())
+    return cached_response(request, ("stocks",), response_cache.version("stock"), stocks_view)
 
 @app.get("/stock/{stock_id}")
-def get_stock_by_id(stock_id: str):
-    # Fetch stock from in-memory database
-    stock = stocks_db.get(stock_id)
-    
-    if not stock:
-        raise HTTPException(status_code=404, detail="Stock not found")
-    
-    # Create response with stock details, open orders, and last 10 transactions
-    stock_data = {
-        "id": stock.id,
-        "name": stock.name,
-        "current_price": stock.current_price,
-        "amount": stock.amount,
-        "open_orders": stock.open_orders,
-        "transactions": stock.transactions[-10:],  # Last 10 transactions
-    }
-    return stock_data
+async def get_stock_by_id(stock_id: str, request: Request):
+    if router:
+        return encoded_response(request, await router.get_stock(stock_id))
+    return cached_response(request, ("stock", stock_id), response_cache.version("stock", stock_id), lambda: stock_view(stock_id))
+
+@app.get("/stock/{stock_id}/depth")
+async def get_stock_depth(stock_id: str, request: Request, levels: int = Query(10, ge=1, le=1000)):
+    if router:
+        return encoded_response(request, await router.submit(stock_id, depth_view, stock_id, levels))
+    return cached_response(
+        request, ("depth", stock_id, str(levels)), response_cache.version("stock", stock_id),
+        lambda: depth_view(stock_id, levels)
+    )
+
+def local_time(value: Optional[datetime.datetime]):
+    """Converts a timezone-aware query parameter to the server's local time, which bars and transaction timestamps are kept in."""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+def parse_cursor(cursor: Optional[str]):
+    """Returns the offset or position in a cursor, 0 for the first page."""
+    if cursor is None:
+        return 0
+    if not cursor.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return int(cursor)
+
+def parse_fields(fields: Optional[str]):
+    """Returns the trader fields of a comma-separated `fields` parameter, all of them if it's missing."""
+    if fields is None:
+        return tuple(TRADER_FIELDS)
+    requested = tuple(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    if not requested or not set(requested).issubset(TRADER_FIELDS):
+        raise HTTPException(status_code=400, detail=f"Fields must be some of {', '.join(TRADER_FIELDS)}.")
+    return requested
+
+def history_page(page: dict):
+    return {"transactions": page["transactions"], "next_cursor": None if page["next_cursor"] is None else str(page["next_cursor"])}
+
+@app.get("/stock/{stock_id}/candles")
+async def get_stock_candles(stock_id: str, request: Request, interval: str = "1m", start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None):
+    start, end = local_time(start), local_time(end)
+    if router:
+        return encoded_response(request, await router.submit(stock_id, candles_view, stock_id, interval, start, end))
+    return encoded_response(request, candles_view(stock_id, interval, start, end))
+
+
+@app.get("/history/stock/{stock_id}")
+async def get_stock_history(stock_id: str, request: Request, start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None, cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)):
+    args = ("stock", stock_id, local_time(start), local_time(end), parse_cursor(cursor), limit)
+    page = await router.submit(stock_id, history_view, *args) if router else history_view(*args)
+    return encoded_response(request, {"stock_id": stock_id, **history_page(page)})
 
 
 @app.get("/traders")
-def get_traders():
-    return list(traders_db.values())
+async def get_traders(request: Request, cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1, le=1000), fields: Optional[str] = None):
+    if cursor is not None or limit is not None or fields is not None:
+        # Paged in the order traders were added, so a page costs the same however many traders there are
+        args = (parse_cursor(cursor), 100 if limit is None else limit, parse_fields(fields))
+        page = await router.get_traders_page(*args) if router else traders_page_view(*args)
+        next_cursor = None if page["next_cursor"] is None else str(page["next_cursor"])
+        return encoded_response(request, {"traders": page["traders"], "next_cursor": next_cursor})
+    if router:
+        return encoded_response(request, await router.get_traders())
+    return cached_response(request, ("traders",), response_cache.version("trader"), traders_view)
 
 @app.get("/trader-names")
-def get_trader_names():
-    return {"trader_names": [trader.name for trader in traders_db.values()]}
+async def get_trader_names(request: Request):
+    # Trader names never change, so the front end's own copy of the traders is enough in sharded mode
+    return cached_response(request, ("trader-names",), response_cache.version("trader-names"), trader_names_view)
 
 @app.get("/trader/{trader_id}")
-def get_trader_details(trader_id: str):
-    trader = traders_db.get(trader_id)
-    if not trader:
-        raise HTTPException(status_code=404, detail="Trader not found")
-
-    return {
-        "name": trader.name,
-        "money": trader.money,
-        "holdings": trader.holdings,
-        "buy_orders": list(trader.buy_orders.values()),
-        "sell_orders": list(trader.sell_orders.values()),
-    }
+async def get_trader_details(trader_id: str, request: Request):
+    if router:
+        return encoded_response(request, await router.get_trader(trader_id))
+    return cached_response(request, ("trader", trader_id), response_cache.version("trader", trader_id), lambda: trader_view(trader_id))
 
 
 @app.get("/get_last_transactions/{trader_id}")
-def get_last_transactions(trader_id: str):
-    trader = traders_db.get(trader_id)
-    
-    if not trader:
-        raise HTTPException(status_code=404, detail="Trader not found.")
-    
-    # Fetch the last 8 transactions, if fewer transactions are available, return all of them
-    last_transactions = trader.transactions[-8:]
-    
-    return {"trader_id": trader_id, "last_transactions": last_transactions}
-
-@app.post("/place_buy_order")
-def place_buy_order(trader_id: str, stock_id: str, price: float, amount: int):
-    # Fetch trader and stock and validate constraints
-    trader, stock = fetch_and_validate_buy_order(trader_id, stock_id, price, amount, traders_db, stocks_db)
-
-    # Reserve funds and create the buy order
-    reserve_funds(trader, price, amount)
-    buy_order = create_buy_order(trader_id, stock_id, price, amount)
-    
-    # Get matched sell orders
-    matched_sell_orders = find_matching_sell_orders(stock_id, price, traders_db)
-
-    if matched_sell_orders:
-        for sell_order, seller in matched_sell_orders:
-            if sell_order.amount < amount:
-                # Full match, buyer purchases all shares from this sell order (E.g., buyer wants 10, seller has 5)
-                amount -= sell_order.amount
-                trade_cost = sell_order.amount * sell_order.price
-                
-                # Deduct from reserved funds and actual money, and update the buyer's holdings
-                update_buyer_funds_and_holdings(trader, stock_id, trade_cost, sell_order.amount)
-
-                # Update the seller's money and holdings
-                seller.money += trade_cost
-                seller.holdings[stock_id] = seller.holdings.get(stock_id, 0) - sell_order.amount
-
-                # Create transaction and update buyer, seller, and stock transaction histories
-                create_and_update_transaction_in_buy_order(trader, seller, stock_id, sell_order, trade_cost, sell_order.amount, stock)
-
-                # Remove stock holdings for seller if they become zero
-                if seller.holdings[stock_id] == 0:
-                    del seller.holdings[stock_id]
-
-                # Remove the completed sell order from stock's open orders 
-                if sell_order in stock.open_orders:
-                    stock.open_orders.remove(sell_order)
-
-                # Sell order is fully completed, remove the completed sell order from the seller's open orders
-                sell_order.amount = 0  
-                seller.sell_orders.pop(stock_id, None)
-
-                # Update the seller in database and update stock price to the transaction price
-                traders_db[seller.id] = seller
-                stocks_db[stock_id].current_price = sell_order.price
-            else:
-                # Partial match, buyer buys only what they need (E.g., buyer wants 10 or less, seller has 10)
-                trade_cost = amount * sell_order.price
-                
-                # Deduct from buyer's reserved funds and actual money and update the buyer's holdings
-                update_buyer_funds_and_holdings(trader, stock_id, trade_cost, amount)
-
-                if sell_order.amount - amount == 0:
-                    # Remove the sell order since it's fully executed
-                    seller.sell_orders.pop(stock_id, None)
-                    # Remove the sell order from stock's open orders 
-                    if sell_order in stock.open_orders:
-                        stock.open_orders.remove(sell_order)
-                
-                # Update sell order amount
-                sell_order.amount -= amount
-
-                # Update the seller's money and holdings
-                seller.money += trade_cost
-                seller.holdings[stock_id] = seller.holdings.get(stock_id, 0) - amount 
-                 
-                # Remove stock holdings for seller if they become zero
-                if seller.holdings[stock_id] == 0:
-                    del seller.holdings[stock_id]              
-                
-                # Create transaction and update buyer, seller, and stock transaction histories
-                create_and_update_transaction_in_buy_order(trader, seller, stock_id, sell_order, trade_cost, amount, stock)
-
-                # Remove the buy order since it's fully fulfilled
-                amount = 0  # Order fully filled
-                trader.buy_orders.pop(stock_id, None)
-
-                # Remove the buy order from stock's open orders 
-                if buy_order in stock.open_orders:
-                    stock.open_orders.remove(buy_order)
-
-                # Update the seller in database and Update stock price to the transaction price
-                traders_db[seller.id] = seller
-                stocks_db[stock_id].current_price = sell_order.price
-                break
-        
-        # If there are still shares left in the buy order, place it as an active buy order
-        if amount > 0:
-            buy_order.amount = amount       
-            trader.buy_orders[stock_id] = buy_order
-            # Add the buy order to the stock's open orders
-            stock.open_orders.append(buy_order)
+async def get_last_transactions(trader_id: str, request: Request):
+    if router:
+        return encoded_response(request, await router.get_last_transactions(trader_id))
+    return cached_response(
+        request, ("last_transactions", trader_id), response_cache.version("trader", trader_id),
+        lambda: last_transactions_view(trader_id)
+    )
+
+@app.get("/history/trader/{trader_id}")
+async def get_trader_history(trader_id: str, request: Request, start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None, cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)):
+    start, end = local_time(start), local_time(end)
+    if router:
+        # The trader's fills are spread over the engine processes, the cursor holds an offset for each
+        page = await router.get_trader_history(trader_id, start, end, cursor, limit)
+    else:
+        page = history_page(history_view("trader", trader_id, start, end, parse_cursor(cursor), limit))
+    return encoded_response(request, {"trader_id": trader_id, **page})
+
+@app.get("/trader/{trader_id}/transactions")
+async def get_trader_transactions(trader_id: str, request: Request, stock_id: Optional[str] = None, before: Optional[str] = None, after: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)):
+    if router:
+        # The trader's fills are spread over the engine processes, the cursors hold an offset for each
+        page = await router.get_trader_transactions(trader_id, stock_id, after, before, limit)
+    else:
+        args = (trader_id, stock_id, parse_cursor(after), 2 ** 63 - 1 if before is None else parse_cursor(before), limit)
+        page = trader_transactions_view(*args)
+        page = {
+            "transactions": page["transactions"],
+            "before": None if page["before"] is None else str(page["before"]),
+            "after": str(page["after"]),
+        }
+    return encoded_response(request, {"trader_id": trader_id, **page})
+
+@app.get("/trader/{trader_id}/portfolio")
+async def get_trader_portfolio(trader_id: str, request: Request):
+    if router:
+        return encoded_response(request, await router.get_portfolio(trader_id))
+    return encoded_response(request, portfolio_view(trader_id))
+
+@app.get("/leaderboard")
+async def get_leaderboard(request: Request, limit: int = Query(10, ge=1, le=1000)):
+    if router:
+        return encoded_response(request, await router.get_leaderboard(limit))
+    return encoded_response(request, leaderboard_view(limit))
+
+@app.get("/metrics")
+async def get_metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled.")
+    gauges = admission_gauges(admission, engine.queue_depths)
+    if router:
+        # Request and admission metrics are recorded here, the matching engine's in every engine process
+        families = merge([collect(all_metrics + gauges)] + await router.broadcast(metrics_view))
     else:
-        # No matching sell orders, place the buy order for future matching and add the buy order to the stock's open orders
-        trader.buy_orders[stock_id] = buy_order
-        stock.open_orders.append(buy_order)
-    
-    # After the transaction, clear the reserved funds to zero if the buy order was completely fulfilled
-    if amount == 0:
-        trader.reserved_funds = 0
+        families = metrics_view() + collect(gauges)
+    return Response(content=render(families), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/slow-orders")
+async def get_slow_orders(request: Request):
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled.")
+    if router:
+        # Every engine process logs its own orders
+        orders = [order for part in await router.broadcast(slow_orders_view) for order in part]
+        orders.sort(key=lambda order: order["time"], reverse=True)
+    else:
+        orders = slow_orders_view()
+    return encoded_response(request, {"threshold": SLOW_ORDER_THRESHOLD, "orders": orders})
+
+@app.post("/admin/profile")
+async def take_profile(seconds: float = Query(10, gt=0, le=300), interval: float = Query(0.005, ge=0.0005, le=1)):
+    # Requests keep being served while the stacks are sampled, in every engine process too in sharded mode
+    start_profile(interval)
+    try:
+        if router:
+            await router.broadcast(start_profile, interval)
+        await asyncio.sleep(seconds)
+    finally:
+        content = collapsed(stop_profile(), "web;" if router else "")
+        if router:
+            for index, stacks in enumerate(await router.broadcast(stop_profile)):
+                content += collapsed(stacks, f"engine-{index};")
+    return Response(
+        content=content, media_type="text/plain",
+        headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'},
+    )
+
+async def submit_order(trader_id: str, stock_id: str, command, *args):
+    """Submits an order command to the engine if admission control admits it, otherwise raises a 429."""
+    orders = [(trader_id, stock_id)]
+    admission.admit(orders)
+    try:
+        return await engine.submit(stock_id, command, *args)
+    finally:
+        admission.release(orders)
+
+@app.get("/admission")
+async def get_admission():
+    # Limits, orders in flight and rejections, to tune the limits with
+    return {**admission.status(), "queue_depths": engine.queue_depths()}
 
-    # Update the buyer in the database
-    traders_db[trader.id] = trader
-    return {"message": "Buy order processed successfully", "buy_order": buy_order}
+@app.post("/place_buy_order")
+async def place_buy_order(trader_id: str, stock_id: str, price: float, amount: int):
+    return await submit_order(trader_id, stock_id, execute_buy_order, trader_id, stock_id, price, amount)
 
 
 # 2. Cancel a Buy Order
 @app.delete("/cancel_buy_order")
-def cancel_buy_order(trader_id: str, stock_id: str):
-    trader = traders_db.get(trader_id)
-    
-    if not trader or stock_id not in trader.buy_orders:
-        raise HTTPException(status_code=404, detail="Buy order not found.")
-    
-    # Retrieve the buy order and release the reserved funds
-    order = trader.buy_orders.pop(stock_id)
-    total_cost = order.price * order.amount
-    trader.reserved_funds -= total_cost  
-
-    # Update the trader in the database
-    traders_db[trader.id] = trader
-
-    # Remove the buy order from the stock's open orders 
-    stock = stocks_db.get(stock_id)
-    if order in stock.open_orders:
-        stock.open_orders.remove(order)
-    
-    return {"message": "Buy order cancelled successfully", "order": order}  
+async def cancel_buy_order(trader_id: str, stock_id: str):
+    return await submit_order(trader_id, stock_id, execute_cancel_buy_order, trader_id, stock_id)
 
 
 @app.post("/place_sell_order")
-def place_sell_order(trader_id: str, stock_id: str, price: float, amount: int):
-    # Fetch trader and stock and validate constraints
-    trader, stock = fetch_and_validate_sell_order(trader_id, stock_id, price, amount, traders_db, stocks_db)
-    
-    # Create the sell order
-    sell_order = create_sell_order(trader_id, stock_id, price, amount)
-
-    # Find matching buy orders
-    matched_buy_orders = find_matching_buy_orders(stock_id, price, traders_db)
-    
-    if matched_buy_orders:
-        for buy_order, buyer in matched_buy_orders:
-
-            if buy_order.amount < amount:
-                # Seller sells part of what he has (e.g., buyer wants 10, seller has 15)
-                amount -= buy_order.amount
-                trade_cost = buy_order.amount * buy_order.price
-                
-                # Update the seller's and buyer's holdings
-                buyer.holdings[stock_id] = buyer.holdings.get(stock_id, 0) + buy_order.amount
-                trader.holdings[stock_id] -= buy_order.amount
-
-                # Adjust balances
-                adjust_balances(trader, buyer, trade_cost)
-                
-                # create transaction and update the seller's, buyer's, and stock's history
-                create_and_update_transaction_in_sell_order(trader, buyer, stock, stock_id, buy_order, buy_order.amount, trade_cost)
-
-                # Remove the open buy order (which is now closed) from the stock's open orders
-                if buy_order in stock.open_orders:
-                    stock.open_orders.remove(buy_order)
-
-                # Remove completed buy order, and update buyer in the database
-                buy_order.amount = 0
-                buyer.buy_orders.pop(stock_id, None)
-                traders_db[buyer.id] = buyer
-
-                # Update stock price to the transaction price
-                stocks_db[stock_id].current_price = buy_order.price
-
-            else:
-                # Seller sells everything he has (e.g., buyer wants 10, seller has 10 or less)
-                trade_cost = amount * buy_order.price
-                
-                # Update holdings
-                buyer.holdings[stock_id] = buyer.holdings.get(stock_id, 0) + amount
-                trader.holdings[stock_id] -= amount
-                
-                # Adjust balances
-                adjust_balances(trader, buyer, trade_cost)
-
-                # Remove stock entry if holdings become zero
-                if trader.holdings[stock_id] == 0:
-                    del trader.holdings[stock_id]
-
-                if buy_order.amount - amount == 0:
-                    # Remove the buy order since it's fully executed
-                    buyer.buy_orders.pop(stock_id, None)   
-                    # Remove the buy order from stock's open orders
-                    if buy_order in stock.open_orders:
-                        stock.open_orders.remove(buy_order)
-
-                # Update buy order amount
-                buy_order.amount -= amount
-
-                # Create transaction and update the seller's, buyer's, and stock's history
-                create_and_update_transaction_in_sell_order(trader, buyer, stock, stock_id, buy_order, amount, trade_cost)
-
-                # Remove the sell order since it's fully executed
-                amount = 0  # Order fully filled
-                trader.sell_orders.pop(stock_id, None)
-
-                # Remove the sell order from stock's open orders 
-                if sell_order in stock.open_orders:
-                    stock.open_orders.remove(sell_order)
-
-                # Update buyer in database
-                traders_db[buyer.id] = buyer
-
-                # Update stock price to the transaction price
-                stocks_db[stock_id].current_price = buy_order.price
-                break
-
-        # If there's any stock left unsold, keep it as an active sell order
-        if amount > 0:
-            sell_order.amount = amount       
-            trader.sell_orders[stock_id] = sell_order
-
-            # Add the sell order to the stock's open orders
-            stock.open_orders.append(sell_order)
-    else:
-        # No matching buy orders, place the sell order for future matching and add the sell order to the stock's open orders
-        trader.sell_orders[stock_id] = sell_order
-        stock.open_orders.append(sell_order)
-    
-    # Update the seller in the database
-    traders_db[trader.id] = trader
-    return {"message": "Sell order processed successfully", "sell_order": sell_order}
+async def place_sell_order(trader_id: str, stock_id: str, price: float, amount: int):
+    return await submit_order(trader_id, stock_id, execute_sell_order, trader_id, stock_id, price, amount)
 
 
 @app.delete("/cancel_sell_order")
-def cancel_sell_order(trader_id: str, stock_id: str):
-    trader = traders_db.get(trader_id)
-
-    if not trader or stock_id not in trader.sell_orders:
-        raise HTTPException(status_code=404, detail="Sell order not found.")
-
-    # Remove the sell order
-    sell_order = trader.sell_orders.pop(stock_id)
-
-    # Update the seller in the database
-    traders_db[trader.id] = trader
-
-    # Remove the sell order from the stock's open orders
-    stock = stocks_db.get(stock_id)
-    if sell_order in stock.open_orders:
-        stock.open_orders.remove(sell_order)
-
-    return {"message": "Sell order cancelled successfully", "order": sell_order}
+async def cancel_sell_order(trader_id: str, stock_id: str):
+    return await submit_order(trader_id, stock_id, execute_cancel_sell_order, trader_id, stock_id)
+
+
+@app.post("/orders/batch")
+async def place_batch_orders(orders: List[BatchOrder]):
+    # Group the instructions by stock, keeping their order, so each stock's book is matched in one pass
+    orders_by_stock = {}
+    for index, order in enumerate(orders):
+        orders_by_stock.setdefault(order.stock_id, []).append((index, order))
+
+    # The whole batch is admitted or rejected, then each stock's instructions run as one command on the stock's shard
+    admitted_orders = [(order.trader_id, order.stock_id) for order in orders]
+    admission.admit(admitted_orders)
+    try:
+        stock_results = await asyncio.gather(*(
+            engine.submit(stock_id, execute_stock_orders, stock_orders)
+            for stock_id, stock_orders in orders_by_stock.items()
+        ))
+    finally:
+        admission.release(admitted_orders)
+
+    results = [None] * len(orders)
+    for index_results in stock_results:
+        for index, result in index_results:
+            results[index] = result
+
+    return {"results": results}
+
+
+@app.post("/admin/traders")
+async def provision_traders(request: Request):
+    received = created = 0
+    async for records, count in ndjson_chunks(request.stream(), PROVISIONING_CHUNK_SIZE):
+        trader_ids, trader_names, trader_money = trader_columns(records, count)
+        if router:
+            router.account_service.check_capacity(len(trader_ids))
+        # Added between sequencer commands, so orders keep running while the body streams in
+        created += add_traders(trader_ids, trader_names, trader_money)
+        if router:
+            await router.add_traders(trader_ids, trader_names, trader_money)
+        received += len(records)
+    return {"received": received, "created": created, "existing": received - created}
+
+@app.post("/admin/stocks")
+async def provision_stocks(request: Request):
+    received = created = 0
+    async for records, count in ndjson_chunks(request.stream(), PROVISIONING_CHUNK_SIZE):
+        stocks = stock_rows(records, count)
+        created += add_stocks(stocks)
+        if router:
+            await router.add_stocks(stocks)
+        received += len(records)
+    return {"received": received, "created": created, "existing": received - created}
+
+
+async def subscribe_to_market_data(subscriber: Subscriber, stock_ids: list):
+    """Subscribes to the stocks' market data, starting with their current quotes."""
+    unknown_stock_ids = [stock_id for stock_id in stock_ids if stock_id not in stocks_db]
+    if unknown_stock_ids:
+        raise HTTPException(status_code=404, detail=f"Stocks not found: {', '.join(unknown_stock_ids)}")
+    if not stock_ids:
+        return
+
+    if router:
+        # The engine processes own the books, they relay the stocks' updates to `feed` from now on
+        quotes = await router.start_relaying(stock_ids)
+    else:
+        quotes = [quote_message(stock_id, stocks_db[stock_id].current_price, order_books[stock_id]) for stock_id in stock_ids]
+    feed.subscribe(subscriber, stock_ids)
+    for quote in quotes:
+        subscriber.add_quote(quote)
+
+
+def unsubscribe_from_market_data(subscriber: Subscriber, stock_ids: list = None):
+    """Unsubscribes from the given stocks, or from every stock if none are given."""
+    stock_ids = list(subscriber.stock_ids if stock_ids is None else stock_ids)
+    feed.unsubscribe(subscriber, stock_ids)
+    if router:
+        unwatched = [stock_id for stock_id in stock_ids if stock_id in stocks_db and not feed.has_subscribers(stock_id)]
+        if unwatched:
+            router.stop_relaying(unwatched)
+
+
+@app.websocket("/ws/market-data")
+async def market_data_websocket(websocket: WebSocket):
+    # Clients send {"subscribe": [stock_ids]} or {"unsubscribe": [stock_ids]} and receive lists of updates
+    await websocket.accept()
+    subscriber = Subscriber(feed.trade_buffer_size)
+
+    async def receive_requests():
+        while True:
+            request = await websocket.receive_json()
+            try:
+                await subscribe_to_market_data(subscriber, request.get("subscribe", []))
+            except HTTPException as error:
+                await websocket.send_json([{"type": "error", "detail": error.detail}])
+            unsubscribe_from_market_data(subscriber, request.get("unsubscribe", []))
+
+    async def send_updates():
+        while True:
+            await websocket.send_json(await subscriber.next_updates())
+
+    tasks = [asyncio.create_task(receive_requests()), asyncio.create_task(send_updates())]
+    try:
+        # Runs until the client disconnects
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not isinstance(task.exception(), WebSocketDisconnect):
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        unsubscribe_from_market_data(subscriber)
+
+
+@app.get("/market-data/stream")
+async def market_data_stream(stock_ids: str):
+    # Server-sent events, each carrying a list of updates for the comma-separated stock IDs
+    subscriber = Subscriber(feed.trade_buffer_size)
+    await subscribe_to_market_data(subscriber, stock_ids.split(","))
+
+    async def events():
+        try:
+            while True:
+                updates = await subscriber.next_updates()
+                yield f"data: {json.dumps(updates)}\n\n"
+        finally:
+            unsubscribe_from_market_data(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
 
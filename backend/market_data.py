@@ -0,0 +1,130 @@
+from collections import deque
+from .order_book import OrderBook
+import asyncio
+
+
+def quote_message(stock_id: str, last_price: float, book: OrderBook):
+    """Builds a top-of-book update for a stock."""
+    return {
+        "type": "quote",
+        "stock_id": stock_id,
+        "last_price": last_price,
+        "best_bid": book.best_bid(),
+        "best_ask": book.best_ask(),
+    }
+
+
+class Subscriber:
+    """A market-data client's pending updates.
+
+    Trade prints are buffered up to a fixed size, dropping the oldest ones, and quotes are
+    conflated so only the latest one per stock is kept. However slow the client is, its
+    backlog stays bounded and publishing never waits for it.
+    """
+
+    def __init__(self, trade_buffer_size: int):
+        self.stock_ids = set()
+        self._trades = deque(maxlen=trade_buffer_size)
+        self._quotes = {}  # stock_id -> latest quote
+        self._dropped_trades = 0
+        self._ready = asyncio.Event()
+
+    def add_trade(self, message: dict):
+        if len(self._trades) == self._trades.maxlen:
+            self._dropped_trades += 1
+        self._trades.append(message)
+        self._ready.set()
+
+    def add_quote(self, message: dict):
+        self._quotes[message["stock_id"]] = message
+        self._ready.set()
+
+    async def next_updates(self):
+        """Waits for updates and returns all of them, oldest first."""
+        await self._ready.wait()
+        self._ready.clear()
+
+        updates = []
+        if self._dropped_trades:
+            updates.append({"type": "dropped_trades", "count": self._dropped_trades})
+            self._dropped_trades = 0
+        updates.extend(self._trades)
+        updates.extend(self._quotes.values())
+        self._trades.clear()
+        self._quotes.clear()
+        return updates
+
+
+class Relay:
+    """Collects an engine process's updates for the front end's feed, in sharded mode.
+
+    It's subscribed to the stocks the front end has subscribers for, and every update is kept
+    until `take`, which runs after each command, so nothing is dropped or conflated here.
+    """
+
+    def __init__(self):
+        self.stock_ids = set()
+        self._updates = []
+
+    def add_trade(self, message: dict):
+        self._updates.append(message)
+
+    def add_quote(self, message: dict):
+        self._updates.append(message)
+
+    def take(self):
+        """Returns the updates collected since the last call, oldest first."""
+        updates, self._updates = self._updates, []
+        return updates
+
+
+class MarketDataFeed:
+    """Pushes trade prints and quotes from the matching engine and market events to subscribers."""
+
+    def __init__(self, trade_buffer_size: int):
+        self.trade_buffer_size = trade_buffer_size
+        self._subscribers = {}  # stock_id -> set of subscribers
+
+    def has_subscribers(self, stock_id: str):
+        return stock_id in self._subscribers
+
+    def subscribe(self, subscriber: Subscriber, stock_ids):
+        for stock_id in stock_ids:
+            subscriber.stock_ids.add(stock_id)
+            self._subscribers.setdefault(stock_id, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber, stock_ids=None):
+        """Unsubscribes from the given stocks, or from every stock if none are given."""
+        for stock_id in list(subscriber.stock_ids if stock_ids is None else stock_ids):
+            subscriber.stock_ids.discard(stock_id)
+            subscribers = self._subscribers.get(stock_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[stock_id]
+
+    def publish_trade(self, fill: dict):
+        """Publishes a fill, given as the fields of a `Transaction` (see `TradeLog.fill`)."""
+        subscribers = self._subscribers.get(fill["stock_id"])
+        if subscribers:
+            message = {"type": "trade", **fill}
+            for subscriber in subscribers:
+                subscriber.add_trade(message)
+
+    def publish_quote(self, stock_id: str, last_price: float, book: OrderBook):
+        subscribers = self._subscribers.get(stock_id)
+        if subscribers:
+            message = quote_message(stock_id, last_price, book)
+            for subscriber in subscribers:
+                subscriber.add_quote(message)
+
+    def publish_updates(self, updates: list):
+        """Publishes trade prints and quotes relayed from an engine process."""
+        for message in updates:
+            subscribers = self._subscribers.get(message["stock_id"])
+            if subscribers:
+                for subscriber in subscribers:
+                    if message["type"] == "trade":
+                        subscriber.add_trade(message)
+                    else:
+                        subscriber.add_quote(message)
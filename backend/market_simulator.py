@@ -0,0 +1,81 @@
+import numpy as np
+import zlib
+
+# Market events: every tick the simulator draws a return for every stock at once from a
+# pluggable model, and the new prices are computed in one array operation.
+
+
+class RandomWalkModel:
+    """Moves each stock up or down by a random 1% to 5%, independently of the others."""
+
+    def __init__(self, min_change: float = 0.01, max_change: float = 0.05):
+        self.min_change = min_change
+        self.max_change = max_change
+
+    def prepare(self, stock_ids: list):
+        pass
+
+    def returns(self, rng: np.random.Generator, count: int):
+        trend = rng.choice((-1.0, 1.0), size=count)  # Simulate good/bad news
+        return trend * rng.uniform(self.min_change, self.max_change, size=count)
+
+
+class SectorFactorModel:
+    """Moves stocks by a market-wide factor, a factor shared by their sector and noise of their own.
+
+    Stocks are assigned to sectors by hashing their ID, so a stock stays in the same sector
+    across restarts and engine processes.
+    """
+
+    def __init__(self, sector_count: int = 10, market_volatility: float = 0.01, sector_volatility: float = 0.015,
+                 stock_volatility: float = 0.02):
+        self.sector_count = sector_count
+        self.market_volatility = market_volatility
+        self.sector_volatility = sector_volatility
+        self.stock_volatility = stock_volatility
+        self._sectors = np.zeros(0, dtype=np.int64)
+
+    def prepare(self, stock_ids: list):
+        self._sectors = np.array([zlib.crc32(stock_id.encode()) % self.sector_count for stock_id in stock_ids], dtype=np.int64)
+
+    def returns(self, rng: np.random.Generator, count: int):
+        market = rng.normal(0.0, self.market_volatility)
+        sectors = rng.normal(0.0, self.sector_volatility, size=self.sector_count)
+        return market + sectors[self._sectors] + rng.normal(0.0, self.stock_volatility, size=count)
+
+
+def create_market_model(name: str, sector_count: int):
+    """Creates a market model by name, "random_walk" or "sector_factor"."""
+    if name == "random_walk":
+        return RandomWalkModel()
+    if name == "sector_factor":
+        return SectorFactorModel(sector_count=sector_count)
+    raise ValueError(f"Unknown market model {name!r}, expected random_walk or sector_factor")
+
+
+class MarketSimulator:
+    """Draws the stocks' prices after each market event from a market model and a seedable RNG.
+
+    A market model is any object with `prepare(stock_ids)`, called whenever the set of
+    stocks changes, and `returns(rng, count)`, returning an array of relative price changes.
+    """
+
+    def __init__(self, model, seed=None):
+        self.model = model
+        self.seed(seed)
+        self._stock_ids = None
+
+    def seed(self, seed):
+        """Restarts the random number generator, from fresh entropy if `seed` is None."""
+        self.rng = np.random.default_rng(seed)
+
+    def next_prices(self, stocks: dict):
+        """Returns the IDs of the stocks in `stocks` and an array of their new prices, rounded to cents and at least 1."""
+        stock_ids = list(stocks)
+        if stock_ids != self._stock_ids:
+            self.model.prepare(stock_ids)
+            self._stock_ids = stock_ids
+
+        prices = np.fromiter((stock.current_price for stock in stocks.values()), dtype=np.float64, count=len(stock_ids))
+        returns = self.model.returns(self.rng, len(stock_ids))
+        return stock_ids, np.maximum(1.0, np.round(prices * (1.0 + returns), 2))
@@ -0,0 +1,179 @@
+from bisect import bisect_left
+import time
+
+# Counters and histograms exposed by /metrics in the Prometheus text format. Recording is a
+# dict update, and every call site checks `METRICS_ENABLED` first, so instrumentation costs
+# nothing when it's switched off.
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.values = {}  # label values -> count
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def collect(self):
+        samples = [(self.name, labels, value) for labels, value in self.values.items()]
+        return self.name, "counter", self.help, self.label_names, samples
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple, label_names: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets  # Upper bounds, ascending
+        self.values = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+
+    def observe(self, value: float, labels: tuple = ()):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self):
+        samples = []
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                samples.append((self.name + "_bucket", labels + (str(bound),), cumulative))
+            samples.append((self.name + "_sum", labels, series[-1]))
+            samples.append((self.name + "_count", labels, cumulative))
+        return self.name, "histogram", self.help, self.label_names, samples
+
+
+class Gauge:
+    """A gauge read when metrics are collected, from a function returning (label values, value) pairs."""
+
+    def __init__(self, name: str, help: str, label_names: tuple, read):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.read = read
+
+    def collect(self):
+        samples = [(self.name, labels, value) for labels, value in self.read()]
+        return self.name, "gauge", self.help, self.label_names, samples
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+http_requests = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+http_request_duration = Histogram("http_request_duration_seconds", "HTTP request latency by route.", LATENCY_BUCKETS, ("method", "route"))
+orders_placed = Counter("orders_placed_total", "Orders accepted by the matching engine.", ("stock_id", "side"))
+orders_filled = Counter("orders_filled_total", "Orders filled completely when placed.", ("stock_id", "side"))
+orders_partially_filled = Counter("orders_partially_filled_total", "Orders partly filled when placed, the rest resting in the book.", ("stock_id", "side"))
+orders_cancelled = Counter("orders_cancelled_total", "Orders cancelled.", ("stock_id", "side"))
+fills = Counter("fills_total", "Fills.", ("stock_id",))
+match_loop_iterations = Histogram("match_loop_iterations", "Resting orders matched per order placed.", (0, 1, 2, 5, 10, 20, 50, 100, 200))
+orders_rejected = Counter("orders_rejected_total", "Orders rejected by admission control: 429 for the in_flight, stock_in_flight and rate_limit reasons, 413 for too_large batches.", ("reason",))
+order_stage_duration = Histogram(
+    "order_stage_duration_seconds", "Time spent in each stage of the order paths, recorded with PROFILING_ENABLED.",
+    (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025) + LATENCY_BUCKETS, ("path", "stage")
+)
+market_event_duration = Histogram("market_event_duration_seconds", "Time spent applying a market event to every stock.", LATENCY_BUCKETS + (5.0, 10.0))
+
+all_metrics = [
+    http_requests, http_request_duration, orders_placed, orders_filled, orders_partially_filled, orders_cancelled, fills,
+    match_loop_iterations, orders_rejected, market_event_duration, order_stage_duration,
+]
+
+
+def book_gauges(order_books: dict):
+    """Creates the gauges reading open orders and depth from the order books."""
+    def read(statistic: int):
+        return [
+            ((stock_id, side), book.side_depth(side)[statistic])
+            for stock_id, book in order_books.items()
+            for side in ("BUY", "SELL")
+        ]
+
+    return [
+        Gauge("open_orders", "Orders resting in the book.", ("stock_id", "side"), lambda: read(0)),
+        Gauge("book_depth_levels", "Price levels in the book.", ("stock_id", "side"), lambda: read(1)),
+        Gauge("book_depth_shares", "Shares resting in the book.", ("stock_id", "side"), lambda: read(2)),
+    ]
+
+
+def admission_gauges(admission, queue_depths):
+    """Creates the gauges reading the orders in flight and the engine's queue depths, `queue_depths` returns one per shard."""
+    return [
+        Gauge("orders_in_flight", "Orders admitted and not finished yet.", (), lambda: [((), admission.in_flight)]),
+        Gauge("engine_queue_depth", "Commands waiting per sequencer shard or engine process.", ("shard",),
+              lambda: [((str(index),), depth) for index, depth in enumerate(queue_depths())]),
+    ]
+
+
+def collect(metrics: list):
+    """Returns the metrics' families as plain data, which can be merged with `merge` and rendered with `render`."""
+    return [metric.collect() for metric in metrics]
+
+
+def merge(collections: list):
+    """Merges collections of the same metrics from several processes, adding up identical samples."""
+    merged = {}
+    for families in collections:
+        for name, kind, help, label_names, samples in families:
+            family = merged.setdefault(name, (kind, help, label_names, {}))
+            values = family[3]
+            for sample_name, labels, value in samples:
+                values[(sample_name, labels)] = values.get((sample_name, labels), 0) + value
+    return [
+        (name, kind, help, label_names, [(sample_name, labels, value) for (sample_name, labels), value in values.items()])
+        for name, (kind, help, label_names, values) in merged.items()
+    ]
+
+
+def _escape(value: str):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render(families: list):
+    """Renders metric families in the Prometheus text exposition format."""
+    lines = []
+    for name, kind, help, label_names, samples in families:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample_name, labels, value in samples:
+            names = label_names + ("le",) if sample_name.endswith("_bucket") else label_names
+            if names:
+                label_text = ",".join(f'{label}="{_escape(str(label_value))}"' for label, label_value in zip(names, labels))
+                lines.append(f"{sample_name}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{sample_name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware recording the latency and status of every HTTP request by route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            http_request_duration.observe(time.perf_counter() - start, (scope["method"], route_path))
+            http_requests.inc((scope["method"], route_path, str(status[0])))
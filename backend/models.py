@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Dict, List
+from typing import Dict, Optional
 
 # Stock model representing the stock data
 class Stock(BaseModel):
@@ -7,8 +7,6 @@ class Stock(BaseModel):
     name: str
     current_price: float
     amount: int
-    open_orders: List['Order'] = []  
-    transactions: List['Transaction'] = []  # Last 10 completed transactions
 
 
 # Order model representing a buy or sell order
@@ -41,7 +39,14 @@ class Trader(BaseModel):
     holdings: Dict[str, int] = {}  # Mapping stock_id to quantity of shares owned
     buy_orders: Dict[str, 'Order'] = {}  # Mapping stock_id to buy orders
     sell_orders: Dict[str, 'Order'] = {}  # Mapping stock_id to sell orders
-    transactions: List['Transaction'] = []  
 
 
 
+
+# Batch order model representing one instruction in a batch order request
+class BatchOrder(BaseModel):
+    action: str  # "BUY", "SELL", "CANCEL_BUY" or "CANCEL_SELL"
+    trader_id: str
+    stock_id: str
+    price: Optional[float] = None  # Required for "BUY" and "SELL"
+    amount: Optional[int] = None  # Required for "BUY" and "SELL"
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from sortedcontainers import SortedList
+from .domain import Order
+
+
+class OrderBook:
+    """Price-time priority order book for a single stock.
+
+    Each side keeps its price levels in a sorted list of keys, ordered so the best
+    level is always the last element, which adds and removes levels in O(log n) however
+    deep in the book they are, a FIFO queue of orders per level and the total
+    amount resting at each level, kept up to date as orders are added, filled and removed.
+    """
+
+    def __init__(self, stock_id: str):
+        self.stock_id = stock_id
+        # Bid keys are prices sorted ascending, ask keys are negated prices sorted ascending,
+        # so the best bid (highest) and best ask (lowest) are both at index -1
+        self._bid_keys = SortedList()
+        self._ask_keys = SortedList()
+        self._bids = {}  # price -> OrderedDict of order_id -> Order
+        self._asks = {}
+        self._bid_totals = {}  # price -> total amount resting at the price
+        self._ask_totals = {}
+        self._orders = {}  # order_id -> Order
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, order: Order):
+        return self._orders.get(order.id) is order
+
+    def _side(self, order_type: str):
+        if order_type == "BUY":
+            return self._bid_keys, self._bids, self._bid_totals, 1
+        return self._ask_keys, self._asks, self._ask_totals, -1
+
+    def add(self, order: Order):
+        """Adds an order to the back of the queue at its price level."""
+        keys, levels, totals, sign = self._side(order.order_type)
+        level = levels.get(order.price)
+        if level is None:
+            # New price level, insert its key in sorted position
+            level = levels[order.price] = OrderedDict()
+            totals[order.price] = 0
+            keys.add(sign * order.price)
+        level[order.id] = order
+        totals[order.price] += order.amount
+        self._orders[order.id] = order
+
+    def remove(self, order: Order):
+        """Removes an order from the book if it is resting there."""
+        if self._orders.get(order.id) is not order:
+            return
+        del self._orders[order.id]
+
+        keys, levels, totals, sign = self._side(order.order_type)
+        level = levels[order.price]
+        del level[order.id]
+        totals[order.price] -= order.amount
+        if not level:
+            # Drop the empty price level, which is usually the best one
+            del levels[order.price]
+            del totals[order.price]
+            keys.remove(sign * order.price)
+
+    def fill(self, order: Order, amount: int):
+        """Takes `amount` shares off a resting order that stays in the book."""
+        order.amount -= amount
+        if self._orders.get(order.id) is order:
+            _, _, totals, _ = self._side(order.order_type)
+            totals[order.price] -= amount
+
+    def best_bid(self):
+        """Returns the highest buy price, or None if there are no bids."""
+        return self._bid_keys[-1] if self._bid_keys else None
+
+    def best_ask(self):
+        """Returns the lowest sell price, or None if there are no asks."""
+        return -self._ask_keys[-1] if self._ask_keys else None
+
+    def _crossing(self, order_type: str, price: float, amount: int):
+        keys, levels, _, sign = self._side(order_type)
+        matched = []
+        # Walk levels from the best price, stopping once enough shares are collected
+        for key in reversed(keys):
+            level_price = sign * key
+            if (order_type == "SELL" and level_price > price) or (order_type == "BUY" and level_price < price):
+                break
+            for order in levels[level_price].values():
+                matched.append(order)
+                amount -= order.amount
+                if amount <= 0:
+                    return matched
+        return matched
+
+    def crossing_sell_orders(self, price: float, amount: int):
+        """Returns sell orders priced at or below `price` in priority order, covering at most `amount` shares."""
+        return self._crossing("SELL", price, amount)
+
+    def crossing_buy_orders(self, price: float, amount: int):
+        """Returns buy orders priced at or above `price` in priority order, covering at most `amount` shares."""
+        return self._crossing("BUY", price, amount)
+
+    def side_depth(self, order_type: str):
+        """Returns the number of orders, price levels and shares resting on a side of the book."""
+        _, levels, totals, _ = self._side(order_type)
+        return sum(len(level) for level in levels.values()), len(levels), sum(totals.values())
+
+    def depth(self, order_type: str, level_count: int):
+        """Returns (price, total amount) of the best `level_count` price levels on a side, best first."""
+        keys, _, totals, sign = self._side(order_type)
+        return [(sign * key, totals[sign * key]) for key in keys[:-level_count - 1:-1]]
+
+    def orders(self):
+        """Returns all resting orders, bids first, each side in priority order."""
+        result = []
+        for keys, levels, _, sign in (self._side("BUY"), self._side("SELL")):
+            for key in reversed(keys):
+                result.extend(levels[sign * key].values())
+        return result
@@ -0,0 +1,208 @@
+import heapq
+
+# The stock market trader is not ranked on the leaderboard
+STOCK_MARKET_ID = "0"
+
+
+class Ranking:
+    """Traders ranked by net worth in a heap, re-ranking only the traders marked as changed when it's read.
+
+    The heap is built the first time it's read. After that, reading the top N pushes the
+    changed traders' new net worths, in O(log n) each, and skips the entries left behind by
+    earlier ones. When most traders changed, or stale entries pile up, it's rebuilt instead.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._net_worths = {}  # trader_id -> net worth as ranked
+        self._ranking = None  # Heap of (-net worth, trader_id), richest first, with stale entries of re-ranked traders
+
+    def top(self, count: int, changed, trader_ids, net_worths):
+        """Returns (trader_id, net worth) of the `count` richest traders, richest first.
+
+        `changed` holds the traders whose net worth may have changed since the last call,
+        `trader_ids` all of them, and `net_worths(trader_ids)` returns {trader_id: net worth}
+        of those of the given traders that are ranked.
+        """
+        if self._ranking is None or len(changed) > len(self._net_worths) // 8 or len(self._ranking) > 2 * len(self._net_worths) + 1024:
+            # Building the heap from every trader is faster than pushing most of them, and drops the stale entries
+            self._net_worths = net_worths(trader_ids)
+            self._ranking = [(-net_worth, trader_id) for trader_id, net_worth in self._net_worths.items()]
+            heapq.heapify(self._ranking)
+        else:
+            for trader_id, net_worth in net_worths(changed).items():
+                if self._net_worths.get(trader_id) != net_worth:
+                    self._net_worths[trader_id] = net_worth
+                    heapq.heappush(self._ranking, (-net_worth, trader_id))
+
+        # Entries not matching a trader's current net worth are stale and dropped, the top ones are put back
+        top = []
+        while self._ranking and len(top) < count:
+            entry = heapq.heappop(self._ranking)
+            negated, trader_id = entry
+            if self._net_worths.get(trader_id) == -negated and (not top or top[-1] != entry):
+                top.append(entry)
+        for entry in top:
+            heapq.heappush(self._ranking, entry)
+        return [(trader_id, -negated) for negated, trader_id in top]
+
+
+class Portfolios:
+    """Every trader's mark-to-market value and profit and loss, kept up to date incrementally.
+
+    Positions are indexed by stock, so a price change only touches the traders holding the
+    stock. Positions are valued at average cost: selling shares realizes the difference
+    between the sale price and their average cost, and the unrealized P&L is the market
+    value minus the cost of the shares still held. Traders are ranked by net worth (money
+    plus market value) in a `Ranking`, built the first time it's read, so loading a large
+    market stays fast. A fill or price change only marks its traders as changed, so the
+    matching engine never pays for the ranking.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.positions = {}  # stock_id -> {trader_id: [quantity, cost]}
+        self.prices = {}  # stock_id -> price positions are marked at
+        self.values = {}  # trader_id -> market value of their holdings
+        self.costs = {}  # trader_id -> cost of their holdings
+        self.realized = {}  # trader_id -> realized P&L
+        self._ranking = Ranking()
+        self._changed = set()  # Traders whose net worth may have changed since the ranking was last read
+
+    def rebuild(self, stocks_db: dict, traders_db: dict):
+        """Starts over from the traders' holdings, taking the current prices as their cost."""
+        self.clear()
+        for stock_id, stock in stocks_db.items():
+            self.prices[stock_id] = stock.current_price
+            self.positions[stock_id] = {}
+        for trader_id, trader in traders_db.items():
+            if not trader.holdings:
+                continue
+            value = 0.0
+            for stock_id, quantity in trader.holdings.items():
+                if stock_id in self.prices:
+                    stock_value = quantity * self.prices[stock_id]
+                    self.positions[stock_id][trader_id] = [quantity, stock_value]
+                    value += stock_value
+            self.values[trader_id] = self.costs[trader_id] = value
+
+    def add_stock(self, stock_id: str, price: float, holdings: dict):
+        """Starts marking a new stock at `price`, with the {trader_id: quantity} holdings of it costed at that price."""
+        self.prices[stock_id] = price
+        self.positions[stock_id] = {}
+        for trader_id, quantity in holdings.items():
+            self._add_shares(stock_id, trader_id, quantity, price)
+
+    def add_traders(self, trader_ids: list):
+        """Ranks new traders, who hold nothing yet, the next time the ranking is read."""
+        self._changed.update(trader_ids)
+
+    def _add_shares(self, stock_id: str, trader_id: str, quantity: int, price: float):
+        holders = self.positions[stock_id]
+        position = holders.get(trader_id)
+        if position is None:
+            position = holders[trader_id] = [0, 0.0]
+        position[0] += quantity
+        position[1] += quantity * price
+        self.values[trader_id] = self.values.get(trader_id, 0.0) + quantity * self.prices[stock_id]
+        self.costs[trader_id] = self.costs.get(trader_id, 0.0) + quantity * price
+        self._changed.add(trader_id)
+
+    def _remove_shares(self, stock_id: str, trader_id: str, quantity: int, price: float):
+        holders = self.positions[stock_id]
+        position = holders.get(trader_id)
+        # Runs in the middle of a fill, so a position missing the shares (none, or fewer than sold) must not raise.
+        # Only the shares it holds are costed, at its average cost, and it's removed once they're all sold
+        held = 0 if position is None else min(quantity, position[0])
+        cost = position[1] * held / position[0] if held > 0 else 0.0
+        if position is not None:
+            position[0] -= quantity
+            position[1] -= cost
+            if position[0] <= 0:
+                del holders[trader_id]
+        self.values[trader_id] = self.values.get(trader_id, 0.0) - held * self.prices[stock_id]
+        self.costs[trader_id] = self.costs.get(trader_id, 0.0) - cost
+        self.realized[trader_id] = self.realized.get(trader_id, 0.0) + quantity * price - cost
+        self._changed.add(trader_id)
+
+    def record_fill(self, stock_id: str, buyer_id: str, seller_id: str, price: float, amount: int):
+        """Moves `amount` shares bought at `price` from the seller's position to the buyer's."""
+        self._remove_shares(stock_id, seller_id, amount, price)
+        self._add_shares(stock_id, buyer_id, amount, price)
+
+    def set_prices(self, stock_ids: list, prices: list):
+        """Marks the stocks' positions at new prices, touching only the traders holding them."""
+        for stock_id, price in zip(stock_ids, prices):
+            change = price - self.prices[stock_id]
+            if not change:
+                continue
+            self.prices[stock_id] = price
+            for trader_id, (quantity, _) in self.positions[stock_id].items():
+                self.values[trader_id] += quantity * change
+                self._changed.add(trader_id)
+
+    def top(self, count: int, traders_db: dict):
+        """Returns (trader_id, net worth) of the `count` richest traders, richest first."""
+        changed, self._changed = self._changed, set()
+
+        def net_worths(trader_ids):
+            values = self.values
+            return {
+                trader_id: traders_db[trader_id].money + values.get(trader_id, 0.0)
+                for trader_id in trader_ids if trader_id != STOCK_MARKET_ID and trader_id in traders_db
+            }
+
+        return self._ranking.top(count, changed, traders_db, net_worths)
+
+    def take_changed(self):
+        """Returns the traders whose portfolio changed since the last call, for a ranking kept in another process.
+
+        Only used where this ranking isn't read, in the engine processes of sharded mode.
+        """
+        changed, self._changed = self._changed, set()
+        return changed
+
+    def summary(self, trader_id: str):
+        """Returns the trader's market value, cost, and realized and unrealized P&L."""
+        value = self.values.get(trader_id, 0.0)
+        cost = self.costs.get(trader_id, 0.0)
+        return {
+            "market_value": value,
+            "cost": cost,
+            "realized_pnl": self.realized.get(trader_id, 0.0),
+            "unrealized_pnl": value - cost,
+        }
+
+    def position(self, stock_id: str, trader_id: str):
+        """Returns the trader's (quantity, cost) of the stock."""
+        quantity, cost = self.positions[stock_id].get(trader_id, (0, 0.0))
+        return quantity, cost
+
+    def snapshot(self):
+        """Returns the positions and P&L as plain data for a snapshot."""
+        return {
+            "positions": {
+                stock_id: {trader_id: tuple(position) for trader_id, position in holders.items()}
+                for stock_id, holders in self.positions.items()
+            },
+            "prices": dict(self.prices),
+            "values": dict(self.values),
+            "costs": dict(self.costs),
+            "realized": dict(self.realized),
+        }
+
+    def restore(self, state: dict):
+        """Replaces the positions and P&L with a snapshot taken by `snapshot`."""
+        self.clear()
+        self.positions = {
+            stock_id: {trader_id: list(position) for trader_id, position in holders.items()}
+            for stock_id, holders in state["positions"].items()
+        }
+        self.prices = state["prices"]
+        self.values = state["values"]
+        self.costs = state["costs"]
+        self.realized = state["realized"]
@@ -0,0 +1,122 @@
+from collections import Counter, deque
+from fastapi import HTTPException
+from . import metrics
+import datetime
+import os
+import signal
+import time
+
+# Profiling of the matching engine. With PROFILING_ENABLED, the order paths time each of their
+# stages with an `OrderSpan`, observed in the `order_stage_duration_seconds` histograms, and
+# orders slower than a threshold are kept in the slow-order log. Every call site checks for a
+# span first, so the paths only pay for a comparison when profiling is off. The sampling
+# profiler is independent of it: a CPU-time timer interrupting the process to read its stack,
+# only set while a profile is being taken.
+
+
+class OrderSpan:
+    """Times the stages of one order, each mark ending the stage that started at the previous one."""
+
+    __slots__ = ("path", "start", "last", "stages")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.start = self.last = time.perf_counter()
+        self.stages = []  # (stage, seconds) in order
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+
+class SlowOrderLog:
+    """The last orders slower than `threshold` seconds, with their stages and how much of the book they swept."""
+
+    def __init__(self, threshold: float, size: int):
+        self.threshold = threshold
+        self.entries = deque(maxlen=size)
+
+    def finish(self, span: OrderSpan, trader_id: str, stock_id: str, matched_orders: list = (), fills: int = 0):
+        """Records a finished order's stage timings, and logs it if it was slow."""
+        duration = span.last - span.start
+        for stage, seconds in span.stages:
+            metrics.order_stage_duration.observe(seconds, (span.path, stage))
+        if duration < self.threshold:
+            return
+        self.entries.append({
+            "time": datetime.datetime.now().isoformat(),
+            "path": span.path,
+            "trader_id": trader_id,
+            "stock_id": stock_id,
+            "duration": duration,
+            "levels_swept": len({order.price for order, _ in matched_orders}),
+            "orders_matched": len(matched_orders),
+            "fills": fills,
+            "stages": dict(span.stages),
+        })
+
+    def view(self):
+        """Returns the logged orders, newest first."""
+        return list(reversed(self.entries))
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """Samples the main thread's stack on a CPU-time timer, counting stacks in the collapsed-stack format.
+
+    Each stack is the frames from the outermost, joined by ";", which flamegraph tools read
+    along with its count. The event loop, and an engine process's command loop, run on the
+    main thread. Python runs signal handlers between bytecodes, so the handler sees exactly
+    where the engine is, unlike a sampling thread, which only gets the GIL when the main
+    thread waits.
+    """
+
+    def __init__(self):
+        self.stacks = None  # stack -> samples, None when not sampling
+
+    def start(self, interval: float):
+        if not hasattr(signal, "setitimer"):
+            raise HTTPException(status_code=501, detail="Sampling profiles need setitimer, which this platform doesn't have.")
+        if self.stacks is not None:
+            raise HTTPException(status_code=409, detail="A profile is already being taken.")
+        self.stacks = Counter()
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+
+    def stop(self):
+        """Stops sampling and returns the stack counts."""
+        if self.stacks is None:
+            return Counter()
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        # A signal still on its way would end the process with the default action
+        signal.signal(signal.SIGPROF, signal.SIG_IGN)
+        stacks, self.stacks = self.stacks, None
+        return stacks
+
+    def _sample(self, signum, frame):
+        frames = []
+        while frame is not None:
+            frames.append(_frame_name(frame.f_code))
+            frame = frame.f_back
+        self.stacks[";".join(reversed(frames))] += 1
+
+
+def collapsed(stacks: dict, prefix: str = ""):
+    """Renders {stack: count} as collapsed-stack lines, heaviest first."""
+    return "".join(f"{prefix}{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
+
+
+sampler = Sampler()
+
+
+def start_profile(interval: float):
+    sampler.start(interval)
+
+
+def stop_profile():
+    # Plain data, so engine processes can send theirs to the front end in sharded mode
+    return dict(sampler.stop())
@@ -0,0 +1,103 @@
+from fastapi import HTTPException
+import json
+import math
+
+# Bulk provisioning: traders and stocks are streamed in as NDJSON, one JSON object per line,
+# with the fields of the seed file's items. Records are parsed and added a chunk at a time as
+# the request body arrives, so the import never holds the whole body, and trading continues
+# between chunks.
+
+
+def _invalid(number: int, problem: str):
+    return HTTPException(status_code=400, detail=f"Record {number}: {problem}. The chunks before its chunk were imported.")
+
+
+async def ndjson_chunks(stream, chunk_size: int):
+    """Yields (records, count) for the records of an NDJSON byte stream in lists of up to `chunk_size`, skipping blank lines.
+
+    `count` is the number of records yielded before, to number them in errors.
+    """
+    pending = b""
+    lines = []
+    count = 0
+    async for data in stream:
+        *complete, pending = (pending + data).split(b"\n")
+        lines.extend(line for line in complete if line.strip())
+        while len(lines) >= chunk_size:
+            yield _parse(lines[:chunk_size], count), count
+            count += chunk_size
+            del lines[:chunk_size]
+    if pending.strip():
+        lines.append(pending)
+    if lines:
+        yield _parse(lines, count), count
+
+
+def _parse(lines: list, count: int):
+    # One call parses the whole chunk. A line holding more than one value would add records, so the count is checked
+    try:
+        records = json.loads(b"[" + b",".join(lines) + b"]")
+        if len(records) == len(lines) and all(type(record) is dict for record in records):
+            return records
+    except ValueError:
+        pass
+    records = []
+    for number, line in enumerate(lines, count + 1):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise _invalid(number, "invalid JSON")
+        if type(record) is not dict:
+            raise _invalid(number, "expected a JSON object")
+        records.append(record)
+    return records
+
+
+def _check(records: list, count: int, fields: dict):
+    """Raises a 400 for the first record missing one of the fields, or holding a value of the wrong type."""
+    for number, record in enumerate(records, count + 1):
+        for field, types in fields.items():
+            value = record.get(field)
+            if type(value) not in types:
+                raise _invalid(number, f"{field!r} is missing or has the wrong type")
+
+
+TRADER_FIELDS = {"id": (str,), "name": (str,), "money": (float, int)}
+STOCK_FIELDS = {"id": (str,), "name": (str,), "currentPrice": (float, int), "amount": (int,)}
+
+
+def _valid_money(value):
+    # Not a bool, whose type isn't int, nor negative, infinite or NaN
+    return type(value) in TRADER_FIELDS["money"] and 0 <= value < math.inf
+
+
+def trader_columns(records: list, count: int):
+    """Returns the traders' (ids, names, money) columns, `count` being the number of records before these."""
+    try:
+        ids = [record["id"] for record in records]
+        names = [record["name"] for record in records]
+        money = [record["money"] for record in records]
+        valid = (
+            all(type(value) is str for value in ids) and all(type(value) is str for value in names)
+            and all(_valid_money(value) for value in money)
+        )
+    except KeyError:
+        valid = False
+    if not valid:
+        # Find the first invalid record to report it
+        _check(records, count, TRADER_FIELDS)
+        for number, record in enumerate(records, count + 1):
+            if not _valid_money(record["money"]):
+                raise _invalid(number, "'money' must not be negative")
+    return ids, names, [float(value) for value in money]
+
+
+def stock_rows(records: list, count: int):
+    """Returns the stocks as (id, name, price, amount) tuples, `count` being the number of records before these."""
+    _check(records, count, STOCK_FIELDS)
+    stocks = [(record["id"], record["name"], float(record["currentPrice"]), record["amount"]) for record in records]
+    for number, (_, _, price, amount) in enumerate(stocks, count + 1):
+        if not 0 < price < math.inf or amount <= 0:
+            # A stock without shares would leave the stock market an empty sell order to match against
+            raise _invalid(number, "'currentPrice' and 'amount' must be positive")
+    return stocks
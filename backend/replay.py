@@ -0,0 +1,142 @@
+"""Headless replay of order flow through the matching engine on a simulated clock.
+
+Runs an order stream, or a strategy generating one, through the same matching code as the
+server, without HTTP and without waiting for market events, then writes the fills and the
+final state. Run from the repository root, for example:
+
+    python -m backend.replay --orders orders.jsonl --output results
+    python -m backend.replay --orders journal --market-interval 0 --output results
+    python -m backend.replay --strategy strategies.momentum:orders --seed 7 --output results
+
+The order stream is a JSON-lines file, or a journal directory, of records in the journal's
+format, e.g. {"type": "BUY", "trader_id": "1", "stock_id": "2", "price": 101.5, "amount": 10}
+with "SELL", "CANCEL_BUY", "CANCEL_SELL" and "PRICES" records alike. A record may carry a
+"time", as an ISO timestamp or as seconds since the start, to move the simulated clock;
+market events are drawn by the seeded market simulator every `--market-interval` simulated
+seconds. With the same inputs and seed, a replay always produces the same fills.
+"""
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from .database import load_data, trade_log, clock, market_simulator, run_market_event
+from .engine import replay_record
+from .journal import read_records
+from .views import stocks_view, traders_view
+from .config import MARKET_EVENT_INTERVAL, SEED_FILE
+import argparse
+import datetime
+import importlib
+import json
+import os
+import random
+import time
+
+
+def read_order_stream(path: str):
+    """Yields the records of a JSON-lines order stream, or of a journal directory."""
+    if os.path.isdir(path):
+        yield from read_records(path, 0)
+        return
+    with open(path, "r") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def load_strategy(spec: str):
+    """Imports a strategy given as "module:function"."""
+    module_name, _, function_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def record_time(value, start: datetime.datetime):
+    """Returns the time of a record, given as an ISO timestamp or as seconds since the start."""
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    return start + datetime.timedelta(seconds=value)
+
+
+def run_replay(records, start: datetime.datetime, market_interval: float, on_fill):
+    """Applies order-stream records on a simulated clock starting at `start`, calling `on_fill` with every fill.
+
+    Returns the number of records applied and rejected, and the number of fills and market events.
+    """
+    clock.simulate(start)
+    interval = datetime.timedelta(seconds=market_interval)
+    next_market_event = start + interval if market_interval > 0 else None
+    applied = rejected = market_events = 0
+    first_fill = fills_from = trade_log.count
+
+    for record in records:
+        if record["type"] == "FILL":
+            # Fills are produced again by the matching engine
+            continue
+
+        if "time" in record:
+            now = record_time(record["time"], start)
+            while next_market_event is not None and next_market_event <= now:
+                clock.advance_to(next_market_event)
+                run_market_event()
+                market_events += 1
+                next_market_event += interval
+            clock.advance_to(now)
+
+        try:
+            replay_record(record)
+        except HTTPException:
+            rejected += 1
+        applied += 1
+
+        for offset in range(fills_from, trade_log.count):
+            on_fill(trade_log.fill(offset))
+        fills_from = trade_log.count
+
+    clock.use_system_time()
+    return {"records": applied, "rejected": rejected, "fills": trade_log.count - first_fill, "market_events": market_events}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--orders", help="Order stream to replay: a JSON-lines file or a journal directory")
+    source.add_argument("--strategy", help='Function generating the order stream, as "module:function". It is called with a random.Random')
+    parser.add_argument("--seed-file", default=SEED_FILE, help="Stocks and traders to start from")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the market events and of the strategy")
+    parser.add_argument("--start", default="2024-01-01T09:30:00", help="Simulated time the replay starts at")
+    parser.add_argument("--market-interval", type=float, default=MARKET_EVENT_INTERVAL,
+                        help="Simulated seconds between market events, 0 disables them (e.g. when replaying a journal)")
+    parser.add_argument("--output", help="Directory to write fills.jsonl and state.json to")
+    args = parser.parse_args()
+
+    load_data(args.seed_file)
+    market_simulator.seed(args.seed)
+    if args.orders:
+        records = read_order_stream(args.orders)
+    else:
+        records = load_strategy(args.strategy)(random.Random(args.seed))
+
+    fills_file = None
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        fills_file = open(os.path.join(args.output, "fills.jsonl"), "w")
+
+    def on_fill(fill: dict):
+        if fills_file is not None:
+            fills_file.write(json.dumps(fill) + "\n")
+
+    started = time.perf_counter()
+    summary = run_replay(records, datetime.datetime.fromisoformat(args.start), args.market_interval, on_fill)
+    elapsed = time.perf_counter() - started
+
+    if fills_file is not None:
+        fills_file.close()
+        with open(os.path.join(args.output, "state.json"), "w") as file:
+            json.dump(jsonable_encoder({"summary": summary, "stocks": stocks_view(), "traders": traders_view()}), file, indent=2)
+
+    print(
+        f"{summary['records']} records ({summary['rejected']} rejected), {summary['fills']} fills, "
+        f"{summary['market_events']} market events in {elapsed:.2f}s, {summary['records'] / max(elapsed, 1e-9):.0f} records/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+from multiprocessing import shared_memory
+from fastapi.responses import JSONResponse, Response
+from .database import stocks_db, traders_db, response_cache
+from .response_cache import etag_matches
+from .serialization import MEDIA_TYPES, encode, negotiate
+from .views import stocks_view, stock_view, trader_view, trader_names_view
+import json
+import struct
+import zlib
+
+# Read replicas: the process running the matching engine publishes the bodies of /stocks,
+# /stock/{id}, /trader/{id} and /trader-names into a shared-memory region, and any number of
+# read-only worker processes serve those GETs straight from it.
+#
+# The region holds two buffers. The publisher writes the one readers aren't directed to, then
+# points them at it, so it never waits for a reader. Each buffer has a sequence number that is
+# odd while it's being written (a seqlock): a reader copies a body out, and retries if the
+# sequence number changed meanwhile. A buffer is an open-addressing hash table of keys
+# followed by an arena of (key, ETag, body) entries. Changed bodies are appended to the arena,
+# and the buffer is rebuilt, copying unchanged entries from the other buffer, once it's full.
+
+REGION_MAGIC = b"BURSERP1"
+REGION_HEADER = struct.Struct("<8sqq")  # magic, size of each buffer, buffer readers are directed to (-1 until the first publish)
+BUFFER_HEADER = struct.Struct("<qqqq")  # sequence number, version (publish count), table capacity, arena bytes used
+SLOT = struct.Struct("<IIqII")  # key hash, key length (0 for an empty slot), entry offset in the arena, ETag length, body length
+DATA_START = 128  # After the region header and both buffer headers
+
+NOT_SERVED = {"detail": "Read replicas only serve /stocks, /stock/{stock_id}, /trader/{trader_id} and /trader-names."}
+
+
+def _key_hash(key: bytes):
+    # Unlike hash(), the same in every process
+    return zlib.crc32(key)
+
+
+def _buffer_header_offset(buffer: int):
+    return REGION_HEADER.size + buffer * BUFFER_HEADER.size
+
+
+def _attach(name: str):
+    """Attaches to an existing shared-memory region without letting this process's exit remove it."""
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Before Python 3.13 every process attaching registers the region to be removed when it exits
+        from multiprocessing import resource_tracker
+        region = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(region._name, "shared_memory")
+        return region
+
+
+class _Buffer:
+    """Layout of one of the region's two buffers."""
+
+    def __init__(self, region, index: int, size: int):
+        self.region = region
+        self.index = index
+        self.start = DATA_START + index * size
+        self.size = size
+
+    def header(self):
+        return BUFFER_HEADER.unpack_from(self.region.buf, _buffer_header_offset(self.index))
+
+    def find(self, key: bytes, key_hash: int, capacity: int):
+        """Returns the slot of the key, or of the empty slot where it would go, and the slot's fields."""
+        buf = self.region.buf
+        mask = capacity - 1
+        arena = self.start + capacity * SLOT.size
+        slot = key_hash & mask
+        for _ in range(capacity):
+            fields = SLOT.unpack_from(buf, self.start + slot * SLOT.size)
+            slot_hash, key_length, offset, _, _ = fields
+            if key_length == 0:
+                return slot, fields
+            if slot_hash == key_hash and key_length == len(key) and buf[arena + offset:arena + offset + key_length] == key:
+                return slot, fields
+            slot = (slot + 1) & mask
+        return None, None
+
+
+class ReplicaPublisher:
+    """Writes the bodies of the replicated GET responses to the shared-memory region.
+
+    `publish` runs on the event loop between sequencer commands, so it sees a consistent
+    state, and only renders the bodies of stocks and traders bumped in the response cache
+    since the buffer was last written.
+    """
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+        self.version = 0
+        self._region = None
+        self._buffers = []
+        self._active = -1
+        self._pending = [None, None]  # Keys changed since each buffer was written, None to rebuild it
+        self._capacities = [0, 0]  # Slots in each buffer's table
+        self._used = [0, 0]  # Bytes used in each buffer's arena
+        self._counts = [0, 0]  # Keys in each buffer
+
+    def open(self):
+        try:
+            stale = shared_memory.SharedMemory(self.name)
+        except FileNotFoundError:
+            pass
+        else:
+            # Left behind by a previous run that didn't shut down cleanly
+            stale.close()
+            stale.unlink()
+        self._region = shared_memory.SharedMemory(self.name, create=True, size=self.size)
+        buffer_size = (self.size - DATA_START) // 2 // 8 * 8
+        self._buffers = [_Buffer(self._region, index, buffer_size) for index in range(2)]
+        buf = self._region.buf
+        buf[:DATA_START] = bytes(DATA_START)
+        REGION_HEADER.pack_into(buf, 0, REGION_MAGIC, buffer_size, -1)
+        response_cache.changed = set()
+        self.publish()
+
+        # Offsets are relative to the buffer, so the second buffer starts as a copy of the first
+        first, second = self._buffers
+        length = self._capacities[0] * SLOT.size + self._used[0]
+        buf[second.start:second.start + length] = buf[first.start:first.start + length]
+        self._capacities[1], self._used[1], self._counts[1] = self._capacities[0], self._used[0], self._counts[0]
+        self._pending[1] = set()
+        BUFFER_HEADER.pack_into(buf, _buffer_header_offset(1), 0, self.version, self._capacities[1], self._used[1])
+
+    def close(self):
+        if self._region is not None:
+            response_cache.changed = None
+            self._region.close()
+            self._region.unlink()
+            self._region = None
+
+    def _changed_keys(self):
+        keys = set()
+        for kind, entity_id in response_cache.changed:
+            if kind == "stock":
+                keys.add("stocks")
+                keys.add(f"stock/{entity_id}")
+            elif kind == "trader":
+                keys.add(f"trader/{entity_id}")
+            elif kind == "trader-names":
+                keys.add("trader-names")
+        response_cache.changed.clear()
+        return keys
+
+    def _all_keys(self):
+        keys = ["stocks", "trader-names"]
+        keys.extend(f"stock/{stock_id}" for stock_id in stocks_db)
+        keys.extend(f"trader/{trader_id}" for trader_id in traders_db)
+        return keys
+
+    def _render(self, key: str):
+        """Returns the ETag and body of the GET response for a key, as the writer itself would serve them."""
+        kind, _, entity_id = key.partition("/")
+        if kind == "stocks":
+            cache_key, version, render = ("stocks",), response_cache.version("stock"), stocks_view
+        elif kind == "trader-names":
+            cache_key, version, render = ("trader-names",), response_cache.version("trader-names"), trader_names_view
+        elif kind == "stock":
+            cache_key, version, render = ("stock", entity_id), response_cache.version("stock", entity_id), lambda: stock_view(entity_id)
+        else:
+            cache_key, version, render = ("trader", entity_id), response_cache.version("trader", entity_id), lambda: trader_view(entity_id)
+        return response_cache.etag(cache_key, version).encode(), encode(render())
+
+    def _write(self, buffer: _Buffer, key: str, etag: bytes, body: bytes):
+        """Adds or replaces a key's entry, returning False if the buffer has no room for it."""
+        index = buffer.index
+        capacity, used = self._capacities[index], self._used[index]
+        key_bytes = key.encode()
+        key_hash = _key_hash(key_bytes)
+        slot, fields = buffer.find(key_bytes, key_hash, capacity)
+        is_new = fields[1] == 0
+        # Half the slots at most are used, so probe sequences stay short
+        if is_new and 2 * (self._counts[index] + 1) > capacity:
+            return False
+        arena = buffer.start + capacity * SLOT.size
+        length = len(key_bytes) + len(etag) + len(body)
+        if arena + used + length > buffer.start + buffer.size:
+            return False
+
+        buf = self._region.buf
+        position = arena + used
+        buf[position:position + length] = key_bytes + etag + body
+        SLOT.pack_into(buf, buffer.start + slot * SLOT.size, key_hash, len(key_bytes), used, len(etag), len(body))
+        self._used[index] += length
+        self._counts[index] += is_new
+        return True
+
+    def _rebuild(self, buffer: _Buffer):
+        """Rewrites a buffer with every key, copying the entries that are current in the other buffer."""
+        keys = self._all_keys()
+        capacity = 64
+        while capacity < 2 * len(keys):
+            capacity *= 2
+        if buffer.start + capacity * SLOT.size > buffer.start + buffer.size:
+            raise RuntimeError("SHARED_STATE_SIZE is too small for the replicated responses")
+
+        buf = self._region.buf
+        buf[buffer.start:buffer.start + capacity * SLOT.size] = bytes(capacity * SLOT.size)
+        self._capacities[buffer.index] = capacity
+        self._used[buffer.index] = 0
+        self._counts[buffer.index] = 0
+
+        other = self._buffers[1 - buffer.index]
+        stale = self._pending[other.index]
+        if stale is None:
+            # The other buffer was never written
+            other = None
+        else:
+            other_capacity = self._capacities[other.index]
+            other_arena = other.start + other_capacity * SLOT.size
+        for key in keys:
+            etag = body = None
+            if other is not None and key not in stale:
+                key_bytes = key.encode()
+                _, (_, key_length, offset, etag_length, body_length) = other.find(key_bytes, _key_hash(key_bytes), other_capacity)
+                if key_length:
+                    position = other_arena + offset + key_length
+                    etag = bytes(buf[position:position + etag_length])
+                    body = bytes(buf[position + etag_length:position + etag_length + body_length])
+            if etag is None:
+                etag, body = self._render(key)
+            if not self._write(buffer, key, etag, body):
+                raise RuntimeError("SHARED_STATE_SIZE is too small for the replicated responses")
+
+    def publish(self):
+        """Writes the responses changed since the last publish to the buffer readers aren't using, then directs readers to it."""
+        changed = self._changed_keys()
+        for pending in self._pending:
+            if pending is not None:
+                pending |= changed
+
+        index = 0 if self._active != 0 else 1
+        buffer = self._buffers[index]
+        buf = self._region.buf
+        header_offset = _buffer_header_offset(index)
+        sequence, version, _, _ = buffer.header()
+        # Readers still reading the buffer from before the last publish retry once they see the odd sequence number
+        BUFFER_HEADER.pack_into(buf, header_offset, sequence + 1, version, self._capacities[index], self._used[index])
+        pending = self._pending[index]
+        if pending is None or not all(self._write(buffer, key, *self._render(key)) for key in pending):
+            self._rebuild(buffer)
+        self.version += 1
+        BUFFER_HEADER.pack_into(buf, header_offset, sequence + 2, self.version, self._capacities[index], self._used[index])
+        self._pending[index] = set()
+
+        self._active = index
+        REGION_HEADER.pack_into(buf, 0, REGION_MAGIC, buffer.size, index)
+
+
+class ReplicaReader:
+    """Reads the responses published by a `ReplicaPublisher` from the shared-memory region."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._region = None
+        self._buffers = []
+
+    def _open(self):
+        try:
+            region = _attach(self.name)
+        except FileNotFoundError:
+            return False
+        magic, buffer_size, _ = REGION_HEADER.unpack_from(region.buf)
+        if magic != REGION_MAGIC:
+            # Created, not initialized yet
+            region.close()
+            return False
+        self._region = region
+        self._buffers = [_Buffer(region, index, buffer_size) for index in range(2)]
+        return True
+
+    def close(self):
+        if self._region is not None:
+            self._buffers = []
+            self._region.close()
+            self._region = None
+
+    def get(self, key: str):
+        """Returns the (version, etag, body) published for the key, (version, None, None) if there is none, or None before the first publish."""
+        if self._region is None and not self._open():
+            return None
+        buf = self._region.buf
+        key_bytes = key.encode()
+        key_hash = _key_hash(key_bytes)
+        while True:
+            _, _, active = REGION_HEADER.unpack_from(buf)
+            if active < 0:
+                return None
+            buffer = self._buffers[active]
+            sequence, version, capacity, _ = buffer.header()
+            if sequence & 1:
+                continue
+            try:
+                _, fields = buffer.find(key_bytes, key_hash, capacity)
+                etag = body = None
+                if fields is not None and fields[1]:
+                    _, key_length, offset, etag_length, body_length = fields
+                    position = buffer.start + capacity * SLOT.size + offset + key_length
+                    etag = bytes(buf[position:position + etag_length])
+                    body = bytes(buf[position + etag_length:position + etag_length + body_length])
+            except (struct.error, ValueError, ZeroDivisionError):
+                # Read while the publisher was rewriting the buffer, checked below
+                pass
+            if buffer.header()[0] == sequence:
+                return version, etag, body
+
+
+def _msgpack_response(etag: str, body: bytes):
+    """Returns the MessagePack ETag and body of a published JSON response, as the primary would serve them."""
+    # The primary tags each format on its own, with the format before the version (see `ResponseCache.get`)
+    prefix, version = etag[:-1].rsplit("-", 1)
+    return f'{prefix}-msgpack-{version}"', encode(json.loads(body), "msgpack")
+
+
+class ReplicaMiddleware:
+    """ASGI middleware of read-replica workers: serves the replicated GETs from shared memory and turns away everything else."""
+
+    def __init__(self, app, reader: ReplicaReader):
+        self.app = app
+        self.reader = reader
+
+    def _key(self, scope):
+        if scope["method"] not in ("GET", "HEAD"):
+            return None
+        parts = scope["path"].strip("/").split("/")
+        if parts in (["stocks"], ["trader-names"]):
+            return parts[0]
+        if len(parts) == 2 and parts[0] in ("stock", "trader") and parts[1]:
+            return "/".join(parts)
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.app(scope, receive, send)
+            return
+        if scope["type"] != "http":
+            # Market-data streams are served by the primary
+            await receive()
+            await send({"type": "websocket.close", "code": 1008})
+            return
+
+        key = self._key(scope)
+        if key is None:
+            response = JSONResponse(NOT_SERVED, status_code=421)
+        else:
+            published = self.reader.get(key)
+            if published is None:
+                response = JSONResponse({"detail": "Waiting for the primary to publish."}, status_code=503, headers={"Retry-After": "1"})
+            else:
+                version, etag, body = published
+                if body is None:
+                    detail = "Stock not found" if key.startswith("stock/") else "Trader not found"
+                    response = JSONResponse({"detail": detail}, status_code=404)
+                else:
+                    request_headers = dict(scope["headers"])
+                    format = negotiate(request_headers.get(b"accept", b"").decode("latin-1"))
+                    etag = etag.decode()
+                    if format == "msgpack":
+                        # Only JSON is published, MessagePack bodies are converted from it
+                        etag, body = _msgpack_response(etag, body)
+                    headers = {"ETag": etag, "Vary": "Accept", "X-Replica-Version": str(version)}
+                    if_none_match = request_headers.get(b"if-none-match")
+                    if if_none_match and etag_matches(if_none_match.decode("latin-1"), etag):
+                        response = Response(status_code=304, headers=headers)
+                    else:
+                        response = Response(content=body, media_type=MEDIA_TYPES[format], headers=headers)
+        await response(scope, receive, send)
@@ -0,0 +1,57 @@
+from .serialization import encode
+import uuid
+
+
+class ResponseCache:
+    """Serialized GET responses, reused until the entities they show change.
+
+    Every stock and trader has a version that the engine bumps whenever it changes, and
+    each collection ("stock", "trader") has a version bumped along with any of its
+    entities. A cached body is served as long as the version it was rendered at is
+    current, and the version doubles as the response's ETag.
+    """
+
+    def __init__(self):
+        self.changed = None  # (kind, entity_id) bumped since it was last emptied, tracked while a set is assigned
+        self.clear()
+
+    def clear(self):
+        # Included in ETags so they don't match responses from before a restart or a reload
+        self._epoch = uuid.uuid4().hex[:8]
+        self._versions = {}  # (kind, entity_id) -> version
+        self._collection_versions = {}  # kind -> version
+        self._entries = {}  # key -> (version, etag, body)
+
+    def bump(self, kind: str, entity_id: str = None):
+        """Marks an entity, and its collection, as changed, or only the collection if no ID is given."""
+        key = (kind, entity_id)
+        if entity_id is not None:
+            self._versions[key] = self._versions.get(key, 0) + 1
+        self._collection_versions[kind] = self._collection_versions.get(kind, 0) + 1
+        if self.changed is not None:
+            self.changed.add(key)
+
+    def version(self, kind: str, entity_id: str = None):
+        """Returns the version of an entity, or of the whole collection if no ID is given."""
+        if entity_id is None:
+            return self._collection_versions.get(kind, 0)
+        return self._versions.get((kind, entity_id), 0)
+
+    def get(self, key: tuple, version: int, render, format: str = "json"):
+        """Returns the (etag, body) cached for the key at this version in the format, rendering and caching it if needed."""
+        if format != "json":
+            # Each format is cached, and tagged, on its own
+            key = key + (format,)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            body = encode(render(), format)
+            entry = self._entries[key] = (version, self.etag(key, version), body)
+        return entry[1], entry[2]
+
+    def etag(self, key: tuple, version: int):
+        return f'"{self._epoch}-{"-".join(key)}-{version}"'
+
+
+def etag_matches(if_none_match: str, etag: str):
+    """Returns whether an If-None-Match header matches the ETag, meaning the client already has the response."""
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
@@ -0,0 +1,185 @@
+"""Readers for the seed file of stocks and traders, and a compiler to its binary format.
+
+A JSON seed ({"shares": [...], "traders": [...]}) is parsed one item at a time, so the whole
+document is never held in memory. For large markets, compile it to the binary format, which
+is memory-mapped and read as whole columns. Run from the repository root, for example:
+
+    python -m backend.seed BurseJson.json BurseJson.seed
+
+and start the server with SEED_FILE=BurseJson.seed.
+"""
+from array import array
+import argparse
+import json
+import mmap
+import re
+import struct
+import sys
+
+# Binary seed: the magic, the stock and trader counts, then the sections whose lengths follow.
+# Stocks are a small JSON list of [id, name, price, amount]. Traders are three columns: their
+# IDs and names as "\0"-separated UTF-8, and their money as native doubles.
+SEED_MAGIC = b"BURSESD1"
+SEED_HEADER = struct.Struct("<8sqqqqqq")  # magic, stock count, trader count, then the byte length of each section
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def _stream_json_seed(path: str):
+    """Yields (key, item) for the items of the arrays in the seed's top-level object, reading a chunk at a time."""
+    raw_decode = json.JSONDecoder().raw_decode
+    skip = WHITESPACE.match
+    with open(path, "r", encoding="utf-8") as file:
+        buffer = ""
+        position = 0
+        at_end = False
+
+        def fill():
+            # Drops what was parsed and reads the next chunk
+            nonlocal buffer, position, at_end
+            chunk = file.read(CHUNK_SIZE)
+            buffer = buffer[position:] + chunk
+            position = 0
+            at_end = not chunk
+
+        def next_char():
+            # Skips whitespace and returns the next character, "" at the end of the file
+            nonlocal position
+            position = skip(buffer, position).end()
+            while position == len(buffer) and not at_end:
+                fill()
+                position = skip(buffer, position).end()
+            return buffer[position:position + 1]
+
+        def next_value():
+            nonlocal position
+            next_char()
+            while True:
+                try:
+                    value, end = raw_decode(buffer, position)
+                    # A number at the end of the buffer may continue in the next chunk
+                    if end < len(buffer) or at_end:
+                        position = end
+                        return value
+                except json.JSONDecodeError:
+                    if at_end:
+                        raise
+                fill()
+
+        def expect(char: str):
+            nonlocal position
+            if next_char() != char:
+                raise ValueError(f"Expected {char!r} in the seed file")
+            position += 1
+
+        expect("{")
+        if next_char() == "}":
+            return
+        while True:
+            key = next_value()
+            expect(":")
+            if next_char() != "[":
+                next_value()
+            else:
+                position += 1
+                if next_char() == "]":
+                    position += 1
+                else:
+                    while True:
+                        yield key, next_value()
+                        # Most items are followed by a comma in the same chunk, checked without a call
+                        if buffer.startswith(",", position):
+                            position += 1
+                            continue
+                        separator = next_char()
+                        position += 1
+                        if separator == "]":
+                            break
+                        if separator != ",":
+                            raise ValueError("Expected ',' or ']' in the seed file")
+            if next_char() == "}":
+                return
+            expect(",")
+
+
+def read_json_seed(path: str):
+    """Reads a JSON seed into a list of (id, name, price, amount) stocks and the traders' (ids, names, money) columns."""
+    stocks = []
+    ids, names, money = [], [], []
+    for key, item in _stream_json_seed(path):
+        if key == "shares":
+            stocks.append((item["id"], item["name"], float(item["currentPrice"]), item["amount"]))
+        elif key == "traders":
+            ids.append(item["id"])
+            names.append(item["name"])
+            money.append(float(item["money"]))
+    return stocks, (ids, names, money)
+
+
+def read_binary_seed(path: str):
+    """Reads a binary seed written by `write_binary_seed`, returning the same as `read_json_seed`."""
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        magic, stock_count, trader_count, stocks_size, ids_size, names_size, money_size = SEED_HEADER.unpack_from(mapped)
+        if magic != SEED_MAGIC:
+            raise ValueError(f"{path} is not a binary seed file")
+
+        offset = SEED_HEADER.size
+        stocks = [tuple(stock) for stock in json.loads(mapped[offset:offset + stocks_size])]
+        offset += stocks_size
+        ids = mapped[offset:offset + ids_size].decode("utf-8").split("\0") if trader_count else []
+        offset += ids_size
+        names = mapped[offset:offset + names_size].decode("utf-8").split("\0") if trader_count else []
+        offset += names_size
+        money = array("d")
+        money.frombytes(mapped[offset:offset + money_size])
+
+    if len(stocks) != stock_count or not len(ids) == len(names) == len(money) == trader_count:
+        raise ValueError(f"{path} is truncated")
+    return stocks, (ids, names, money.tolist())
+
+
+def is_binary_seed(path: str):
+    with open(path, "rb") as file:
+        return file.read(len(SEED_MAGIC)) == SEED_MAGIC
+
+
+def read_seed(path: str):
+    """Reads a seed file in either format, returning a list of (id, name, price, amount) stocks and the traders' (ids, names, money) columns."""
+    if is_binary_seed(path):
+        return read_binary_seed(path)
+    return read_json_seed(path)
+
+
+def write_binary_seed(path: str, stocks: list, traders: tuple):
+    """Writes stocks and the traders' (ids, names, money) columns as a binary seed."""
+    ids, names, money = traders
+    for value in (*ids, *names):
+        if "\0" in value:
+            raise ValueError(f"Trader IDs and names can't contain NUL characters: {value!r}")
+
+    sections = [
+        json.dumps([list(stock) for stock in stocks]).encode("utf-8"),
+        "\0".join(ids).encode("utf-8"),
+        "\0".join(names).encode("utf-8"),
+        array("d", money).tobytes(),
+    ]
+    with open(path, "wb") as file:
+        file.write(SEED_HEADER.pack(SEED_MAGIC, len(stocks), len(ids), *(len(section) for section in sections)))
+        for section in sections:
+            file.write(section)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compiles a JSON seed file to the binary seed format.")
+    parser.add_argument("source", help="JSON seed file")
+    parser.add_argument("destination", help="Binary seed file to write")
+    args = parser.parse_args()
+
+    stocks, traders = read_json_seed(args.source)
+    write_binary_seed(args.destination, stocks, traders)
+    print(f"Wrote {len(stocks)} stocks and {len(traders[0])} traders to {args.destination}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import asyncio
+import zlib
+
+
+def shard_of(stock_id: str, shard_count: int):
+    """Returns the index of the shard that owns the stock."""
+    return zlib.crc32(stock_id.encode()) % shard_count
+
+
+class Sequencer:
+    """Single writer for the order books.
+
+    Stocks are spread over shards by hashing their ID. Each shard is one asyncio task
+    reading commands from a bounded queue and running them one at a time, so a stock's
+    book is only ever changed by its shard's task and no lock is needed. Submitting to
+    a full queue waits until the shard catches up.
+    """
+
+    def __init__(self, shard_count: int, queue_size: int):
+        self.shard_count = shard_count
+        self.queue_size = queue_size
+        self._queues = []
+        self._tasks = []
+
+    def start(self):
+        """Starts the shard tasks on the running event loop."""
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.shard_count)]
+        self._tasks = [asyncio.create_task(self._run(queue)) for queue in self._queues]
+
+    async def stop(self):
+        """Cancels the shard tasks, dropping any queued commands."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._queues = []
+        self._tasks = []
+
+    def queue_depths(self):
+        """Returns the number of commands waiting in each shard's queue."""
+        return [queue.qsize() for queue in self._queues]
+
+    async def submit(self, stock_id: str, command, *args):
+        """Queues a command on the stock's shard and waits for its result."""
+        if not self._tasks:
+            self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[shard_of(stock_id, self.shard_count)].put((command, args, future))
+        return await future
+
+    async def _run(self, queue: asyncio.Queue):
+        while True:
+            # A queued command is returned without suspending, so yield to let requests and reads run
+            # between commands instead of draining a long queue in one go
+            await asyncio.sleep(0)
+            command, args, future = await queue.get()
+            if future.cancelled():
+                # The request went away while the command was queued
+                continue
+            try:
+                result = command(*args)
+            except Exception as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
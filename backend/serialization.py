@@ -0,0 +1,27 @@
+from pydantic_core import to_json, to_jsonable_python
+import msgpack
+
+# Response bodies are encoded straight to bytes by pydantic-core, which walks dicts, lists,
+# pydantic models and datetimes natively instead of building a JSON-compatible copy first.
+# Clients that accept MessagePack get the same data in that format.
+
+MEDIA_TYPES = {"json": "application/json", "msgpack": "application/msgpack"}
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+
+def negotiate(accept: str):
+    """Returns the response format for an Accept header: "msgpack" if it asks for MessagePack, "json" otherwise."""
+    if accept:
+        for media_range in accept.split(","):
+            media_type, _, parameters = media_range.partition(";")
+            if media_type.strip().lower() in MSGPACK_MEDIA_TYPES and parameters.replace(" ", "") not in ("q=0", "q=0.0"):
+                return "msgpack"
+    return "json"
+
+
+def encode(content, format: str = "json"):
+    """Encodes response content, built of dicts, lists, pydantic models and datetimes, in the format."""
+    if format == "msgpack":
+        # Datetimes become ISO strings, as in JSON responses
+        return msgpack.packb(to_jsonable_python(content), use_bin_type=True)
+    return to_json(content)
@@ -0,0 +1,440 @@
+from fastapi import HTTPException
+from multiprocessing import shared_memory
+from .database import load_data, keep_stocks, add_stocks, add_traders, stocks_db, traders_db, trader_order, order_books, trade_log, trade_archive, accounts, feed, market_simulator, run_market_event
+from .accounts import AccountService, LOCK_STRIPES
+from .market_data import Relay, quote_message
+from .portfolio import STOCK_MARKET_ID, Ranking
+from .sequencer import shard_of
+from .views import stocks_view, stock_view, traders_view, traders_page_view, trader_view, last_transactions_view, history_view, trader_transactions_view, portfolio_view, portfolio_summaries_view, portfolio_changes_view
+from .config import TRADER_HISTORY_SIZE, MARKET_EVENT_INTERVAL, MARKET_SEED, ARCHIVE_DIR, ACCOUNT_CAPACITY
+import asyncio
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+
+# Sharded mode: stocks are partitioned over several engine processes by hashing their ID,
+# each running the matching engine for its own stocks. Traders' cash is shared through the
+# account service, and the front end routes every request to the process owning the stock.
+
+
+# Market data of the stocks the front end has subscribers for, sent to it after every command
+relay = Relay()
+
+
+def relay_market_data(stock_ids: list, relayed: bool):
+    """Starts or stops relaying the stocks' market data to the front end. Returns their current quotes when starting."""
+    if not relayed:
+        feed.unsubscribe(relay, stock_ids)
+        return []
+    feed.subscribe(relay, stock_ids)
+    return [quote_message(stock_id, stocks_db[stock_id].current_price, order_books[stock_id]) for stock_id in stock_ids]
+
+
+def send_relayed_updates(connection):
+    # Request ID None marks updates, which aren't the response to a command
+    updates = relay.take()
+    if updates:
+        connection.send((None, updates, None))
+
+
+def run_engine_process(index: int, shard_count: int, connection, accounts_name: str, account_locks: list):
+    """Entry point of an engine process: owns the stocks hashed to it and runs the front end's commands."""
+    load_data()
+    keep_stocks({stock_id for stock_id in stocks_db if shard_of(stock_id, shard_count) == index})
+    # Engine processes share the front end's resource tracker, which removes the region once the front end unlinks it
+    accounts.service = AccountService(shared_memory.SharedMemory(accounts_name), account_locks, trader_order)
+    if MARKET_SEED is not None:
+        # Give each process its own reproducible random numbers
+        market_simulator.seed([MARKET_SEED, index])
+    if ARCHIVE_DIR:
+        # Every process archives its own fills. There's no journal, so its trade log starts empty and continues the archive's offsets
+        trade_archive.open(os.path.join(ARCHIVE_DIR, f"engine-{index}"), trade_log)
+
+    next_market_event = time.monotonic()
+    while True:
+        # Wait for a command, or until the next market event is due
+        if not connection.poll(max(0, next_market_event - time.monotonic())):
+            run_market_event()
+            send_relayed_updates(connection)
+            next_market_event += MARKET_EVENT_INTERVAL
+            continue
+
+        request = connection.recv()
+        if request is None:
+            trade_archive.close()
+            break
+
+        request_id, command, args = request
+        try:
+            response = (request_id, command(*args), None)
+        except HTTPException as error:
+            response = (request_id, None, (error.status_code, error.detail))
+        except Exception as error:
+            response = (request_id, None, (500, repr(error)))
+        finally:
+            # Send the cash changes made by the command to the account service in one call
+            accounts.commit()
+        send_relayed_updates(connection)
+        connection.send(response)
+
+
+def transaction_time(transaction):
+    """Returns the timestamp part of a transaction ID (f"{stock_id}_{timestamp}"), for ordering."""
+    return transaction.id.rsplit("_", 1)[1]
+
+
+# Trader fields every engine process has all of, the others are split by stock
+SHARED_TRADER_FIELDS = {"id", "name", "money", "reserved_funds"}
+
+
+def merge_trader(parts: list, balance: tuple):
+    """Merges a trader's representations from every engine process, taking cash from the account service.
+
+    Only the fields the representations have are merged, they can be projected.
+    """
+    merged = dict(parts[0])
+    if "money" in merged:
+        merged["money"] = balance[0]
+    if "reserved_funds" in merged:
+        merged["reserved_funds"] = balance[1]
+    for field in ("holdings", "buy_orders", "sell_orders"):
+        if field in merged:
+            merged[field] = {}
+            for part in parts:
+                merged[field].update(part[field])
+    if "transactions" in merged:
+        transactions = [transaction for part in parts for transaction in part["transactions"]]
+        merged["transactions"] = sorted(transactions, key=transaction_time)[-TRADER_HISTORY_SIZE:]
+    return merged
+
+
+class ShardRouter:
+    """Front end of sharded mode: starts the engine processes and routes commands to them.
+
+    Each engine process reads commands from a pipe and runs them one at a time, like a
+    sequencer shard, so `submit` can be used wherever `Sequencer.submit` is.
+    """
+
+    def __init__(self, shard_count: int):
+        self.shard_count = shard_count
+        self.account_service = None
+        self._connections = []
+        self._processes = []
+        self._pending = {}  # request_id -> future
+        self._queue_depths = [0] * shard_count  # Commands sent to each engine process and not answered yet
+        self._market_values = None  # Each engine process's {trader_id: market value}, fetched by the first leaderboard request
+        self._ranking = Ranking()
+        self._request_ids = itertools.count()
+
+    def start(self):
+        """Starts the account service and the engine processes, seeding cash balances from `traders_db`."""
+        self._loop = asyncio.get_running_loop()
+        context = multiprocessing.get_context("spawn")
+
+        # Balances are written here and read and changed in place by every process
+        capacity = max(ACCOUNT_CAPACITY, 2 * len(trader_order))
+        self._account_locks = [context.Lock() for _ in range(LOCK_STRIPES)]
+        self.account_service = AccountService(
+            shared_memory.SharedMemory(create=True, size=16 * capacity), self._account_locks, trader_order
+        )
+        self.account_service.add({trader_id: (trader.money, trader.reserved_funds) for trader_id, trader in traders_db.items()})
+
+        for index in range(self.shard_count):
+            connection, engine_connection = context.Pipe()
+            process = context.Process(
+                target=run_engine_process,
+                args=(index, self.shard_count, engine_connection, self.account_service.region.name, self._account_locks),
+                name=f"engine-{index}",
+                daemon=True,
+            )
+            process.start()
+            self._connections.append(connection)
+            self._processes.append(process)
+            threading.Thread(target=self._read_responses, args=(connection,), daemon=True).start()
+
+    async def stop(self):
+        """Stops the engine processes and the account service."""
+        for connection in self._connections:
+            connection.send(None)
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join)
+        region = self.account_service.region
+        self.account_service.close()
+        region.unlink()
+        self._connections = []
+        self._processes = []
+
+    def _read_responses(self, connection):
+        while True:
+            try:
+                request_id, result, error = connection.recv()
+            except (EOFError, OSError):
+                return
+            if request_id is None:
+                self._loop.call_soon_threadsafe(feed.publish_updates, result)
+                continue
+            self._loop.call_soon_threadsafe(self._resolve, request_id, result, error)
+
+    def _resolve(self, request_id: int, result, error):
+        future = self._pending.pop(request_id)
+        if future.cancelled():
+            return
+        if error:
+            future.set_exception(HTTPException(status_code=error[0], detail=error[1]))
+        else:
+            future.set_result(result)
+
+    async def _call(self, index: int, command, args: tuple):
+        request_id = next(self._request_ids)
+        future = self._pending[request_id] = self._loop.create_future()
+        self._queue_depths[index] += 1
+        try:
+            self._connections[index].send((request_id, command, args))
+            return await future
+        finally:
+            self._queue_depths[index] -= 1
+
+    def queue_depths(self):
+        """Returns the number of commands each engine process has not answered yet."""
+        return list(self._queue_depths)
+
+    async def submit(self, stock_id: str, command, *args):
+        """Runs a command on the engine process that owns the stock and returns its result."""
+        return await self._call(shard_of(stock_id, self.shard_count), command, args)
+
+    async def broadcast(self, command, *args):
+        """Runs a command on every engine process and returns their results."""
+        return await asyncio.gather(*(self._call(index, command, args) for index in range(self.shard_count)))
+
+    def _by_shard(self, stock_ids: list):
+        shards = {}
+        for stock_id in stock_ids:
+            shards.setdefault(shard_of(stock_id, self.shard_count), []).append(stock_id)
+        return shards
+
+    async def start_relaying(self, stock_ids: list):
+        """Has the engine processes relay the stocks' market data to `feed`. Returns their current quotes."""
+        parts = await asyncio.gather(*(
+            self._call(index, relay_market_data, (shard_stock_ids, True)) for index, shard_stock_ids in self._by_shard(stock_ids).items()
+        ))
+        return [quote for part in parts for quote in part]
+
+    def stop_relaying(self, stock_ids: list):
+        """Has the engine processes stop relaying the stocks' market data, without waiting for them.
+
+        The commands are sent before this returns, so a later `start_relaying` is never overtaken by them.
+        """
+        for index, shard_stock_ids in self._by_shard(stock_ids).items():
+            request_id = next(self._request_ids)
+            self._pending[request_id] = self._loop.create_future()
+            self._connections[index].send((request_id, relay_market_data, (shard_stock_ids, False)))
+
+    async def add_traders(self, trader_ids: list, trader_names: list, trader_money: list):
+        """Opens the accounts of the traders just added to `traders_db` and adds them to every engine process."""
+        self.account_service.add({trader_id: (money, 0.0) for trader_id, money in zip(trader_ids, trader_money)})
+        await self.broadcast(add_traders, trader_ids, trader_names, trader_money)
+
+    async def add_stocks(self, stocks: list):
+        """Adds new stocks to the engine processes that own them."""
+        shards = {}
+        for stock in stocks:
+            shards.setdefault(shard_of(stock[0], self.shard_count), []).append(stock)
+        await asyncio.gather(*(self._call(index, add_stocks, (shard_stocks,)) for index, shard_stocks in shards.items()))
+
+    async def get_stocks(self):
+        parts = await self.broadcast(stocks_view)
+        stocks = {stock["id"]: stock for part in parts for stock in part}
+        # Keep the order of the seed file
+        return [stocks[stock_id] for stock_id in stocks_db if stock_id in stocks]
+
+    async def get_stock(self, stock_id: str):
+        return await self.submit(stock_id, stock_view, stock_id)
+
+    async def get_traders(self):
+        parts = await self.broadcast(traders_view)
+        balances = self.account_service.balances()
+        return [
+            merge_trader([part[position] for part in parts], balances[trader["id"]])
+            for position, trader in enumerate(parts[0])
+        ]
+
+    async def get_traders_page(self, position: int, limit: int, fields: tuple):
+        # Every process adds traders in the same order, so a page holds the same traders in each.
+        # Balances are looked up by ID, which is dropped again if it wasn't asked for
+        engine_fields = fields if "id" in fields else ("id",) + fields
+        if SHARED_TRADER_FIELDS.issuperset(fields):
+            parts = [await self._call(0, traders_page_view, (position, limit, engine_fields))]
+        else:
+            parts = await self.broadcast(traders_page_view, position, limit, engine_fields)
+        trader_ids = [trader["id"] for trader in parts[0]["traders"]]
+        balances = {}
+        if not {"money", "reserved_funds"}.isdisjoint(fields):
+            balances = self.account_service.balances(trader_ids)
+
+        traders = []
+        for index, trader_id in enumerate(trader_ids):
+            trader = merge_trader([part["traders"][index] for part in parts], balances.get(trader_id))
+            if "id" not in fields:
+                del trader["id"]
+            traders.append(trader)
+        return {"traders": traders, "next_cursor": parts[0]["next_cursor"]}
+
+    async def get_trader(self, trader_id: str):
+        parts = await self.broadcast(trader_view, trader_id)
+        money, _ = self.account_service.balance(trader_id)
+        trader = dict(parts[0])
+        trader["money"] = money
+        trader["holdings"] = {}
+        trader["buy_orders"] = []
+        trader["sell_orders"] = []
+        for part in parts:
+            trader["holdings"].update(part["holdings"])
+            trader["buy_orders"].extend(part["buy_orders"])
+            trader["sell_orders"].extend(part["sell_orders"])
+        return trader
+
+    async def get_last_transactions(self, trader_id: str):
+        parts = await self.broadcast(last_transactions_view, trader_id)
+        transactions = [transaction for part in parts for transaction in part["last_transactions"]]
+        last_transactions = sorted(transactions, key=transaction_time)[-TRADER_HISTORY_SIZE:]
+        return {"trader_id": trader_id, "last_transactions": last_transactions}
+
+    async def get_trader_history(self, trader_id: str, start, end, cursor: str, limit: int):
+        """Merges a page of the trader's archived fills from every engine process, oldest first.
+
+        The cursor holds the offset to read from in each process, "-" for a process with no
+        more fills.
+        """
+        offsets = self._cursor_offsets(cursor, "0")
+
+        pages = await asyncio.gather(*(
+            self._call(index, history_view, ("trader", trader_id, start, end, int(offset), limit))
+            for index, offset in enumerate(offsets) if offset != "-"
+        ))
+        shards = [index for index, offset in enumerate(offsets) if offset != "-"]
+        fills = heapq.merge(*(
+            [(transaction_time(transaction), index, offset, transaction) for transaction, offset in zip(page["transactions"], page["offsets"])]
+            for index, page in zip(shards, pages)
+        ))
+        transactions = []
+        taken = dict.fromkeys(shards, 0)
+        for _, index, _, transaction in itertools.islice(fills, limit):
+            transactions.append(transaction)
+            taken[index] += 1
+
+        next_offsets = list(offsets)
+        for index, page in zip(shards, pages):
+            if taken[index] < len(page["offsets"]):
+                next_offsets[index] = str(page["offsets"][taken[index]])
+            else:
+                next_offsets[index] = "-" if page["next_cursor"] is None else str(page["next_cursor"])
+        next_cursor = None if all(offset == "-" for offset in next_offsets) else ".".join(next_offsets)
+        return {"transactions": transactions, "next_cursor": next_cursor}
+
+    async def get_trader_transactions(self, trader_id: str, stock_id: str, after: str, before: str, limit: int):
+        """Merges a page of the trader's archived fills from every engine process, newest first.
+
+        The cursors hold an offset for each process, "-" for a process with nothing more to
+        read. Filtering by stock only reads the process trading it.
+        """
+        shards = range(self.shard_count) if stock_id is None else [shard_of(stock_id, self.shard_count)]
+        afters = self._cursor_offsets(after, "0")
+        befores = self._cursor_offsets(before, str(2 ** 63 - 1))
+        shards = [index for index in shards if afters[index] != "-" and befores[index] != "-"]
+
+        pages = await asyncio.gather(*(
+            self._call(index, trader_transactions_view, (trader_id, stock_id, int(afters[index]), int(befores[index]), limit))
+            for index in shards
+        ))
+        fills = heapq.merge(*(
+            [(transaction_time(transaction), index, offset, transaction) for transaction, offset in zip(page["transactions"], page["offsets"])]
+            for index, page in zip(shards, pages)
+        ), reverse=True)
+        transactions = []
+        taken = dict.fromkeys(shards, 0)
+        for _, index, _, transaction in itertools.islice(fills, limit):
+            transactions.append(transaction)
+            taken[index] += 1
+
+        next_afters = ["-"] * self.shard_count
+        next_befores = ["-"] * self.shard_count
+        for index, page in zip(shards, pages):
+            next_afters[index] = str(page["after"])
+            if taken[index] < len(page["offsets"]):
+                next_befores[index] = str(page["offsets"][taken[index]] + 1)
+            elif page["before"] is not None:
+                next_befores[index] = str(page["before"])
+        return {
+            "transactions": transactions,
+            "before": None if all(offset == "-" for offset in next_befores) else ".".join(next_befores),
+            "after": ".".join(next_afters),
+        }
+
+    def _cursor_offsets(self, cursor: str, default: str):
+        """Splits a cursor into the offsets for each engine process."""
+        if cursor is None:
+            return [default] * self.shard_count
+        offsets = cursor.split(".")
+        if len(offsets) != self.shard_count or not all(offset == "-" or offset.isdigit() for offset in offsets):
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        return offsets
+
+    async def get_portfolio(self, trader_id: str):
+        parts = await self.broadcast(portfolio_view, trader_id)
+        money, _ = self.account_service.balance(trader_id)
+        portfolio = {"trader_id": trader_id, "money": money}
+        for key in ("market_value", "cost", "realized_pnl", "unrealized_pnl"):
+            portfolio[key] = sum(part[key] for part in parts)
+        portfolio["net_worth"] = money + portfolio["market_value"]
+        portfolio["positions"] = [position for part in parts for position in part["positions"]]
+        return portfolio
+
+    async def get_leaderboard(self, count: int):
+        # Every process only values its own stocks, so the ranking is kept here. Each request gets
+        # the market values of the traders whose portfolio changed in a process since the last one,
+        # a fill changing their money too, and only they are re-ranked. The first gets every trader's
+        first = self._market_values is None
+        parts = await self.broadcast(portfolio_changes_view, first)
+        if first:
+            self._market_values = [{} for _ in range(self.shard_count)]
+        changed = set()
+        for market_values, part in zip(self._market_values, parts):
+            market_values.update(part)
+            changed.update(part)
+        top = self._ranking.top(count, changed, trader_order, self._net_worths)
+
+        trader_ids = [trader_id for trader_id, _ in top]
+        parts = await self.broadcast(portfolio_summaries_view, trader_ids)
+        balances = self.account_service.balances(trader_ids)
+        leaderboard = []
+        for rank, (trader_id, net_worth) in enumerate(top, 1):
+            summary = dict.fromkeys(parts[0][rank - 1], 0.0)
+            for part in parts:
+                for key, value in part[rank - 1].items():
+                    summary[key] += value
+            leaderboard.append({
+                "rank": rank,
+                "trader_id": trader_id,
+                "name": traders_db[trader_id].name,
+                "net_worth": net_worth,
+                "money": balances[trader_id][0],
+                **summary,
+            })
+        return leaderboard
+
+    def _net_worths(self, trader_ids):
+        # Every trader's balances are read in one pass when the ranking is rebuilt
+        balances = self.account_service.balances(None if trader_ids is trader_order else trader_ids)
+        net_worths = {}
+        for trader_id in trader_ids:
+            if trader_id == STOCK_MARKET_ID:
+                continue
+            net_worth = balances[trader_id][0]
+            for market_values in self._market_values:
+                net_worth += market_values.get(trader_id, 0.0)
+            net_worths[trader_id] = net_worth
+        return net_worths
@@ -0,0 +1,389 @@
+from array import array
+from bisect import bisect_left
+from .trade_log import TradeLog, EPOCH, MICROSECOND
+import json
+import mmap
+import os
+import struct
+
+STRINGS_FILE = "strings.jsonl"
+SEGMENT_PREFIX = "trades-"
+
+# One fill: timestamp (microseconds since the epoch), stock ID, buyer ID, buyer name, seller ID,
+# seller name, price, amount and total. Strings are indexes into the archive's string table.
+RECORD = struct.Struct("<qiiiiidqd")
+
+# Index of a sealed segment: the trader and stock entry counts, then (key, start, count) entries
+# sorted by key, traders first, then the positions in the segment of each key's fills
+INDEX_HEADER = struct.Struct("<qq")
+INDEX_ENTRY = struct.Struct("<iqq")
+
+TRADERS, STOCKS = 0, 1
+
+
+def _segment_path(directory: str, first: int, extension: str):
+    return os.path.join(directory, f"{SEGMENT_PREFIX}{first:012d}.{extension}")
+
+
+def _map(path: str):
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _SealedIndex:
+    """Postings of a sealed segment, read from its memory-mapped index file."""
+
+    def __init__(self, path: str):
+        self._data = _map(path)
+        self._counts = INDEX_HEADER.unpack_from(self._data)
+        self._positions_start = INDEX_HEADER.size + INDEX_ENTRY.size * sum(self._counts)
+
+    def positions(self, kind: int, key: int):
+        # Binary search for the key among the kind's entries, which are sorted by key
+        low = 0 if kind == TRADERS else self._counts[TRADERS]
+        high = low + self._counts[kind]
+        while low < high:
+            middle = (low + high) // 2
+            entry_key, start, count = INDEX_ENTRY.unpack_from(self._data, INDEX_HEADER.size + middle * INDEX_ENTRY.size)
+            if entry_key < key:
+                low = middle + 1
+            elif entry_key > key:
+                high = middle
+            else:
+                begin = self._positions_start + start * 4
+                positions = array("i")
+                positions.frombytes(self._data[begin:begin + count * 4])
+                return positions
+        return ()
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+
+class TradeArchive:
+    """Every fill, appended as fixed-width row records (`RECORD`) to segment files on disk.
+
+    Fills are archived at their trade-log offset, so the offset addresses a fill in both.
+    Each segment holds `segment_size` fills. The current segment's postings (the positions
+    of every trader's and stock's fills) are kept in memory. When it fills up they're
+    written to an index file next to it, and the next segment starts. Queries read
+    segments and indexes through memory maps, and fills still held by the trade log from
+    memory, so memory use doesn't grow with the number of fills archived.
+    """
+
+    def __init__(self, segment_size: int):
+        self.segment_size = segment_size
+        self.directory = None
+        self.count = 0  # Number of fills archived, the offset of the next one
+        self._last_timestamp = 0  # Timestamp of the last fill archived, records never go below it
+        self._segments = []  # First offset of every segment, the last one is being written
+        self._file = None
+        self._strings = []
+        self._string_indexes = {}
+        self._strings_file = None
+        self._postings = ({}, {})  # Positions in the current segment per trader and per stock string index
+
+    @property
+    def enabled(self):
+        return self._file is not None
+
+    def open(self, directory: str, trade_log: TradeLog):
+        """Opens the archive in a directory and lines it up with the trade log.
+
+        Fills archived past the trade log's count (e.g. not recovered from the journal) are
+        dropped, and fills the archive is missing are copied from the trade log. An empty trade
+        log (e.g. without a journal) drops nothing, its offsets start after the archived fills.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+        strings_path = os.path.join(directory, STRINGS_FILE)
+        if os.path.exists(strings_path):
+            with open(strings_path, "r", encoding="utf-8") as file:
+                self._strings = [json.loads(line) for line in file if line.endswith("\n")]
+        self._string_indexes = {value: index for index, value in enumerate(self._strings)}
+        # Rewritten so a line cut short by a crash doesn't stay in the middle of the file
+        with open(strings_path + ".tmp", "w", encoding="utf-8") as file:
+            file.writelines(json.dumps(value) + "\n" for value in self._strings)
+        os.replace(strings_path + ".tmp", strings_path)
+        self._strings_file = open(strings_path, "a", encoding="utf-8")
+
+        self._segments = sorted(
+            int(name[len(SEGMENT_PREFIX):].split(".")[0])
+            for name in os.listdir(directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(".seg")
+        )
+        if trade_log.count:
+            self._truncate(trade_log.count)
+        else:
+            self._truncate(None)
+            trade_log.start_at(self.count)
+
+        if not self._segments:
+            self._segments.append(0)
+        first = self._segments[-1]
+        self._rebuild_postings(first)
+        self._file = open(_segment_path(directory, first, "seg"), "ab")
+        if self.count:
+            with _SegmentReader(self) as reader:
+                self._last_timestamp = reader.record(self.count - 1)[0]
+
+        # Catch up with fills the trade log recorded while the archive was closed
+        self.append(trade_log, self.count)
+
+    def _truncate(self, count: int):
+        """Drops archived fills from offset `count` on, or none if it's None, and any partly written record."""
+        while self._segments and count is not None and self._segments[-1] > count:
+            first = self._segments.pop()
+            for extension in ("seg", "idx"):
+                if os.path.exists(_segment_path(self.directory, first, extension)):
+                    os.remove(_segment_path(self.directory, first, extension))
+
+        self.count = 0
+        if self._segments:
+            first = self._segments[-1]
+            path = _segment_path(self.directory, first, "seg")
+            archived = os.path.getsize(path) // RECORD.size
+            self.count = first + (archived if count is None else min(archived, count - first))
+            with open(path, "r+b") as file:
+                file.truncate((self.count - first) * RECORD.size)
+            if self.count - first < self.segment_size and os.path.exists(_segment_path(self.directory, first, "idx")):
+                # The segment is written to again, its postings are kept in memory until it's sealed
+                os.remove(_segment_path(self.directory, first, "idx"))
+
+    def _rebuild_postings(self, first: int):
+        self._postings = ({}, {})
+        path = _segment_path(self.directory, first, "seg")
+        if not os.path.exists(path):
+            return
+        data = _map(path)
+        for position in range(self.count - first):
+            _, stock_id, buyer_id, _, seller_id, _, _, _, _ = RECORD.unpack_from(data, position * RECORD.size)
+            if stock_id >= 0:
+                self._add_postings(position, stock_id, buyer_id, seller_id)
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+    def _add_postings(self, position: int, stock_id: int, buyer_id: int, seller_id: int):
+        trader_postings, stock_postings = self._postings
+        for postings, key in ((trader_postings, buyer_id), (trader_postings, seller_id), (stock_postings, stock_id)):
+            positions = postings.get(key)
+            if positions is None:
+                positions = postings[key] = array("i")
+            if not positions or positions[-1] != position:
+                positions.append(position)
+
+    def _intern(self, value: str):
+        index = self._string_indexes.get(value)
+        if index is None:
+            index = self._string_indexes[value] = len(self._strings)
+            self._strings.append(value)
+            self._strings_file.write(json.dumps(value) + "\n")
+        return index
+
+    def append(self, trade_log: TradeLog, fills_from: int):
+        """Archives the fills recorded in the trade log since offset `fills_from` that aren't archived yet.
+
+        Archiving always continues from the last fill archived, so offsets keep lining up.
+        """
+        for offset in range(self.count, trade_log.count):
+            if self.count - self._segments[-1] == self.segment_size:
+                self._seal()
+
+            fields = trade_log.fill(offset)
+            position = self.count - self._segments[-1]
+            # Timestamps are kept in order for the binary search of `query`, even if the trade log's
+            # went back. An empty record has the previous fill's
+            if fields is None:
+                # Overwritten in the trade log before it could be archived, kept as an empty record so offsets line up
+                self._file.write(RECORD.pack(self._last_timestamp, -1, -1, -1, -1, -1, 0.0, 0, 0.0))
+            else:
+                timestamp = self._last_timestamp = max(self._last_timestamp, trade_log.tick(offset)[0])
+                stock_id = self._intern(fields["stock_id"])
+                buyer_id = self._intern(fields["buyer_id"])
+                seller_id = self._intern(fields["seller_id"])
+                self._file.write(RECORD.pack(
+                    timestamp, stock_id, buyer_id, self._intern(fields["buyer_name"]), seller_id,
+                    self._intern(fields["seller_name"]), fields["price"], fields["amount"], fields["total"]
+                ))
+                self._add_postings(position, stock_id, buyer_id, seller_id)
+            self.count += 1
+
+    def _seal(self):
+        """Writes the current segment's index and starts the next segment."""
+        first = self._segments[-1]
+        self._file.close()
+
+        entries = []
+        positions = array("i")
+        for postings in self._postings:
+            for key in sorted(postings):
+                entries.append(INDEX_ENTRY.pack(key, len(positions), len(postings[key])))
+                positions.extend(postings[key])
+        path = _segment_path(self.directory, first, "idx")
+        with open(path + ".tmp", "wb") as file:
+            file.write(INDEX_HEADER.pack(len(self._postings[TRADERS]), len(self._postings[STOCKS])))
+            file.write(b"".join(entries))
+            file.write(positions.tobytes())
+        os.replace(path + ".tmp", path)
+
+        self._segments.append(self.count)
+        self._postings = ({}, {})
+        self._file = open(_segment_path(self.directory, self.count, "seg"), "ab")
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+            self._strings_file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._strings_file.close()
+            self._file = self._strings_file = None
+
+    def query(self, trade_log: TradeLog, kind: int, key: str, start: int, end: int, cursor: int, limit: int):
+        """Returns up to `limit` of a trader's (`TRADERS`) or stock's (`STOCKS`) fills, oldest first, with their offsets.
+
+        Only fills with timestamps in [start, end) (microseconds since the epoch) and offsets
+        from `cursor` on are returned. The cursor to read the next page from is None once
+        there are no more.
+        """
+        fills = []
+        key_index = self._string_indexes.get(key)
+        if key_index is None:
+            return fills, None
+
+        self.flush()
+        with _SegmentReader(self) as reader:
+            # Fills are archived in time order, so the time range is a range of offsets
+            low = max(cursor, reader.first_offset_at(start))
+            high = reader.first_offset_at(end)
+            segment = max(0, bisect_left(self._segments, low + 1) - 1)
+            while segment < len(self._segments) and low < high:
+                first = self._segments[segment]
+                positions = reader.positions(segment, kind, key_index)
+                for index in range(bisect_left(positions, low - first), len(positions)):
+                    offset = first + positions[index]
+                    if offset >= high:
+                        return fills, None
+                    if len(fills) == limit:
+                        return fills, offset
+                    fills.append((offset, trade_log.fill(offset) or reader.fill(offset)))
+                segment += 1
+        return fills, None
+
+    def latest(self, trade_log: TradeLog, trader_id: str, stock_id: str, after: int, before: int, limit: int):
+        """Returns up to `limit` of a trader's fills with offsets in [after, before), newest first, with their offsets.
+
+        With a `stock_id` only the trader's fills of that stock are returned. The second value
+        is whether there are more fills past the last one returned.
+        """
+        fills = []
+        trader_index = self._string_indexes.get(trader_id)
+        stock_index = None if stock_id is None else self._string_indexes.get(stock_id)
+        if trader_index is None or (stock_id is not None and stock_index is None):
+            return fills, False
+
+        self.flush()
+        with _SegmentReader(self) as reader:
+            low, high = after, min(before, self.count)
+            segment = bisect_left(self._segments, high) - 1
+            while segment >= 0 and low < high:
+                first = self._segments[segment]
+                # Filtering by stock walks the shorter of the two postings and looks fills up in the other
+                positions = reader.positions(segment, TRADERS, trader_index)
+                others = None
+                if stock_index is not None:
+                    others = reader.positions(segment, STOCKS, stock_index)
+                    if len(others) < len(positions):
+                        positions, others = others, positions
+                for index in range(bisect_left(positions, high - first) - 1, -1, -1):
+                    position = positions[index]
+                    if first + position < low:
+                        return fills, False
+                    if others is not None:
+                        other = bisect_left(others, position)
+                        if other == len(others) or others[other] != position:
+                            continue
+                    if len(fills) == limit:
+                        return fills, True
+                    offset = first + position
+                    fills.append((offset, trade_log.fill(offset) or reader.fill(offset)))
+                segment -= 1
+        return fills, False
+
+
+class _SegmentReader:
+    """Memory maps of the segments a query reads, unmapped when it's done."""
+
+    def __init__(self, archive: TradeArchive):
+        self.archive = archive
+        self._maps = {}  # segment number -> (data, sealed index or None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for data, index in self._maps.values():
+            if isinstance(data, mmap.mmap):
+                data.close()
+            if index is not None:
+                index.close()
+
+    def _segment(self, segment: int):
+        mapped = self._maps.get(segment)
+        if mapped is None:
+            archive = self.archive
+            first = archive._segments[segment]
+            data = _map(_segment_path(archive.directory, first, "seg"))
+            # The last segment's postings are in memory
+            index = None if segment == len(archive._segments) - 1 else _SealedIndex(_segment_path(archive.directory, first, "idx"))
+            mapped = self._maps[segment] = (data, index)
+        return mapped
+
+    def record(self, offset: int):
+        segment = bisect_left(self.archive._segments, offset + 1) - 1
+        data, _ = self._segment(segment)
+        return RECORD.unpack_from(data, (offset - self.archive._segments[segment]) * RECORD.size)
+
+    def positions(self, segment: int, kind: int, key: int):
+        _, index = self._segment(segment)
+        if index is None:
+            return self.archive._postings[kind].get(key, ())
+        return index.positions(kind, key)
+
+    def first_offset_at(self, timestamp: int):
+        """Returns the offset of the first fill at or after `timestamp`.
+
+        Archived timestamps never decrease, even where the trade log's went back or a fill
+        was lost, so they are searched rather than the trade log's.
+        """
+        low, high = 0, self.archive.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.record(middle)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def fill(self, offset: int):
+        """Returns the fields of the archived fill at the offset as a dict, like `TradeLog.fill`."""
+        timestamp, stock_id, buyer_id, buyer_name, seller_id, seller_name, price, amount, total = self.record(offset)
+        strings = self.archive._strings
+        stock_id = strings[stock_id]
+        return {
+            "id": f"{stock_id}_{EPOCH + timestamp * MICROSECOND}",
+            "buyer_id": strings[buyer_id],
+            "buyer_name": strings[buyer_name],
+            "seller_id": strings[seller_id],
+            "seller_name": strings[seller_name],
+            "stock_id": stock_id,
+            "price": price,
+            "amount": amount,
+            "total": total,
+        }
@@ -0,0 +1,206 @@
+from array import array
+from collections import deque
+from .models import Transaction
+import datetime
+import numpy as np
+
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+# Fills searched at once by `TradeLog.trader_offsets`
+SEARCH_BLOCK_SIZE = 4096
+
+
+class TradeLog:
+    """Fixed-capacity, columnar log of every fill.
+
+    Fills are written into preallocated arrays used as a ring buffer and are addressed by
+    an ever increasing offset. Traders and stocks keep the offsets of their last fills in
+    bounded windows, and `Transaction` models are only built when a window is read.
+    """
+
+    def __init__(self, capacity: int, trader_history_size: int, stock_history_size: int):
+        self.capacity = capacity
+        self.trader_history_size = trader_history_size
+        self.stock_history_size = stock_history_size
+
+        # One column per transaction field, strings are stored as indexes into `_strings`
+        self._timestamps = array("q", [0]) * capacity  # Microseconds since the epoch
+        self._stock_ids = array("i", [0]) * capacity
+        self._buyer_ids = array("i", [0]) * capacity
+        self._buyer_names = array("i", [0]) * capacity
+        self._seller_ids = array("i", [0]) * capacity
+        self._seller_names = array("i", [0]) * capacity
+        self._prices = array("d", [0.0]) * capacity
+        self._amounts = array("q", [0]) * capacity
+        self._totals = array("d", [0.0]) * capacity
+
+        self.clear()
+
+    def clear(self):
+        """Forgets every recorded fill."""
+        self.count = 0  # Total number of fills recorded, the offset of the next fill
+        self.first = 0  # Offset of the first fill recorded, past 0 when the offsets continue the trade archive's
+        self._strings = []
+        self._string_indexes = {}
+        self._trader_windows = {}  # Mapping trader_id to offsets of their last fills
+        self._stock_windows = {}  # Mapping stock_id to offsets of its last fills
+
+    def start_at(self, offset: int):
+        """Makes the offsets of the empty log start at `offset`."""
+        self.first = self.count = offset
+
+    def _intern(self, value: str):
+        index = self._string_indexes.get(value)
+        if index is None:
+            index = self._string_indexes[value] = len(self._strings)
+            self._strings.append(value)
+        return index
+
+    def _window(self, windows: dict, key: str, size: int):
+        window = windows.get(key)
+        if window is None:
+            window = windows[key] = deque(maxlen=size)
+        return window
+
+    def record(self, timestamp: datetime.datetime, stock_id: str, buyer, seller, price: float, amount: int, total: float):
+        """Records a fill and adds it to the buyer's, seller's and stock's windows. Returns its offset."""
+        offset = self.count
+        slot = offset % self.capacity
+
+        self._timestamps[slot] = (timestamp - EPOCH) // MICROSECOND
+        self._stock_ids[slot] = self._intern(stock_id)
+        self._buyer_ids[slot] = self._intern(buyer.id)
+        self._buyer_names[slot] = self._intern(buyer.name)
+        self._seller_ids[slot] = self._intern(seller.id)
+        self._seller_names[slot] = self._intern(seller.name)
+        self._prices[slot] = price
+        self._amounts[slot] = amount
+        self._totals[slot] = total
+        self.count += 1
+
+        self._window(self._trader_windows, buyer.id, self.trader_history_size).append(offset)
+        self._window(self._trader_windows, seller.id, self.trader_history_size).append(offset)
+        self._window(self._stock_windows, stock_id, self.stock_history_size).append(offset)
+        return offset
+
+    def fill(self, offset: int):
+        """Returns the fields of the transaction stored at the offset as a dict, or None if it was overwritten."""
+        if offset < self.first or offset < self.count - self.capacity or offset >= self.count:
+            return None
+
+        slot = offset % self.capacity
+        strings = self._strings
+        stock_id = strings[self._stock_ids[slot]]
+        timestamp = EPOCH + self._timestamps[slot] * MICROSECOND
+        return {
+            "id": f"{stock_id}_{timestamp}",
+            "buyer_id": strings[self._buyer_ids[slot]],
+            "buyer_name": strings[self._buyer_names[slot]],
+            "seller_id": strings[self._seller_ids[slot]],
+            "seller_name": strings[self._seller_names[slot]],
+            "stock_id": stock_id,
+            "price": self._prices[slot],
+            "amount": self._amounts[slot],
+            "total": self._totals[slot],
+        }
+
+    def get(self, offset: int):
+        """Builds the transaction stored at the offset, or returns None if it was overwritten."""
+        fields = self.fill(offset)
+        return None if fields is None else Transaction(**fields)
+
+    def tick(self, offset: int):
+        """Returns the (timestamp in microseconds since the epoch, price, amount) of the fill at the offset, which must not have been overwritten."""
+        slot = offset % self.capacity
+        return self._timestamps[slot], self._prices[slot], self._amounts[slot]
+
+    def participants(self, offset: int):
+        """Returns the (buyer_id, seller_id) of the fill at the offset, which must not have been overwritten."""
+        slot = offset % self.capacity
+        return self._strings[self._buyer_ids[slot]], self._strings[self._seller_ids[slot]]
+
+    def _transactions(self, window):
+        if not window:
+            return []
+        transactions = (self.get(offset) for offset in window)
+        return [transaction for transaction in transactions if transaction is not None]
+
+    def trader_transactions(self, trader_id: str):
+        """Returns the trader's last transactions, oldest first."""
+        return self._transactions(self._trader_windows.get(trader_id))
+
+    def stock_transactions(self, stock_id: str):
+        """Returns the stock's last transactions, oldest first."""
+        return self._transactions(self._stock_windows.get(stock_id))
+
+    def trader_offsets(self, trader_id: str, stock_id: str, after: int, before: int, limit: int):
+        """Returns up to `limit` offsets of the trader's fills still held, in [after, before), newest first.
+
+        With a `stock_id` only the trader's fills of that stock are returned. The second value
+        is whether there are more fills past the last one returned. The columns are searched
+        backwards a block at a time with NumPy, stopping once the page is full.
+        """
+        trader = self._string_indexes.get(trader_id)
+        stock = None if stock_id is None else self._string_indexes.get(stock_id)
+        if trader is None or (stock_id is not None and stock is None):
+            return [], False
+
+        buyers = np.frombuffer(self._buyer_ids, dtype=np.int32)
+        sellers = np.frombuffer(self._seller_ids, dtype=np.int32)
+        stocks = np.frombuffer(self._stock_ids, dtype=np.int32)
+        low, high = max(after, self.count - self.capacity, self.first), min(before, self.count)
+        offsets = []
+        while high > low and len(offsets) <= limit:
+            # A block never wraps around the end of the columns
+            start = max(low, high - SEARCH_BLOCK_SIZE, high - 1 - (high - 1) % self.capacity)
+            first, last = start % self.capacity, (high - 1) % self.capacity + 1
+            matches = (buyers[first:last] == trader) | (sellers[first:last] == trader)
+            if stock is not None:
+                matches &= stocks[first:last] == stock
+            offsets.extend((np.flatnonzero(matches)[::-1] + start).tolist())
+            high = start
+        return offsets[:limit], len(offsets) > limit
+
+    def snapshot(self):
+        """Returns the log's contents as plain data for a snapshot."""
+        return {
+            "capacity": self.capacity,
+            "count": self.count,
+            "first": self.first,
+            "strings": list(self._strings),
+            # Slots past the number of recorded fills are still empty and are left out
+            "columns": [column[:self.count].tobytes() for column in self._columns()],
+            "trader_windows": {key: list(window) for key, window in self._trader_windows.items()},
+            "stock_windows": {key: list(window) for key, window in self._stock_windows.items()},
+        }
+
+    def restore(self, state: dict):
+        """Replaces the log's contents with a snapshot taken by `snapshot`."""
+        self.clear()
+        self.count = state["count"]
+        self.first = state.get("first", 0)  # Left out by older versions
+        self._strings = state["strings"]
+        self._string_indexes = {value: index for index, value in enumerate(self._strings)}
+
+        # Copy every fill still held by the snapshot into its slot, the capacity may have changed
+        capacity = state["capacity"]
+        first = max(self.first, self.count - capacity, self.count - self.capacity)
+        for column, data in zip(self._columns(), state["columns"]):
+            saved = array(column.typecode)
+            saved.frombytes(data)
+            for offset in range(first, self.count):
+                column[offset % self.capacity] = saved[offset % capacity]
+
+        for windows, saved_windows, size in (
+            (self._trader_windows, state["trader_windows"], self.trader_history_size),
+            (self._stock_windows, state["stock_windows"], self.stock_history_size),
+        ):
+            for key, offsets in saved_windows.items():
+                windows[key] = deque(offsets, maxlen=size)
+
+    def _columns(self):
+        return (
+            self._timestamps, self._stock_ids, self._buyer_ids, self._buyer_names, self._seller_ids,
+            self._seller_names, self._prices, self._amounts, self._totals
+        )
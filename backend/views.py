@@ -0,0 +1,228 @@
+from fastapi import HTTPException
+from .database import stocks_db, traders_db, trader_order, order_books, trade_log, candles, portfolios, trade_archive, slow_orders
+from .candles import CANDLE_INTERVALS, to_microseconds
+from .trade_archive import TRADERS, STOCKS
+from .models import Transaction
+import datetime
+from .metrics import all_metrics, book_gauges, collect
+
+# Read-side representations of the in-memory database, returned by the GET endpoints.
+# In sharded mode every engine process builds them for its own stocks (see `backend/sharding.py`).
+
+def stocks_view():
+    return [
+        {
+            **stock.to_model().model_dump(),
+            "open_orders": [order.to_model() for order in order_books[stock.id].orders()],
+            "transactions": trade_log.stock_transactions(stock.id),
+        }
+        for stock in stocks_db.values()
+    ]
+
+def stock_view(stock_id: str):
+    # Fetch stock from in-memory database
+    stock = stocks_db.get(stock_id)
+    
+    if not stock:
+        raise HTTPException(status_code=404, detail="Stock not found")
+    
+    # Create response with stock details, open orders, and the last transactions kept for the stock
+    stock_data = {
+        "id": stock.id,
+        "name": stock.name,
+        "current_price": stock.current_price,
+        "amount": stock.amount,
+        "open_orders": [order.to_model() for order in order_books[stock_id].orders()],
+        "transactions": trade_log.stock_transactions(stock_id),  # Last 10 transactions by default
+    }
+    return stock_data
+
+def depth_view(stock_id: str, levels: int):
+    book = order_books.get(stock_id)
+    if book is None:
+        raise HTTPException(status_code=404, detail="Stock not found")
+
+    # Total amount at each of the best price levels, kept by the book as orders change
+    return {
+        "stock_id": stock_id,
+        "bids": [{"price": price, "amount": amount} for price, amount in book.depth("BUY", levels)],
+        "asks": [{"price": price, "amount": amount} for price, amount in book.depth("SELL", levels)],
+    }
+
+def candles_view(stock_id: str, interval: str, start: datetime.datetime = None, end: datetime.datetime = None):
+    if stock_id not in stocks_db:
+        raise HTTPException(status_code=404, detail="Stock not found")
+    if interval not in CANDLE_INTERVALS:
+        raise HTTPException(status_code=400, detail=f"Interval must be one of {', '.join(CANDLE_INTERVALS)}.")
+
+    return {"stock_id": stock_id, "interval": interval, "candles": candles.bars(stock_id, interval, start, end)}
+
+def history_view(kind: str, key: str, start: datetime.datetime = None, end: datetime.datetime = None, cursor: int = 0, limit: int = 100):
+    """Returns a page of a trader's ("trader") or a stock's ("stock") fills from the trade archive, oldest first.
+
+    The page has the transactions, their offsets and the offset to read the next page
+    from, None once there are no more.
+    """
+    if not trade_archive.enabled:
+        raise HTTPException(status_code=501, detail="The trade archive is disabled, set ARCHIVE_DIR to keep the full history.")
+    if kind == "trader" and key not in traders_db:
+        raise HTTPException(status_code=404, detail="Trader not found")
+    if kind == "stock" and key not in stocks_db:
+        raise HTTPException(status_code=404, detail="Stock not found")
+
+    fills, next_cursor = trade_archive.query(
+        trade_log, TRADERS if kind == "trader" else STOCKS, key,
+        0 if start is None else to_microseconds(start), 2 ** 63 - 1 if end is None else to_microseconds(end),
+        cursor, limit
+    )
+    return {
+        "transactions": [Transaction(**fields) for _, fields in fills],
+        "offsets": [offset for offset, _ in fills],
+        "next_cursor": next_cursor,
+    }
+
+def traders_view():
+    return [
+        {**trader.to_model().model_dump(), "transactions": trade_log.trader_transactions(trader.id)}
+        for trader in traders_db.values()
+    ]
+
+# The fields `/traders` can be projected to, with how each is read from a trader
+TRADER_FIELDS = {
+    "id": lambda trader: trader.id,
+    "name": lambda trader: trader.name,
+    "money": lambda trader: trader.money,
+    "reserved_funds": lambda trader: trader.reserved_funds,
+    "holdings": lambda trader: dict(trader.holdings),
+    "buy_orders": lambda trader: {stock_id: order.to_model() for stock_id, order in trader.buy_orders.items()},
+    "sell_orders": lambda trader: {stock_id: order.to_model() for stock_id, order in trader.sell_orders.items()},
+    "transactions": lambda trader: trade_log.trader_transactions(trader.id),
+}
+
+def traders_page_view(position: int, limit: int, fields: tuple):
+    """Returns `limit` traders from `position` on in the order they were added, with only the given fields.
+
+    The page has the traders and the position to read the next page from, None once there
+    are no more.
+    """
+    getters = [(field, TRADER_FIELDS[field]) for field in fields]
+    traders = [
+        {field: getter(trader) for field, getter in getters}
+        for trader in map(traders_db.__getitem__, trader_order[position:position + limit])
+    ]
+    next_position = position + limit
+    return {"traders": traders, "next_cursor": next_position if next_position < len(trader_order) else None}
+
+def trader_names_view():
+    return {"trader_names": [trader.name for trader in traders_db.values()]}
+
+def trader_view(trader_id: str):
+    trader = traders_db.get(trader_id)
+    if not trader:
+        raise HTTPException(status_code=404, detail="Trader not found")
+
+    return {
+        "name": trader.name,
+        "money": trader.money,
+        "holdings": dict(trader.holdings),
+        "buy_orders": [order.to_model() for order in trader.buy_orders.values()],
+        "sell_orders": [order.to_model() for order in trader.sell_orders.values()],
+    }
+
+def last_transactions_view(trader_id: str):
+    trader = traders_db.get(trader_id)
+    
+    if not trader:
+        raise HTTPException(status_code=404, detail="Trader not found.")
+    
+    # Fetch the last 8 transactions (by default) from the trade log, if fewer transactions are available, return all of them
+    last_transactions = trade_log.trader_transactions(trader_id)
+    
+    return {"trader_id": trader_id, "last_transactions": last_transactions}
+
+def trader_transactions_view(trader_id: str, stock_id: str = None, after: int = 0, before: int = 2 ** 63 - 1, limit: int = 100):
+    """Returns a page of a trader's fills with offsets in [after, before), newest first.
+
+    The fills come from the trade archive, or with it disabled from the trade log, which only
+    holds the last TRADE_LOG_CAPACITY fills of the market. The page has the transactions, their offsets, the `before` cursor to read the older fills
+    from, None once there are no more, and the `after` cursor to read fills newer than the
+    page from.
+    """
+    if trader_id not in traders_db:
+        raise HTTPException(status_code=404, detail="Trader not found.")
+    if stock_id is not None and stock_id not in stocks_db:
+        raise HTTPException(status_code=404, detail="Stock not found")
+
+    if trade_archive.enabled:
+        fills, more = trade_archive.latest(trade_log, trader_id, stock_id, after, before, limit)
+    else:
+        offsets, more = trade_log.trader_offsets(trader_id, stock_id, after, before, limit)
+        fills = [(offset, trade_log.fill(offset)) for offset in offsets]
+    offsets = [offset for offset, _ in fills]
+    return {
+        "transactions": [Transaction(**fields) for _, fields in fills],
+        "offsets": offsets,
+        "before": offsets[-1] if more else None,
+        # Nothing in the range matched, so newer fills are those past it
+        "after": offsets[0] + 1 if offsets else max(after, min(before, trade_log.count)),
+    }
+
+def portfolio_view(trader_id: str):
+    trader = traders_db.get(trader_id)
+    if not trader:
+        raise HTTPException(status_code=404, detail="Trader not found")
+
+    # Positions are valued at the stocks' current prices, against their average cost
+    positions = []
+    for stock_id in trader.holdings:
+        amount, cost = portfolios.position(stock_id, trader_id)
+        price = portfolios.prices[stock_id]
+        positions.append({
+            "stock_id": stock_id,
+            "amount": amount,
+            "average_cost": cost / amount if amount else 0.0,
+            "current_price": price,
+            "market_value": amount * price,
+            "unrealized_pnl": amount * price - cost,
+        })
+    summary = portfolios.summary(trader_id)
+    return {
+        "trader_id": trader_id,
+        "money": trader.money,
+        "net_worth": trader.money + summary["market_value"],
+        **summary,
+        "positions": positions,
+    }
+
+def leaderboard_view(count: int):
+    leaderboard = []
+    for rank, (trader_id, net_worth) in enumerate(portfolios.top(count, traders_db), 1):
+        trader = traders_db[trader_id]
+        leaderboard.append({
+            "rank": rank,
+            "trader_id": trader_id,
+            "name": trader.name,
+            "net_worth": net_worth,
+            "money": trader.money,
+            **portfolios.summary(trader_id),
+        })
+    return leaderboard
+
+def portfolio_changes_view(everyone: bool):
+    # Market values of the traders whose portfolio changed since the last call, or of every trader
+    # holding something, for the leaderboard ranked by the front end in sharded mode
+    changed = portfolios.take_changed()
+    if everyone:
+        return dict(portfolios.values)
+    return {trader_id: portfolios.values.get(trader_id, 0.0) for trader_id in changed}
+
+def portfolio_summaries_view(trader_ids: list):
+    # The traders' market value, cost and P&L, merged with the other engine processes' in sharded mode
+    return [portfolios.summary(trader_id) for trader_id in trader_ids]
+
+def slow_orders_view():
+    return slow_orders.view()
+
+def metrics_view():
+    # Collected as plain data, so engine processes can send theirs to be merged in sharded mode
+    return collect(all_metrics + book_gauges(order_books))
@@ -0,0 +1,97 @@
+"""Compares the engine's slotted domain objects with the pydantic models they replaced.
+
+Run from the repository root:
+
+    python -m benchmarks.domain_objects
+"""
+from backend import domain, models
+from backend.database import load_data, stocks_db, traders_db, order_books, trade_log, portfolios
+from backend.engine import execute_buy_order, execute_sell_order
+import argparse
+import time
+import tracemalloc
+
+
+def time_per_call(function, repeat: int):
+    """Returns the mean time of a call to `function` in microseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def bytes_per_object(create, count: int):
+    """Returns the memory allocated per object created by `create`, in bytes."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [create() for _ in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return (after - before) / count
+
+
+def order_benchmarks(repeat: int):
+    fields = dict(id="1-1-BUY", trader_id="1", stock_id="1", order_type="BUY", price=100.0, amount=10)
+    model_order = models.Order(**fields)
+    domain_order = domain.Order(**fields)
+
+    def update_model():
+        model_order.amount -= 1
+        model_order.amount += 1
+
+    def update_domain():
+        domain_order.amount -= 1
+        domain_order.amount += 1
+
+    return [
+        ("create order (us)", time_per_call(lambda: models.Order(**fields), repeat), time_per_call(lambda: domain.Order(**fields), repeat)),
+        ("order size (bytes)", bytes_per_object(lambda: models.Order(**fields), repeat), bytes_per_object(lambda: domain.Order(**fields), repeat)),
+        ("update order (us)", time_per_call(update_model, repeat), time_per_call(update_domain, repeat)),
+    ]
+
+
+def fill_benchmark(fills: int):
+    """Rests one buy order per trader and sweeps them with a single sell order. Returns microseconds per fill."""
+    load_data()
+    stock_id = next(iter(stocks_db))
+    seller_id = "0"
+    buyer_ids = [trader_id for trader_id in traders_db if trader_id != seller_id]
+
+    # Take the stock market's order out of the way so the buy orders rest, and give it enough shares to sell
+    seller = traders_db[seller_id]
+    order_books[stock_id].remove(seller.sell_orders.pop(stock_id))
+    seller.holdings[stock_id] = max(seller.holdings[stock_id], fills)
+    portfolios.rebuild(stocks_db, traders_db)
+
+    elapsed = 0.0
+    remaining = fills
+    while remaining > 0:
+        count = min(remaining, len(buyer_ids))
+        for buyer_id in buyer_ids[:count]:
+            traders_db[buyer_id].money += 1000.0
+            execute_buy_order(buyer_id, stock_id, 1.0, 1)
+
+        fills_from = trade_log.count
+        start = time.perf_counter()
+        execute_sell_order(seller_id, stock_id, 1.0, count)
+        elapsed += time.perf_counter() - start
+        assert trade_log.count - fills_from == count
+        remaining -= count
+    return elapsed / fills * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=100_000, help="Calls per micro-benchmark")
+    parser.add_argument("--fills", type=int, default=20_000, help="Fills for the matching benchmark")
+    args = parser.parse_args()
+
+    print(f"{'':<22}{'pydantic':>12}{'slotted':>12}{'factor':>10}")
+    for name, model_value, domain_value in order_benchmarks(args.repeat):
+        print(f"{name:<22}{model_value:>12.3f}{domain_value:>12.3f}{model_value / domain_value:>9.1f}x")
+    print(f"matching: {fill_benchmark(args.fills):.2f} us per fill")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Load-generation and latency benchmark for the API and the matching engine.
+
+Run from the repository root, for example:
+
+    python -m benchmarks.suite asgi --requests 20000 --output asgi.json
+    python -m benchmarks.suite direct --requests 20000 --compare asgi-before.json
+    python -m benchmarks.suite asgi --replay recorded.jsonl
+
+The "asgi" mode sends the requests to the FastAPI app in-process through an ASGI client, so
+routing, validation, the sequencer and serialization are included. The "direct" mode calls
+the functions behind each endpoint directly. Both report throughput and p50/p99/p999
+latency per endpoint, and can save the results as JSON and compare them with an earlier run.
+
+Market events, journaling and snapshots are not started, so runs with the same workload
+do the same work.
+"""
+from fastapi import HTTPException
+from backend.main import app, admission
+from backend.database import load_data
+from backend.engine import execute_buy_order, execute_sell_order, execute_cancel_buy_order, execute_cancel_sell_order
+from backend.views import stocks_view, stock_view, traders_view, trader_view, last_transactions_view
+from .workload import provision_market, synthetic_workload, load_workload, save_workload
+import argparse
+import asyncio
+import json
+import time
+
+# Functions behind each endpoint for the direct mode, given the path and query parameters
+DIRECT_HANDLERS = {
+    "POST /place_buy_order": lambda params: execute_buy_order(params["trader_id"], params["stock_id"], float(params["price"]), int(params["amount"])),
+    "POST /place_sell_order": lambda params: execute_sell_order(params["trader_id"], params["stock_id"], float(params["price"]), int(params["amount"])),
+    "DELETE /cancel_buy_order": lambda params: execute_cancel_buy_order(params["trader_id"], params["stock_id"]),
+    "DELETE /cancel_sell_order": lambda params: execute_cancel_sell_order(params["trader_id"], params["stock_id"]),
+    "GET /stocks": lambda params: stocks_view(),
+    "GET /stock/{stock_id}": lambda params: stock_view(params["stock_id"]),
+    "GET /traders": lambda params: traders_view(),
+    "GET /trader/{trader_id}": lambda params: trader_view(params["trader_id"]),
+    "GET /get_last_transactions/{trader_id}": lambda params: last_transactions_view(params["trader_id"]),
+}
+
+
+def resolve_endpoint(method: str, path: str):
+    """Returns the endpoint ("METHOD /route/{param}") serving a request and the path parameters."""
+    for route in app.routes:
+        match = route.path_regex.match(path)
+        if match and method in getattr(route, "methods", ()):
+            return f"{method} {route.path}", match.groupdict()
+    raise ValueError(f"No endpoint serves {method} {path}")
+
+
+def percentile(sorted_values: list, fraction: float):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(latencies: dict, errors: dict, elapsed: float):
+    """Builds per-endpoint results from latencies in seconds."""
+    endpoints = {}
+    for endpoint, values in sorted(latencies.items()):
+        values.sort()
+        endpoints[endpoint] = {
+            "count": len(values),
+            "errors": errors.get(endpoint, 0),
+            "throughput": len(values) / elapsed,
+            "mean_ms": sum(values) / len(values) * 1e3,
+            "p50_ms": percentile(values, 0.5) * 1e3,
+            "p99_ms": percentile(values, 0.99) * 1e3,
+            "p999_ms": percentile(values, 0.999) * 1e3,
+        }
+    total = sum(len(values) for values in latencies.values())
+    return {"elapsed": elapsed, "requests": total, "throughput": total / elapsed, "endpoints": endpoints}
+
+
+def run_direct(requests: list, warmup: int):
+    """Calls the function behind each request's endpoint, one request at a time."""
+    calls = []
+    for request in requests:
+        endpoint, path_params = resolve_endpoint(request["method"], request["path"])
+        if endpoint not in DIRECT_HANDLERS:
+            raise ValueError(f"The direct mode doesn't support {endpoint}")
+        calls.append((endpoint, DIRECT_HANDLERS[endpoint], {**request.get("params", {}), **path_params}))
+
+    latencies = {}
+    errors = {}
+    start = None
+    for position, (endpoint, handler, params) in enumerate(calls):
+        if position == warmup:
+            start = time.perf_counter()
+        request_start = time.perf_counter()
+        try:
+            handler(params)
+        except HTTPException:
+            if position >= warmup:
+                errors[endpoint] = errors.get(endpoint, 0) + 1
+        if position >= warmup:
+            latencies.setdefault(endpoint, []).append(time.perf_counter() - request_start)
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run_asgi(requests: list, warmup: int, concurrency: int):
+    """Sends the requests to the app through an in-process ASGI client from `concurrency` workers."""
+    import httpx
+
+    latencies = {}
+    errors = {}
+    endpoints = [resolve_endpoint(request["method"], request["path"])[0] for request in requests]
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        async def send(position: int):
+            request = requests[position]
+            request_start = time.perf_counter()
+            response = await client.request(request["method"], request["path"], params=request.get("params"), json=request.get("json"))
+            if position >= warmup:
+                endpoint = endpoints[position]
+                latencies.setdefault(endpoint, []).append(time.perf_counter() - request_start)
+                if response.status_code >= 400:
+                    errors[endpoint] = errors.get(endpoint, 0) + 1
+
+        for position in range(min(warmup, len(requests))):
+            await send(position)
+
+        positions = iter(range(warmup, len(requests)))
+
+        async def worker():
+            for position in positions:
+                await send(position)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return summarize(latencies, errors, elapsed)
+
+
+def print_results(results: dict, baseline: dict = None):
+    print(f"{results['requests']} requests in {results['elapsed']:.2f}s, {results['throughput']:.0f} requests/s")
+    header = f"{'endpoint':<40}{'count':>8}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'p999 ms':>10}"
+    if baseline:
+        header += f"{'p50 diff':>10}{'p99 diff':>10}"
+    print(header)
+    for endpoint, stats in results["endpoints"].items():
+        line = (
+            f"{endpoint:<40}{stats['count']:>8}{stats['errors']:>8}{stats['throughput']:>10.0f}"
+            f"{stats['p50_ms']:>10.3f}{stats['p99_ms']:>10.3f}{stats['p999_ms']:>10.3f}"
+        )
+        previous = baseline["endpoints"].get(endpoint) if baseline else None
+        if previous:
+            for key in ("p50_ms", "p99_ms"):
+                line += f"{(stats[key] / previous[key] - 1) * 100:>+9.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("mode", choices=("asgi", "direct"))
+    parser.add_argument("--replay", help="Recorded requests to replay (JSON lines) instead of synthetic order flow")
+    parser.add_argument("--save-workload", help="Write the requests sent to this file, in the format --replay reads")
+    parser.add_argument("--seed-data", action="store_true", help="Run on the seed file's stocks and traders instead of a synthetic market")
+    parser.add_argument("--requests", type=int, default=20_000, help="Number of synthetic requests")
+    parser.add_argument("--traders", type=int, default=100, help="Number of synthetic traders")
+    parser.add_argument("--stocks", type=int, default=20, help="Number of synthetic stocks")
+    parser.add_argument("--crossing-ratio", type=float, default=0.3, help="Share of orders priced to trade")
+    parser.add_argument("--cancel-ratio", type=float, default=0.05, help="Share of requests cancelling an order")
+    parser.add_argument("--read-ratio", type=float, default=0.1, help="Share of requests reading a stock or a trader")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic order flow")
+    parser.add_argument("--warmup", type=int, default=1000, help="Requests sent before measuring")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent clients in asgi mode")
+    parser.add_argument("--admission", action="store_true", help="Keep admission control's limits in asgi mode, the synthetic traders' order rates exceed them")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--compare", help="Compare with results saved by an earlier run")
+    args = parser.parse_args()
+
+    if args.seed_data:
+        load_data()
+    else:
+        provision_market(args.traders, args.stocks)
+    if args.replay:
+        requests = load_workload(args.replay)
+    else:
+        requests = synthetic_workload(
+            args.requests + args.warmup, args.traders, args.stocks, args.crossing_ratio, args.cancel_ratio,
+            args.read_ratio, args.seed
+        )
+    if args.save_workload:
+        save_workload(args.save_workload, requests)
+    warmup = min(args.warmup, len(requests) - 1)
+
+    if not args.admission:
+        # Measure the engine rather than the 429s
+        admission.max_in_flight = admission.max_in_flight_per_stock = admission.trader_rate = 0
+
+    if args.mode == "direct":
+        results = run_direct(requests, warmup)
+    else:
+        results = asyncio.run(run_asgi(requests, warmup, args.concurrency))
+    results["mode"] = args.mode
+    results["config"] = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "save_workload")}
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Workloads for the benchmark suite: a synthetic market, synthetic order flow and recorded traffic.
+
+A workload is a list of requests, each a dict with the HTTP method, the path and the query
+parameters, e.g. {"method": "POST", "path": "/place_buy_order", "params": {...}}. Recorded
+traffic is stored in the same shape, one JSON request per line.
+"""
+from backend.database import load_data, stocks_db, traders_db, trader_order, order_books, response_cache, portfolios, trade_log
+from backend.domain import Stock, Trader, Order
+from backend.order_book import OrderBook
+import json
+import random
+
+MARKET_PRICE = 100.0
+SHARES_PER_TRADER = 1_000_000
+MONEY_PER_TRADER = 1e12
+
+
+def provision_market(trader_count: int, stock_count: int):
+    """Replaces the in-memory database with `stock_count` stocks and `trader_count` traders.
+
+    Stock and trader IDs are "1", "2", ... Every trader has plenty of money and holds
+    `SHARES_PER_TRADER` shares of every stock, and the stock market offers as many at `MARKET_PRICE`.
+    """
+    load_data()
+    stocks_db.clear()
+    traders_db.clear()
+    order_books.clear()
+    response_cache.clear()
+    trade_log.clear()
+
+    stock_ids = [str(index) for index in range(1, stock_count + 1)]
+    for stock_id in stock_ids:
+        stocks_db[stock_id] = Stock(stock_id, f"Stock {stock_id}", MARKET_PRICE, (trader_count + 1) * SHARES_PER_TRADER)
+        order_books[stock_id] = OrderBook(stock_id)
+
+    stock_market = traders_db["0"] = Trader("0", "Stock Market", 0.0)
+    for stock_id in stock_ids:
+        stock_market.holdings[stock_id] = SHARES_PER_TRADER
+        sell_order = Order(f"order_{stock_id}", "0", stock_id, "SELL", MARKET_PRICE, SHARES_PER_TRADER)
+        stock_market.sell_orders[stock_id] = sell_order
+        order_books[stock_id].add(sell_order)
+
+    for index in range(1, trader_count + 1):
+        trader_id = str(index)
+        traders_db[trader_id] = Trader(
+            trader_id, f"Trader {trader_id}", MONEY_PER_TRADER,
+            holdings={stock_id: SHARES_PER_TRADER for stock_id in stock_ids}
+        )
+    trader_order[:] = traders_db
+    portfolios.rebuild(stocks_db, traders_db)
+
+
+def synthetic_workload(request_count: int, trader_count: int, stock_count: int, crossing_ratio: float,
+                       cancel_ratio: float, read_ratio: float, seed: int):
+    """Generates random order flow for a market set up by `provision_market`.
+
+    Each trader only buys or only sells a given stock, so their orders are never rejected for
+    having an order on the other side. A `crossing_ratio` share of the orders is priced to
+    trade against the other side of the book, the rest rest in the book below or above it.
+    """
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(request_count):
+        trader = rng.randint(1, trader_count)
+        stock = rng.randint(1, stock_count)
+        params = {"trader_id": str(trader), "stock_id": str(stock)}
+        buyer = (trader + stock) % 2 == 0
+
+        draw = rng.random()
+        if draw < read_ratio:
+            if rng.random() < 0.5:
+                requests.append({"method": "GET", "path": f"/stock/{stock}", "params": {}})
+            else:
+                requests.append({"method": "GET", "path": f"/trader/{trader}", "params": {}})
+            continue
+        if draw < read_ratio + cancel_ratio:
+            path = "/cancel_buy_order" if buyer else "/cancel_sell_order"
+            requests.append({"method": "DELETE", "path": path, "params": params})
+            continue
+
+        crossing = rng.random() < crossing_ratio
+        if buyer:
+            price = rng.randint(101, 105) if crossing else rng.randint(90, 99)
+            path = "/place_buy_order"
+        else:
+            price = rng.randint(90, 99) if crossing else rng.randint(101, 110)
+            path = "/place_sell_order"
+        requests.append({"method": "POST", "path": path, "params": {**params, "price": price, "amount": rng.randint(1, 10)}})
+    return requests
+
+
+def load_workload(path: str):
+    """Reads recorded requests, one JSON request per line."""
+    with open(path, "r") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def save_workload(path: str, requests: list):
+    with open(path, "w") as file:
+        for request in requests:
+            file.write(json.dumps(request) + "\n")
@@ -0,0 +1,56 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import pytest
+from fastapi import HTTPException
+
+from backend.accounts import AccountService, LOCK_STRIPES
+
+
+def reserve_repeatedly(name: str, locks: list, trader_order: list, results):
+    region = shared_memory.SharedMemory(name)
+    service = AccountService(region, locks, trader_order)
+    results.put(sum(service.reserve("a", 1.0) for _ in range(2000)))
+    service.close()
+
+
+@pytest.fixture
+def service():
+    context = multiprocessing.get_context("spawn")
+    region = shared_memory.SharedMemory(create=True, size=16 * 8)
+    locks = [context.Lock() for _ in range(LOCK_STRIPES)]
+    trader_order = ["a", "b"]
+    service = AccountService(region, locks, trader_order)
+    service.add({"a": (3000.0, 0.0), "b": (10.0, 0.0)})
+    yield service, context, locks, trader_order
+    service.close()
+    region.unlink()
+
+
+def test_reservations_and_changes_are_seen_by_every_process(service):
+    service, context, locks, trader_order = service
+    assert service.reserve("b", 6.0) and not service.reserve("b", 6.0)
+    service.apply([("b", -6.0, -6.0), ("a", 6.0, 0.0)])
+    assert service.balances() == {"a": (3006.0, 0.0), "b": (4.0, 0.0)}
+
+    # Two processes racing for more than the trader has never reserve too much
+    results = context.Queue()
+    processes = [context.Process(target=reserve_repeatedly, args=(service.region.name, locks, trader_order, results)) for _ in range(2)]
+    for process in processes:
+        process.start()
+    reserved = results.get(timeout=60) + results.get(timeout=60)
+    for process in processes:
+        process.join()
+    assert reserved == 3006 and service.balance("a") == (3006.0, 3006.0)
+
+
+def test_new_accounts_are_opened_in_trader_order_up_to_the_capacity(service):
+    service, _, _, trader_order = service
+    trader_order.extend(["c", "d"])
+    service.add({"c": (5.0, 0.0), "d": (7.0, 0.0), "a": (1.0, 1.0)})
+    # Existing accounts are kept
+    assert service.balances(["a", "c", "d"]) == {"a": (3000.0, 0.0), "c": (5.0, 0.0), "d": (7.0, 0.0)}
+    assert service.balance("unknown") is None
+    with pytest.raises(HTTPException) as error:
+        service.check_capacity(5)
+    assert error.value.status_code == 507
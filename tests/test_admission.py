@@ -0,0 +1,63 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from backend.admission import AdmissionControl
+from backend.main import app, admission
+
+
+def rejection(control: AdmissionControl, orders: list):
+    with pytest.raises(HTTPException) as error:
+        control.admit(orders)
+    return error.value
+
+
+def test_in_flight_limits_are_retryable():
+    control = AdmissionControl(max_in_flight=3, max_in_flight_per_stock=2, trader_rate=0, trader_burst=0)
+    control.admit([("1", "A"), ("2", "A")])
+    error = rejection(control, [("3", "A")])
+    assert error.status_code == 429 and error.headers["Retry-After"] == "1"
+
+    control.admit([("3", "B")])
+    error = rejection(control, [("4", "C")])
+    assert error.status_code == 429
+
+    control.release([("1", "A")])
+    control.admit([("3", "A")])
+    assert control.stock_in_flight == {"A": 2, "B": 1}
+
+
+def test_rate_limit_tells_when_to_retry():
+    control = AdmissionControl(max_in_flight=0, max_in_flight_per_stock=0, trader_rate=2, trader_burst=4)
+    control.admit([("1", "A")] * 4)
+    error = rejection(control, [("1", "A")] * 2)
+    assert error.status_code == 429 and error.headers["Retry-After"] == "1"
+    # Other traders have their own bucket
+    control.admit([("2", "A")] * 4)
+
+
+@pytest.mark.parametrize("orders", [
+    [("1", "A")] * 4 + [("2", "B")] * 4,  # More orders than the global limit
+    [(str(index), "A") for index in range(6)],  # More orders for a stock than its limit
+    [("1", str(index)) for index in range(5)],  # More orders of a trader than the burst
+])
+def test_batches_over_a_limit_are_refused_without_retry_after(orders):
+    control = AdmissionControl(max_in_flight=7, max_in_flight_per_stock=5, trader_rate=1, trader_burst=4)
+    error = rejection(control, orders)
+    assert error.status_code == 413 and "Retry-After" not in (error.headers or {})
+    assert control.in_flight == 0 and control.rejections["too_large"] == 1
+
+
+def test_oversized_batch_endpoint_returns_413():
+    with TestClient(app) as client:
+        batch = [
+            {"action": "BUY", "trader_id": str(index % 20 + 1), "stock_id": "1", "price": 1.0, "amount": 1}
+            for index in range(admission.max_in_flight_per_stock + 1)
+        ]
+        response = client.post("/orders/batch", json=batch)
+        assert response.status_code == 413
+        assert "retry-after" not in response.headers
+
+        response = client.post("/orders/batch", json=batch[:admission.max_in_flight_per_stock])
+        assert response.status_code == 200
+        assert len(response.json()["results"]) == admission.max_in_flight_per_stock
@@ -0,0 +1,69 @@
+import random
+
+from backend.candles import Candles, CANDLE_INTERVALS, EPOCH, MICROSECOND
+
+
+def expected_bars(ticks: list, interval: int):
+    """Aggregates the (timestamp, price, volume) ticks into bars by scanning them."""
+    bars = {}
+    for timestamp, price, volume in ticks:
+        start = timestamp - timestamp % interval
+        bar = bars.get(start)
+        if bar is None:
+            bars[start] = {"start": EPOCH + start * MICROSECOND, "open": price, "high": price, "low": price, "close": price, "volume": volume}
+        else:
+            bar["high"] = max(bar["high"], price)
+            bar["low"] = min(bar["low"], price)
+            bar["close"] = price
+            bar["volume"] += volume
+    return list(bars.values())
+
+
+def random_ticks(count: int):
+    random.seed(9)
+    timestamp = 1_700_000_000_000_000
+    ticks = []
+    for _ in range(count):
+        timestamp += random.randint(0, 20_000_000)
+        # Price changes from market events have no volume
+        ticks.append((timestamp, round(random.uniform(90, 110), 2), random.choice([0, 1, 5, 20])))
+    return ticks
+
+
+def test_bars_match_a_scan_of_the_ticks_at_every_interval():
+    ticks = random_ticks(3000)
+    candles = Candles(10_000)
+    for tick in ticks:
+        candles.add("A", *tick)
+    for name, interval in CANDLE_INTERVALS.items():
+        expected = expected_bars(ticks, interval)
+        assert candles.bars("A", name) == expected
+        # Ranges select the bars starting in [start, end)
+        start, end = expected[len(expected) // 3]["start"], expected[2 * len(expected) // 3]["start"]
+        assert candles.bars("A", name, start, end) == [bar for bar in expected if start <= bar["start"] < end]
+    assert candles.bars("B", "1m") == []
+
+
+def test_only_the_latest_bars_are_kept_and_restored():
+    ticks = random_ticks(3000)
+    candles = Candles(100)
+    for tick in ticks:
+        candles.add("A", *tick)
+    expected = expected_bars(ticks, CANDLE_INTERVALS["1s"])
+    assert candles.bars("A", "1s") == expected[-100:]
+    assert candles.bars("A", "1m") == expected_bars(ticks, CANDLE_INTERVALS["1m"])[-100:]
+
+    # A snapshot restored with a smaller capacity keeps the latest bars that fit
+    restored = Candles(40)
+    restored.restore(candles.snapshot())
+    assert restored.bars("A", "1s") == expected[-40:]
+    later = (ticks[-1][0] + 5_000_000, 101.0, 3)
+    restored.add("A", *later)
+    assert restored.bars("A", "1s") == expected_bars(ticks + [later], CANDLE_INTERVALS["1s"])[-40:]
+
+    # And with a larger one, only the bars the snapshot held
+    grown = Candles(300)
+    grown.restore(restored.snapshot())
+    assert grown.bars("A", "1s") == expected_bars(ticks + [later], CANDLE_INTERVALS["1s"])[-40:]
+    grown.add("A", later[0] + 1_000_000, 99.0, 1)
+    assert len(grown.bars("A", "1s")) == 41
@@ -0,0 +1,67 @@
+import random
+
+from fastapi import HTTPException
+
+from backend import database, engine
+from backend.database import traders_db, order_books, trade_log, journal
+
+
+def place_orders(count: int):
+    for index in range(count):
+        trader_id = str(random.randint(1, 20))
+        stock_id = random.choice(["1", "2", "3"])
+        try:
+            if index % 25 == 0:
+                engine.execute_cancel_buy_order(trader_id, stock_id)
+            elif random.random() < 0.5:
+                engine.execute_buy_order(trader_id, stock_id, float(random.randint(100, 400)), random.randint(1, 20))
+            else:
+                engine.execute_sell_order(trader_id, stock_id, float(random.randint(100, 400)), random.randint(1, 20))
+        except HTTPException:
+            pass  # Refused orders aren't journaled
+
+
+def market_state():
+    traders = {
+        trader_id: (
+            trader.money, trader.reserved_funds, dict(trader.holdings),
+            {stock_id: (order.price, order.amount) for stock_id, order in trader.buy_orders.items()},
+            {stock_id: (order.price, order.amount) for stock_id, order in trader.sell_orders.items()},
+        )
+        for trader_id, trader in traders_db.items()
+    }
+    books = {stock_id: (book.best_bid(), book.best_ask()) for stock_id, book in order_books.items()}
+    fills = [trade_log.fill(offset) for offset in range(trade_log.count)]
+    return traders, books, fills
+
+
+def recover(directory: str):
+    database.load_data()
+    engine.recover_from_journal(directory)
+    journal.close()
+    return market_state()
+
+
+def run_market(directory: str, snapshot: bool):
+    random.seed(5)
+    database.load_data()
+    engine.recover_from_journal(directory)
+    place_orders(150)
+    if snapshot:
+        journal.write_snapshot(*engine.take_snapshot())
+    place_orders(150)
+    journal.close()
+    return market_state()
+
+
+def test_replaying_the_journal_recovers_the_market(tmp_path):
+    state = run_market(str(tmp_path), snapshot=False)
+    assert state[2]  # Orders were matched
+    assert recover(str(tmp_path)) == state
+
+
+def test_recovering_from_a_snapshot_and_the_journal_after_it(tmp_path):
+    state = run_market(str(tmp_path), snapshot=True)
+    assert recover(str(tmp_path)) == state
+    # Recovering again from what the first recovery left behaves the same
+    assert recover(str(tmp_path)) == state
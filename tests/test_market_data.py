@@ -0,0 +1,39 @@
+from backend.domain import Order
+from backend.market_data import MarketDataFeed, Relay, Subscriber
+from backend.order_book import OrderBook
+
+
+def test_relayed_updates_reach_the_subscribers_of_their_stock():
+    engine_feed, front_feed = MarketDataFeed(10), MarketDataFeed(10)
+    relay = Relay()
+    engine_feed.subscribe(relay, ["A"])
+    book = OrderBook("A")
+    book.add(Order("1", "t1", "A", "BUY", 9.0, 1))
+
+    engine_feed.publish_trade({"stock_id": "A", "price": 10.0})
+    engine_feed.publish_quote("A", 10.0, book)
+    engine_feed.publish_quote("A", 11.0, book)
+    engine_feed.publish_trade({"stock_id": "B", "price": 1.0})
+    updates = relay.take()
+    # Nothing is conflated or dropped on the way
+    assert [update["type"] for update in updates] == ["trade", "quote", "quote"] and relay.take() == []
+
+    subscriber, other = Subscriber(10), Subscriber(10)
+    front_feed.subscribe(subscriber, ["A"])
+    front_feed.subscribe(other, ["B"])
+    front_feed.publish_updates(updates)
+    assert subscriber._trades[0]["price"] == 10.0
+    assert subscriber._quotes["A"]["last_price"] == 11.0 and subscriber._quotes["A"]["best_bid"] == 9.0
+    assert not other._trades and not other._quotes
+
+
+def test_subscribers_keep_the_latest_quote_and_count_dropped_trades():
+    feed = MarketDataFeed(2)
+    subscriber = Subscriber(2)
+    feed.subscribe(subscriber, ["A"])
+    for price in (1.0, 2.0, 3.0):
+        feed.publish_trade({"stock_id": "A", "price": price})
+        feed.publish_quote("A", price, OrderBook("A"))
+    assert subscriber._dropped_trades == 1
+    assert [trade["price"] for trade in subscriber._trades] == [2.0, 3.0]
+    assert subscriber._quotes["A"]["last_price"] == 3.0
@@ -0,0 +1,70 @@
+import random
+
+from fastapi.testclient import TestClient
+
+from backend.domain import Order
+from backend.main import app
+from backend.order_book import OrderBook
+
+
+def order(order_id: str, order_type: str, price: float, amount: int = 1):
+    return Order(order_id, "t", "S", order_type, price, amount)
+
+
+def test_crossing_orders_come_in_price_then_time_priority():
+    book = OrderBook("S")
+    for order_id, price in [("a", 10.0), ("b", 9.0), ("c", 10.0), ("d", 11.0), ("e", 9.0)]:
+        book.add(order(order_id, "SELL", price))
+    assert book.best_ask() == 9.0
+    assert [o.id for o in book.crossing_sell_orders(10.0, 10)] == ["b", "e", "a", "c"]
+    assert [o.id for o in book.crossing_sell_orders(10.0, 3)] == ["b", "e", "a"]
+
+    for order_id, price in [("f", 5.0), ("g", 6.0), ("h", 5.0)]:
+        book.add(order(order_id, "BUY", price))
+    assert book.best_bid() == 6.0
+    assert [o.id for o in book.crossing_buy_orders(5.0, 10)] == ["g", "f", "h"]
+    assert [o.id for o in book.orders()] == ["g", "f", "h", "b", "e", "a", "c", "d"]
+
+
+def test_removing_and_filling_keep_levels_and_totals():
+    book = OrderBook("S")
+    first, second, third = order("a", "BUY", 5.0, 3), order("b", "BUY", 5.0, 4), order("c", "BUY", 4.0, 2)
+    for resting in (first, second, third):
+        book.add(resting)
+    book.fill(first, 2)
+    assert book.depth("BUY", 5) == [(5.0, 5), (4.0, 2)]
+
+    book.remove(first)
+    book.remove(first)  # Removing twice is harmless
+    assert [o.id for o in book.crossing_buy_orders(4.0, 10)] == ["b", "c"]
+    book.remove(second)
+    assert book.best_bid() == 4.0 and book.depth("BUY", 5) == [(4.0, 2)]
+    assert book.side_depth("BUY") == (1, 1, 2) and len(book) == 1
+
+
+def test_levels_follow_random_adds_and_removes():
+    random.seed(5)
+    book = OrderBook("S")
+    resting = {}
+    for index in range(5000):
+        if resting and random.random() < 0.45:
+            book.remove(resting.pop(random.choice(list(resting))))
+        else:
+            new = order(str(index), "SELL", float(random.randint(1, 300)), random.randint(1, 9))
+            book.add(new)
+            resting[new.id] = new
+        if index % 250 == 0 and resting:
+            totals = {}
+            for o in resting.values():
+                totals[o.price] = totals.get(o.price, 0) + o.amount
+            assert book.depth("SELL", 1000) == sorted(totals.items())
+            assert book.best_ask() == min(totals)
+
+
+def test_stocks_list_their_open_orders():
+    with TestClient(app) as client:
+        response = client.post("/place_buy_order", params={"trader_id": "1", "stock_id": "2", "price": 0.5, "amount": 1})
+        assert response.status_code == 200
+        stocks = {stock["id"]: stock for stock in client.get("/stocks").json()}
+        assert stocks["2"]["open_orders"] == client.get("/stock/2").json()["open_orders"]
+        assert any(o["trader_id"] == "1" and o["price"] == 0.5 for o in stocks["2"]["open_orders"])
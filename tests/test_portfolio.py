@@ -0,0 +1,80 @@
+import random
+import time
+
+from backend.domain import Stock, Trader
+from backend.portfolio import Portfolios, STOCK_MARKET_ID
+
+
+def make_market(trader_count: int, holders_of_first: int):
+    stocks_db = {"1": Stock("1", "One", 10.0, 1000), "2": Stock("2", "Two", 20.0, 1000)}
+    traders_db = {STOCK_MARKET_ID: Trader(STOCK_MARKET_ID, "Stock Market", 0.0)}
+    for index in range(1, trader_count + 1):
+        holdings = {"1": 1} if index <= holders_of_first else {}
+        traders_db[str(index)] = Trader(str(index), f"Trader {index}", float(index % 97), holdings=holdings)
+    portfolios = Portfolios()
+    portfolios.rebuild(stocks_db, traders_db)
+    return stocks_db, traders_db, portfolios
+
+
+def expected_top(traders_db: dict, portfolios: Portfolios, count: int):
+    net_worths = sorted(
+        (-(trader.money + portfolios.values.get(trader_id, 0.0)), trader_id)
+        for trader_id, trader in traders_db.items() if trader_id != STOCK_MARKET_ID
+    )
+    return [(trader_id, -negated) for negated, trader_id in net_worths[:count]]
+
+
+def test_top_follows_fills_and_price_changes():
+    random.seed(7)
+    _, traders_db, portfolios = make_market(300, 150)
+    assert portfolios.top(10, traders_db) == expected_top(traders_db, portfolios, 10)
+
+    for _ in range(500):
+        buyer_id, seller_id = random.sample([trader_id for trader_id in traders_db if trader_id != STOCK_MARKET_ID], 2)
+        if portfolios.position("1", seller_id)[0] > 0:
+            price = random.uniform(5, 15)
+            traders_db[buyer_id].money -= price
+            traders_db[seller_id].money += price
+            portfolios.record_fill("1", buyer_id, seller_id, price, 1)
+        portfolios.set_prices(["1"], [random.uniform(5, 15)])
+        if random.random() < 0.2:
+            assert portfolios.top(20, traders_db) == expected_top(traders_db, portfolios, 20)
+    assert portfolios.top(300, traders_db) == expected_top(traders_db, portfolios, 300)
+
+
+def test_net_worth_returning_to_an_earlier_value_is_ranked_once():
+    _, traders_db, portfolios = make_market(5, 5)
+    portfolios.top(5, traders_db)
+    for price in (12.0, 10.0, 12.0, 10.0):
+        portfolios.set_prices(["1"], [price])
+        top = portfolios.top(5, traders_db)
+        assert len({trader_id for trader_id, _ in top}) == len(top) == 5
+
+
+def test_new_traders_are_ranked():
+    _, traders_db, portfolios = make_market(10, 0)
+    portfolios.top(3, traders_db)
+    traders_db["rich"] = Trader("rich", "Rich", 1e9)
+    portfolios.add_traders(["rich"])
+    assert portfolios.top(1, traders_db) == [("rich", 1e9)]
+
+
+def test_price_change_with_many_holders_does_not_rerank_in_the_matching_path():
+    _, traders_db, portfolios = make_market(100_000, 100_000)
+    portfolios.top(10, traders_db)
+    start = time.perf_counter()
+    portfolios.set_prices(["1"], [11.0])
+    # Only marks the holders, which the first leaderboard read after it re-ranks
+    assert time.perf_counter() - start < 0.5
+    assert portfolios.top(10, traders_db) == expected_top(traders_db, portfolios, 10)
+
+
+def test_selling_shares_the_position_does_not_hold_does_not_raise():
+    _, _, portfolios = make_market(3, 1)
+    # Trader 2 holds none of stock 1 and trader 1 only one share
+    portfolios.record_fill("1", "3", "2", 12.0, 2)
+    portfolios.record_fill("1", "3", "1", 12.0, 4)
+    assert portfolios.position("1", "1") == (0, 0.0) and portfolios.position("1", "2") == (0, 0.0)
+    assert portfolios.position("1", "3") == (6, 72.0)
+    assert portfolios.summary("1") == {"market_value": 0.0, "cost": 0.0, "realized_pnl": 38.0, "unrealized_pnl": 0.0}
+    assert portfolios.summary("2")["market_value"] == 0.0
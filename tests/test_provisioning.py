@@ -0,0 +1,59 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from backend.main import app
+from backend.provisioning import stock_rows, trader_columns
+
+
+def trader(number: int, money):
+    return {"id": f"p{number}", "name": f"Trader {number}", "money": money}
+
+
+def test_trader_columns_convert_money_to_floats():
+    assert trader_columns([trader(1, 5), trader(2, 2.5), trader(3, 0)], 0) == (["p1", "p2", "p3"], ["Trader 1", "Trader 2", "Trader 3"], [5.0, 2.5, 0.0])
+
+
+@pytest.mark.parametrize("money", ["12", -5, True, None, float("nan"), float("inf")])
+def test_invalid_money_is_refused_with_its_record_number(money):
+    with pytest.raises(HTTPException) as error:
+        trader_columns([trader(1, 1), trader(2, money)], 10)
+    assert error.value.status_code == 400 and error.value.detail.startswith("Record 12:")
+
+
+def test_records_missing_a_field_are_refused():
+    with pytest.raises(HTTPException) as error:
+        trader_columns([trader(1, 1), {"id": "p2", "money": 1}], 0)
+    assert error.value.detail.startswith("Record 2: 'name'")
+
+
+@pytest.mark.parametrize("stock", [
+    {"id": "s", "name": "S", "currentPrice": 0, "amount": 1},
+    {"id": "s", "name": "S", "currentPrice": 1.0, "amount": -1},
+    {"id": "s", "name": "S", "currentPrice": 1.0, "amount": 0},
+    {"id": "s", "name": "S", "currentPrice": 1.0, "amount": 1.5},
+    {"id": "s", "name": "S", "currentPrice": float("nan"), "amount": 1},
+])
+def test_invalid_stocks_are_refused(stock):
+    with pytest.raises(HTTPException):
+        stock_rows([stock], 0)
+
+
+def test_import_stops_at_the_first_invalid_record():
+    body = "".join(json.dumps(record) + "\n" for record in [trader(101, 1), trader(102, "12"), trader(103, 1)])
+    with TestClient(app) as client:
+        response = client.post("/admin/traders", content=body.encode())
+        assert response.status_code == 400 and "Record 2" in response.json()["detail"]
+        # The whole chunk is refused
+        assert client.get("/trader/p101").status_code == 404
+        assert client.get("/trader/p103").status_code == 404
+
+
+def test_stocks_without_shares_are_refused_before_any_order():
+    body = json.dumps({"id": "empty", "name": "Empty", "currentPrice": 10.0, "amount": 0}).encode()
+    with TestClient(app) as client:
+        response = client.post("/admin/stocks", content=body)
+        assert response.status_code == 400 and "Record 1" in response.json()["detail"]
+        assert client.get("/stock/empty").status_code == 404
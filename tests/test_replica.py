@@ -0,0 +1,84 @@
+import json
+import multiprocessing
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import database
+from backend.database import traders_db, response_cache
+from backend.main import app
+from backend.replica import ReplicaMiddleware, ReplicaPublisher, ReplicaReader
+from backend.serialization import encode
+from backend.views import trader_view, stocks_view
+
+
+def read_repeatedly(name: str, reads: int, results):
+    """Reads trader 1 and reports the reads whose body isn't the one published with their version."""
+    reader = ReplicaReader(name)
+    mismatches = []
+    for _ in range(reads):
+        response = reader.get("trader/1")
+        if response is not None:
+            version, _, body = response
+            money = json.loads(body)["money"]
+            if money != float(version):
+                mismatches.append((version, money))
+    reader.close()
+    results.put(mismatches)
+
+
+@pytest.fixture
+def publisher():
+    database.load_data()
+    # Small enough that publishing rebuilds the buffers now and then
+    publisher = ReplicaPublisher(f"burse-test-{os.getpid()}", 64 * 1024)
+    publisher.open()
+    yield publisher
+    publisher.close()
+    # Trader 1's money was replaced, later tests start from the seed again
+    database.load_data()
+
+
+def publish_money(publisher: ReplicaPublisher):
+    # The body published with each version holds the version as the trader's money
+    traders_db["1"].money = float(publisher.version + 1)
+    response_cache.bump("trader", "1")
+    publisher.publish()
+
+
+def test_readers_get_the_published_bodies(publisher):
+    reader = ReplicaReader(publisher.name)
+    for _ in range(50):
+        publish_money(publisher)
+        version, etag, body = reader.get("trader/1")
+        assert version == publisher.version and body == encode(trader_view("1"))
+        assert reader.get("stocks")[2] == encode(stocks_view())
+    assert reader.get("trader/unknown") == (publisher.version, None, None)
+    reader.close()
+
+
+def test_a_reader_never_sees_a_body_from_another_version(publisher):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=read_repeatedly, args=(publisher.name, 20_000, results))
+    process.start()
+    while process.is_alive() and results.empty():
+        publish_money(publisher)
+    assert results.get(timeout=60) == []
+    process.join()
+
+
+def test_replicas_answer_like_the_primary_in_both_formats(publisher):
+    reader = ReplicaReader(publisher.name)
+    replica = TestClient(ReplicaMiddleware(None, reader))
+    with TestClient(app) as primary:
+        publish_money(publisher)
+        for accept in ("application/json", "application/msgpack"):
+            expected = primary.get("/trader/1", headers={"Accept": accept})
+            response = replica.get("/trader/1", headers={"Accept": accept})
+            assert response.content == expected.content
+            for header in ("ETag", "Content-Type", "Vary"):
+                assert response.headers[header] == expected.headers[header]
+            assert replica.get("/trader/1", headers={"Accept": accept, "If-None-Match": expected.headers["ETag"]}).status_code == 304
+    reader.close()
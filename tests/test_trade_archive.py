@@ -0,0 +1,152 @@
+import datetime
+import random
+
+from backend import clock as clock_module
+from backend.domain import Trader
+from backend.trade_archive import TradeArchive, TRADERS, STOCKS, _SegmentReader
+from backend.trade_log import TradeLog, EPOCH, MICROSECOND
+
+TRADERS_LIST = [Trader(str(index), f"Trader {index}", 0.0) for index in range(4)]
+START = datetime.datetime(2024, 1, 1)
+
+
+def microseconds(seconds: int):
+    return (START + datetime.timedelta(seconds=seconds) - EPOCH) // MICROSECOND
+
+
+class Market:
+    """A trade log and an archive, with the fills expected in the archive."""
+
+    def __init__(self, directory):
+        random.seed(11)
+        self.trade_log = TradeLog(20, 8, 8)
+        self.archive = TradeArchive(7)
+        self.archive.open(str(directory), self.trade_log)
+        self.fills = []  # (buyer_id, seller_id, stock_id, timestamp), None where only a placeholder is archived
+        self.seconds = 0
+
+    def record(self, count: int, archive: bool = True, step: int = 1):
+        for _ in range(count):
+            self.seconds += step
+            buyer, seller = random.sample(TRADERS_LIST, 2)
+            stock_id = random.choice("AB")
+            offset = self.trade_log.record(START + datetime.timedelta(seconds=self.seconds), stock_id, buyer, seller, 1.0, 1, 1.0)
+            self.fills.append((buyer.id, seller.id, stock_id, microseconds(self.seconds)))
+            if archive:
+                self.append()
+
+    def append(self):
+        # Fills the trade log no longer holds are archived as placeholders
+        for offset in range(self.archive.count, self.trade_log.count - self.trade_log.capacity):
+            self.fills[offset] = None
+        self.archive.append(self.trade_log, self.archive.count)
+
+    def archive_all(self):
+        """Archives the fills not archived yet, and works out the timestamps they should be archived with."""
+        self.append()
+        self.archive.flush()
+        last = 0
+        for offset, fill in enumerate(self.fills):
+            if fill is not None:
+                last = max(last, fill[3])
+                self.fills[offset] = fill[:3] + (last,)
+
+
+def test_time_ranges_and_cursors_skip_placeholders_and_a_clock_going_back(tmp_path):
+    market = Market(tmp_path)
+    market.record(12)
+    market.record(3, step=-5)  # The clock went back
+    market.record(30, archive=False)  # 10 fills are overwritten before they're archived
+    market.record(10)
+    market.archive_all()
+
+    timestamps = [fill[3] for fill in market.fills if fill is not None]
+    assert timestamps == sorted(timestamps)
+    with _SegmentReader(market.archive) as reader:
+        for offset, fill in enumerate(market.fills):
+            if fill is None:
+                # Placeholders carry the previous fill's timestamp, so the search passes over them
+                assert reader.record(offset)[0] == max([0] + [f[3] for f in market.fills[:offset] if f is not None])
+
+    for kind, key in [(TRADERS, "1"), (STOCKS, "A")]:
+        for start, end in [(0, 2 ** 62), (microseconds(5), microseconds(40)), (microseconds(20), microseconds(21))]:
+            expected = [
+                offset for offset, fill in enumerate(market.fills)
+                if fill is not None and start <= fill[3] < end and key in ((fill[0], fill[1]) if kind == TRADERS else (fill[2],))
+            ]
+            offsets, cursor = [], 0
+            while cursor is not None:
+                page, cursor = market.archive.query(market.trade_log, kind, key, start, end, cursor, 3)
+                assert len(page) <= 3
+                offsets.extend(offset for offset, _ in page)
+            assert offsets == expected
+
+
+def test_latest_pages_newest_first_with_a_stock_filter(tmp_path):
+    market = Market(tmp_path)
+    market.record(60)
+    market.archive_all()
+    for stock_id in (None, "B"):
+        expected = [
+            offset for offset, fill in reversed(list(enumerate(market.fills)))
+            if "2" in fill[:2] and stock_id in (None, fill[2])
+        ]
+        offsets, before, more = [], 2 ** 63, True
+        while more:
+            page, more = market.archive.latest(market.trade_log, "2", stock_id, 0, before, 4)
+            offsets.extend(offset for offset, _ in page)
+            before = page[-1][0] if page else 0
+        assert offsets == expected
+        fills, _ = market.archive.latest(market.trade_log, "2", stock_id, expected[3], 2 ** 63, 100)
+        assert [offset for offset, _ in fills] == expected[:4]
+
+
+def test_reopened_archive_keeps_timestamps_in_order(tmp_path):
+    market = Market(tmp_path)
+    market.record(10)
+    market.archive.close()
+    market.archive = TradeArchive(7)
+    market.archive.open(str(tmp_path), market.trade_log)
+    market.record(1, step=-100)
+    market.archive.flush()
+    with _SegmentReader(market.archive) as reader:
+        assert reader.record(10)[0] == reader.record(9)[0] == microseconds(10)
+    market.archive.close()
+
+
+def test_an_empty_trade_log_continues_after_the_archived_fills(tmp_path):
+    market = Market(tmp_path)
+    market.record(20)
+    market.archive.close()
+    # Restarted without a journal, the trade log starts empty
+    market.trade_log = TradeLog(20, 8, 8)
+    market.archive = TradeArchive(7)
+    market.archive.open(str(tmp_path), market.trade_log)
+    assert market.trade_log.first == market.trade_log.count == market.archive.count == 20
+    market.record(5)
+    market.archive_all()
+
+    offsets, cursor = [], 0
+    while cursor is not None:
+        page, cursor = market.archive.query(market.trade_log, TRADERS, "1", 0, 2 ** 62, cursor, 4)
+        offsets.extend(offset for offset, _ in page)
+    assert offsets == [offset for offset, fill in enumerate(market.fills) if "1" in fill[:2]]
+
+    # Offsets before the first fill aren't held, also once restored from a snapshot
+    restored = TradeLog(20, 8, 8)
+    restored.restore(market.trade_log.snapshot())
+    assert restored.fill(19) is None and restored.fill(20) == market.trade_log.fill(20)
+    market.archive.close()
+
+
+def test_clock_never_goes_back(monkeypatch):
+    readings = iter([START, START - datetime.timedelta(hours=1), START + datetime.timedelta(seconds=1)])
+
+    class SystemTime(datetime.datetime):
+        @classmethod
+        def now(cls):
+            return next(readings)
+
+    monkeypatch.setattr(clock_module.datetime, "datetime", SystemTime)
+    clock = clock_module.Clock()
+    assert [clock.now() for _ in range(3)] == [START, START, START + datetime.timedelta(seconds=1)]
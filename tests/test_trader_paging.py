@@ -0,0 +1,50 @@
+import datetime
+import random
+
+from fastapi.testclient import TestClient
+
+from backend.domain import Trader
+from backend.main import app
+from backend.trade_log import TradeLog
+
+TRADERS = [Trader(str(index), f"Trader {index}", 0.0) for index in range(5)]
+
+
+def fill_log(capacity: int, fill_count: int):
+    random.seed(3)
+    trade_log = TradeLog(capacity, 8, 8)
+    fills = []
+    for index in range(fill_count):
+        buyer, seller = random.sample(TRADERS, 2)
+        stock_id = random.choice("AB")
+        trade_log.record(datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=index), stock_id, buyer, seller, 1.0, 1, 1.0)
+        fills.append((buyer.id, seller.id, stock_id))
+    return trade_log, fills
+
+
+def test_trader_offsets_match_a_scan_of_the_held_fills():
+    trade_log, fills = fill_log(capacity=5000, fill_count=12_345)
+    for trader_id, stock_id, after, before, limit in [
+        ("1", None, 0, 2 ** 63, 100), ("2", "A", 0, 2 ** 63, 7000), ("3", "B", 9000, 11_000, 50), ("4", None, 0, 8000, 10),
+    ]:
+        expected = [
+            offset for offset in reversed(range(max(after, len(fills) - 5000), min(before, len(fills))))
+            if trader_id in fills[offset][:2] and stock_id in (None, fills[offset][2])
+        ]
+        offsets, more = trade_log.trader_offsets(trader_id, stock_id, after, before, limit)
+        assert offsets == expected[:limit] and more == (len(expected) > limit)
+    assert trade_log.trader_offsets("unknown", None, 0, 2 ** 63, 10) == ([], False)
+
+
+def test_transactions_are_paged_from_the_trade_log_without_the_archive():
+    with TestClient(app) as client:
+        assert client.get("/history/trader/1").status_code == 501
+        for _ in range(3):
+            response = client.post("/place_buy_order", params={"trader_id": "1", "stock_id": "1", "price": 1000, "amount": 1})
+            assert response.status_code == 200
+
+        page = client.get("/trader/1/transactions", params={"limit": 2}).json()
+        assert len(page["transactions"]) == 2 and page["before"] is not None
+        older = client.get("/trader/1/transactions", params={"limit": 2, "before": page["before"]}).json()
+        assert older["transactions"] and older["transactions"][0] not in page["transactions"]
+        assert client.get("/trader/1/transactions", params={"after": page["after"]}).json()["transactions"] == []